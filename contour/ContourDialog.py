@@ -30,7 +30,10 @@ from . import resources
 from . import ContourMethod
 from .ContourMethod import ContourMethodError
 from .ContourGenerator import ContourGenerator, ContourType, ContourExtendOption
+from .ContourGenerator import ContourValueSource
 from .ContourGenerator import ContourError, ContourGenerationError
+from .ContourLayerRegistry import ContourLayerRegistry
+from .ContourPreview import ContourPreview
 
 import sys
 import os.path
@@ -63,6 +66,7 @@ class ContourDialogPlugin:
 
     def __init__(self, iface):
         self._iface = iface
+        self._registry = None
 
     def initGui(self):
         if not mplAvailable:
@@ -87,6 +91,7 @@ class ContourDialogPlugin:
         self.action.triggered.connect(self.run)
         self._iface.addToolBarIcon(self.action)
         self._iface.vectorMenu().addAction(self.action)
+        self._registry = ContourLayerRegistry()
 
     def unload(self):
         try:
@@ -95,11 +100,17 @@ class ContourDialogPlugin:
             self._iface.removeToolBarIcon(self.action)
         except:
             pass
+        if self._registry is not None:
+            self._registry.release()
+            self._registry = None
 
     def run(self):
         try:
-            dlg = ContourDialog(self._iface)
-            dlg.exec_()
+            dlg = ContourDialog(self._iface, self._registry)
+            try:
+                dlg.exec_()
+            finally:
+                dlg.release()
         except ContourError:
             QMessageBox.warning(
                 self._iface.mainWindow(), tr("Contour error"), str(sys.exc_info()[1])
@@ -108,35 +119,64 @@ class ContourDialogPlugin:
 
 class ContourDialog(QDialog, Ui_ContourDialog):
 
+    # Delay in milliseconds after the last change of the data settings
+    # before the data are reloaded
+
+    ReloadDelay = 300
+
+    # Number of contour features written to the layer provider at a time
+
+    WriteBatchSize = 1000
+
     class Feedback:
 
         def __init__(self, messagebar, progress):
             self._messageBar = messagebar
             self._progress = progress
+            self._interruptible = False
+            self._canceled = False
 
         def isCanceled(self):
-            return False
+            return self._canceled
+
+        def cancel(self):
+            self._canceled = True
+
+        def setInterruptible(self, interruptible):
+            # While interruptible progress updates process pending events,
+            # so that changes in the dialog can cancel the operation
+            self._interruptible = interruptible
+            self._canceled = False
 
         def setProgress(self, percent):
-            if self._progress:
+            if self._progress and percent != self._progress.value():
                 self._progress.setValue(percent)
+                if self._interruptible:
+                    QCoreApplication.processEvents()
 
         def pushInfo(self, info):
             self._messageBar.pushInfo("", info)
 
         def reportError(self, message, fatal=False):
+            if self._canceled:
+                return
             self._messageBar.pushWarning(
                 tr("Error") if fatal else tr("Warning"), message
             )
 
-    def __init__(self, iface):
+    def __init__(self, iface, registry=None):
         QDialog.__init__(self)
         self._iface = iface
+        self._ownRegistry = registry is None
+        self._registry = registry or ContourLayerRegistry()
         self._origin = None
         self._loadedDataDef = None
         self._layer = None
         self._zField = ""
+        self._valueSource = ContourValueSource.field
         self._loadingLayer = False
+        self._reloading = False
+        self._afterReload = None
         self._contourId = ""
         self._replaceLayerSet = None
         self._canEditList = False
@@ -167,23 +207,35 @@ class ContourDialog(QDialog, Ui_ContourDialog):
             self.uMethod.addItem(method.name, method.id)
         for option in ContourExtendOption.options():
             self.uExtend.addItem(ContourExtendOption.description(option), option)
+        for source in ContourValueSource.sources():
+            self.uValueSource.addItem(ContourValueSource.description(source), source)
 
         self._feedback = ContourDialog.Feedback(self.uMessageBar, self.progressBar)
+        self._reloadTimer = QTimer(self)
+        self._reloadTimer.setSingleShot(True)
+        self._reloadTimer.timeout.connect(self.scheduledReload)
         self._generator = ContourGenerator(feedback=self._feedback)
+        # Keep the points of the whole layer, where that pays off and fits
+        # in memory, so that changing the selected features does not reread
+        # the layer
+        self._generator.setLayerCache(True)
 
         self.loadSettings()
 
         mapCanvas = self._iface.mapCanvas()
+        self._preview = ContourPreview(mapCanvas, self._generator)
+        self._preview.setColorFunction(self.previewColor)
         self.enableContourParams()
         self.enableOkButton()
 
         # Signals
         self.uSourceLayer.layerChanged.connect(self.uSourceLayerChanged)
         self.uDataField.fieldChanged["QString"].connect(self.uDataFieldUpdate)
-        self.uSelectedOnly.toggled.connect(self.reloadData)
+        self.uValueSource.currentIndexChanged[int].connect(self.uValueSourceChanged)
+        self.uSelectedOnly.toggled.connect(self.scheduleReload)
         self.uUseGrid.toggled.connect(self._generator.setUseGrid)
-        self.uRemoveDuplicates.toggled.connect(self.reloadData)
-        self.uDuplicateTolerance.valueChanged[float].connect(self.reloadData)
+        self.uRemoveDuplicates.toggled.connect(self.scheduleReload)
+        self.uDuplicateTolerance.valueChanged[float].connect(self.scheduleReload)
         self.uContourInterval.valueChanged[float].connect(self.computeLevels)
         self.uSetMinimum.toggled[bool].connect(self.toggleSetMinimum)
         self.uSetMaximum.toggled[bool].connect(self.toggleSetMaximum)
@@ -202,6 +254,11 @@ class ContourDialog(QDialog, Ui_ContourDialog):
         self.uFilledContours.toggled[bool].connect(self.modeToggled)
         self.uBoth.toggled[bool].connect(self.modeToggled)
         self.uLayerContours.toggled[bool].connect(self.modeToggled)
+        self.uExtend.currentIndexChanged[int].connect(self._preview.schedule)
+        self.uUseGrid.toggled.connect(self._preview.schedule)
+        self.uApplyColors.toggled.connect(self._preview.schedule)
+        self.uReverseRamp.toggled.connect(self._preview.schedule)
+        self.uPreview.toggled[bool].connect(self._preview.setEnabled)
 
         # populate layer list
         if self.uSourceLayer.count() <= 0:
@@ -228,10 +285,51 @@ class ContourDialog(QDialog, Ui_ContourDialog):
     def adviseUser(self, message):
         self._feedback.pushInfo(message)
 
+    def _deferWhileReloading(self, action):
+        # Events are processed while the data are reloading, so the dialog
+        # may be closed or released with the reload still on the stack.  In
+        # that case the reload is cancelled and action is run when it has
+        # finished.  Returns True if the action is deferred.
+        if not self._reloading:
+            return False
+        self._afterReload = action
+        self._feedback.cancel()
+        return True
+
     def closeDialog(self):
+        if self._deferWhileReloading(self.closeDialog):
+            return
         self.saveSettings()
+        self.clearPreview()
         self.close()
 
+    def reject(self):
+        if self._deferWhileReloading(self.reject):
+            return
+        QDialog.reject(self)
+
+    def clearPreview(self):
+        self.uPreview.setChecked(False)
+        self._preview.setEnabled(False)
+
+    def release(self):
+        if self._deferWhileReloading(self.release):
+            return
+        self.clearPreview()
+        self._connectLayer(self._layer, False)
+        self._generator.release()
+        if self._ownRegistry:
+            self._registry.release()
+
+    def previewColor(self, i, nLevels):
+        ramp = self.uColorRamp.colorRamp()
+        if not self.uApplyColors.isChecked() or ramp is None or nLevels < 2:
+            return None
+        rampvalue = float(i) / (nLevels - 1)
+        if self.uReverseRamp.isChecked():
+            rampvalue = 1.0 - rampvalue
+        return ramp.color(rampvalue)
+
     def _isMPLOk(self):
         """
         Check if matplotlib version > 1.0.0 for contouring fonctions selection
@@ -248,12 +346,12 @@ class ContourDialog(QDialog, Ui_ContourDialog):
         self.uMaxContour.setDecimals(ndp)
         self.uContourInterval.setDecimals(ndp)
         self.uContourInterval.setDecimals(ndp)
-        x, y, z = self._generator.data()
-        if z is not None:
+        zmin, zmax = self.zRange()
+        if zmin is not None:
             if not self.uSetMinimum.isChecked():
-                self.uMinContour.setValue(np.min(z))
+                self.uMinContour.setValue(zmin)
             if not self.uSetMaximum.isChecked():
-                self.uMaxContour.setValue(np.max(z))
+                self.uMaxContour.setValue(zmax)
             self.showLevels()
 
     def _getOptionalValue(self, properties, name, typefunc):
@@ -287,7 +385,13 @@ class ContourDialog(QDialog, Ui_ContourDialog):
         layerSet = self.contourLayerSet(contourId)
         try:
             attr = properties.get("SourceLayerAttr")
-            self.uDataField.setField(attr)
+            if ContourValueSource.fieldName(attr) is not None:
+                self.uValueSource.setCurrentIndex(self.uValueSource.findData(attr))
+            else:
+                self.uValueSource.setCurrentIndex(
+                    self.uValueSource.findData(ContourValueSource.field)
+                )
+                self.uDataField.setField(attr)
             if FILLED in layerSet:
                 if LINES in layerSet:
                     self.uBoth.setChecked(True)
@@ -339,10 +443,43 @@ class ContourDialog(QDialog, Ui_ContourDialog):
             pass
         self._replaceLayerSet = layerSet
 
+    def _connectLayer(self, layer, connect):
+        # Connect or disconnect the signals of the source layer
+        if layer is None:
+            return
+        signals = (
+            (layer.dataChanged, self._generator.clearLayerCache),
+            (layer.selectionChanged, self.layerSelectionChanged),
+        )
+        for signal, slot in signals:
+            try:
+                if connect:
+                    signal.connect(slot)
+                else:
+                    signal.disconnect(slot)
+            except (TypeError, RuntimeError):
+                pass
+
+    def layerSelectionChanged(self, *args):
+        haveSelected = self._layer is not None and (
+            self._layer.selectedFeatureCount() > 0
+        )
+        self.uSelectedOnly.setEnabled(haveSelected)
+        if not self.uSelectedOnly.isChecked():
+            return
+        if haveSelected:
+            self.scheduleReload()
+        else:
+            # Toggling reloads the data
+            self.uSelectedOnly.setChecked(False)
+
     def uSourceLayerChanged(self, layer):
         if self._loadingLayer:
             return
         self._replaceLayerSet = None
+        if layer is not self._layer:
+            self._connectLayer(self._layer, False)
+            self._connectLayer(layer, True)
         self._layer = layer
         self.uLayerDescription.setText("")
         self.uDataField.setLayer(layer)
@@ -358,55 +495,69 @@ class ContourDialog(QDialog, Ui_ContourDialog):
             finally:
                 self._loadingLayer = False
         self.enableOkButton()
+        self.scheduleReload()
 
     def uDataFieldUpdate(self, inputField):
         self._zField, isExpression, isValid = self.uDataField.currentField()
+        self.scheduleReload()
+
+    def uValueSourceChanged(self, index):
+        valueSource = self.uValueSource.itemData(index)
+        if not ContourValueSource.valid(valueSource):
+            return
+        self._valueSource = valueSource
+        self.uDataField.setEnabled(valueSource == ContourValueSource.field)
+        self.scheduleReload()
+
+    def _hasValueSource(self):
+        return self._valueSource != ContourValueSource.field or bool(self._zField)
+
+    def _sourceAttr(self):
+        # The field or expression contoured, or the value source if the
+        # values are from the geometry
+        if self._valueSource != ContourValueSource.field:
+            return self._valueSource
+        return self._zField
+
+    def scheduleReload(self, *args):
+        """
+        Reload the data once the data settings have not changed for
+        ReloadDelay milliseconds, cancelling any reload in progress.
+        """
+        if self._reloading:
+            self._feedback.cancel()
+        elif self._loadingLayer:
+            return
+        self._reloadTimer.start(self.ReloadDelay)
+
+    def scheduledReload(self):
+        if self._reloading:
+            self._reloadTimer.start(self.ReloadDelay)
+            return
         self.reloadData()
 
-    def dataChanged(self):
-        x, y, z = self._generator.data()
-        if z is not None:
-            zmin = np.min(z)
-            zmax = np.max(z)
-            ndp = self.uPrecision.value()
-            if zmax - zmin > 0:
-                ndp2 = ndp
-                while 10 ** (-ndp2) > (zmax - zmin) / 100 and ndp2 < 10:
-                    ndp2 += 1
-                if ndp2 != ndp:
-                    self.uPrecision.setValue(ndp2)
-                    self.adviseUser(
-                        tr(
-                            "Resetting the label precision to match range of data values"
-                        )
-                    )
-            if not self.uSetMinimum.isChecked():
-                self.uMinContour.setValue(zmin)
-            if not self.uSetMaximum.isChecked():
-                self.uMaxContour.setValue(zmax)
-            gridded = self._generator.isGridded()
-            self.uUseGrid.setEnabled(gridded)
-            self.uUseGrid.setChecked(gridded)
-            self.uUseGridLabel.setEnabled(gridded)
-            description = tr("Contouring {0} points").format(len(z))
-            if gridshape is not None:
-                description = description + tr(" in a {0} x {1} grid").format(
-                    *gridshape
-                )
-            else:
-                description = description + " (" + tr("not in regular grid") + ")"
-            self.uLayerDescription.setText(description)
-        else:
-            self.uLayerDescription.setText(tr("No data selected for contouring"))
+    def flushReload(self):
+        # Apply a scheduled reload immediately
+        if self._reloadTimer.isActive():
+            self.reloadData()
 
     def reloadData(self):
-        if self._loadingLayer:
+        if self._reloading:
+            # Called while processing events during a reload - restart it
+            # with the current settings
+            self.scheduleReload()
             return
-        self._loadingLayer = True
+        self._reloadTimer.stop()
+        self._reloading = True
+        self.uAddButton.setEnabled(False)
+        self._preview.suspend(True)
+        self._feedback.setInterruptible(True)
+        canceled = False
         try:
             fids = None
             if self._layer is not None and self.uSelectedOnly.isChecked():
                 fids = self._layer.selectedFeatureIds()
+            self._generator.setValueSource(self._valueSource)
             self._generator.setDataSource(self._layer, self._zField, fids)
             duptol = 0.0
             if self.uRemoveDuplicates.isChecked():
@@ -414,9 +565,24 @@ class ContourDialog(QDialog, Ui_ContourDialog):
             self._generator.setDuplicatePointTolerance(duptol)
             self.dataChanged()
         finally:
-            self._loadingLayer = False
+            canceled = self._feedback.isCanceled()
+            self._feedback.setInterruptible(False)
+            self._reloading = False
+            self._preview.suspend(False)
+        if self._afterReload is not None:
+            action = self._afterReload
+            self._afterReload = None
+            self._generator.setReloadData()
+            action()
+            return
+        if canceled:
+            # The settings have changed while loading, and a new reload is
+            # scheduled.  Discard the incomplete data.
+            self._generator.setReloadData()
+            self.progressBar.setValue(0)
+            return
         self._replaceLayerSet = None
-        if not self._layer or not self._zField:
+        if not self._layer or not self._hasValueSource():
             self.enableOkButton()
             return
         self.computeLevels()
@@ -424,8 +590,10 @@ class ContourDialog(QDialog, Ui_ContourDialog):
         self.enableOkButton()
 
     def updateOutputName(self):
-        if self._layer.name() and self._zField:
+        if self._layer.name() and self._hasValueSource():
             zf = self._zField
+            if self._valueSource != ContourValueSource.field:
+                zf = ContourValueSource.fieldName(self._valueSource)
             if re.search(r"\W", zf):
                 zf = "expr"
             self.uOutputName.setText("%s_%s" % (self._layer.name(), zf))
@@ -478,6 +646,7 @@ class ContourDialog(QDialog, Ui_ContourDialog):
             fval = self.getLevels()
             self._generator.setContourLevels(fval)
             self.enableOkButton()
+            self._preview.schedule()
 
     def getMethod(self):
         index = self.uMethod.currentIndex()
@@ -524,25 +693,29 @@ class ContourDialog(QDialog, Ui_ContourDialog):
     def toggleSetMinimum(self):
         self.uMinContour.setEnabled(self.uSetMinimum.isChecked())
         if not self.uSetMinimum.isChecked():
-            x, y, z = self._generator.data()
-            if z is not None:
-                self.uMinContour.setValue(np.min(z))
+            zmin, zmax = self.zRange()
+            if zmin is not None:
+                self.uMinContour.setValue(zmin)
                 self.computeLevels()
 
     def toggleSetMaximum(self):
         self.uMaxContour.setEnabled(self.uSetMaximum.isChecked())
         if not self.uSetMaximum.isChecked():
-            x, y, z = self._generator.data()
-            if z is not None:
-                self.uMaxContour.setValue(np.max(z))
+            zmin, zmax = self.zRange()
+            if zmax is not None:
+                self.uMaxContour.setValue(zmax)
                 self.computeLevels()
 
     def computeLevels(self):
+        # Levels are computed once the data are reloaded
+        if self._reloading:
+            return
         # Use ContourGenerator code
         methodcode, params = self.contourLevelParams()
         self._generator.setContourMethod(methodcode, params)
         self.showLevels()
         self.enableOkButton()
+        self._preview.schedule()
 
     def showLevels(self):
         self.uLevelsList.clear()
@@ -551,12 +724,12 @@ class ContourDialog(QDialog, Ui_ContourDialog):
             # Need to create some contours if manual and none
             # defined
             if self._canEditList and len(levels) == 0:
-                x, y, z = self._generator.data()
-                if z is not None:
+                zmin, zmax = self.zRange()
+                if zmin is not None:
                     ncontour = self.uNContour.value()
                     try:
                         levels = ContourMethod.calculateLevels(
-                            z, "equal", ncontour=ncontour
+                            np.array([zmin, zmax]), "equal", ncontour=ncontour
                         )
                     except:
                         levels = [0.0]
@@ -565,6 +738,19 @@ class ContourDialog(QDialog, Ui_ContourDialog):
             return
         for i in range(0, len(levels)):
             self.uLevelsList.addItem(self.formatLevel(levels[i]))
+        if self._generator.levelsApproximate():
+            # Levels estimated from a sample are recalculated from all the
+            # points when the contours are generated
+            tip = tr(
+                "Estimated from a sample of the data - the levels will be "
+                "recalculated from all the points when contours are generated"
+            )
+            for i in range(self.uLevelsList.count()):
+                item = self.uLevelsList.item(i)
+                font = item.font()
+                font.setItalic(True)
+                item.setFont(font)
+                item.setToolTip(tip)
 
     def modeToggled(self, enabled):
         if enabled:
@@ -572,6 +758,7 @@ class ContourDialog(QDialog, Ui_ContourDialog):
                 self.uFilledContours.isChecked() or self.uBoth.isChecked()
             )
             self.enableOkButton()
+            self._preview.schedule()
 
     def enableOkButton(self):
         self.uAddButton.setEnabled(False)
@@ -583,7 +770,9 @@ class ContourDialog(QDialog, Ui_ContourDialog):
 
     def confirmReplaceSet(self, set):
         message = (
-            tr("The following layers already have contours of {0}").format(self._zField)
+            tr("The following layers already have contours of {0}").format(
+                self._sourceAttr()
+            )
             + "\n"
             + tr("Do you want to replace them with the new contours?")
             + "\n\n"
@@ -600,6 +789,7 @@ class ContourDialog(QDialog, Ui_ContourDialog):
         )
 
     def addContours(self):
+        self.flushReload()
         try:
             self.validate()
             self._contourId = QDateTime.currentDateTime().toString("yyyyMMddhhmmss")
@@ -626,6 +816,7 @@ class ContourDialog(QDialog, Ui_ContourDialog):
                     for layer in list(oldLayerSet.values()):
                         QgsProject.instance().removeMapLayer(layer.id())
                 self._replaceLayerSet = self.contourLayerSet(self._contourId)
+                self.showDataDescription()
             finally:
                 QApplication.restoreOverrideCursor()
 
@@ -649,7 +840,10 @@ class ContourDialog(QDialog, Ui_ContourDialog):
         message = None
         if self.uSourceLayer.currentLayer() is None:
             message = tr("Please specify vector layer")
-        if self.uDataField.currentText() == "":
+        if (
+            self._valueSource == ContourValueSource.field
+            and self.uDataField.currentText() == ""
+        ):
             message = tr("Please specify data field")
         if message != None:
             raise ContourError(message)
@@ -665,15 +859,25 @@ class ContourDialog(QDialog, Ui_ContourDialog):
         list = self.uLevelsList
         return [float(list.item(i).text()) for i in range(0, list.count())]
 
+    def memoryLayerUrl(self, type, crs):
+        return QgsWkbTypes.displayString(type) + "?crs=internal:" + str(crs.srsid())
+
     def clearLayer(self, layer):
+        # Remove the features and attributes of a layer being replaced,
+        # keeping the layer id, style, and custom properties.  Where
+        # possible (as for the memory layers created by the dialog) the
+        # provider is truncated in one operation.
         pl = layer.dataProvider()
-        request = QgsFeatureRequest()
-        request.setFlags(QgsFeatureRequest.NoGeometry)
-        request.setSubsetOfAttributes([])
-        fids = []
-        for f in pl.getFeatures(request):
-            fids.append(f.id())
-        pl.deleteFeatures(fids)
+        if not (
+            pl.capabilities() & QgsVectorDataProvider.FastTruncate and pl.truncate()
+        ):
+            request = QgsFeatureRequest()
+            request.setFlags(QgsFeatureRequest.NoGeometry)
+            request.setSubsetOfAttributes([])
+            fids = []
+            for f in pl.getFeatures(request):
+                fids.append(f.id())
+            pl.deleteFeatures(fids)
         pl.deleteAttributes(pl.attributeIndexes())
         layer.updateFields()
 
@@ -685,8 +889,7 @@ class ContourDialog(QDialog, Ui_ContourDialog):
         if layer:
             self.clearLayer(layer)
         else:
-            url = QgsWkbTypes.displayString(type) + "?crs=internal:" + str(crs.srsid())
-            layer = QgsVectorLayer(url, name, "memory")
+            layer = QgsVectorLayer(self.memoryLayerUrl(type, crs), name, "memory")
 
         if layer is None:
             raise ContourError(tr("Could not create layer for contours"))
@@ -700,7 +903,7 @@ class ContourDialog(QDialog, Ui_ContourDialog):
         properties = {
             "ContourId": self._contourId,
             "SourceLayerId": self._layer.id(),
-            "SourceLayerAttr": self._zField,
+            "SourceLayerAttr": self._sourceAttr(),
             "Mode": mode,
             "Levels": levels,
             "LabelPrecision": str(self.uPrecision.value()),
@@ -736,54 +939,19 @@ class ContourDialog(QDialog, Ui_ContourDialog):
 
     def setContourProperties(self, layer, properties):
         for key in list(properties.keys()):
-            layer.setCustomProperty("ContourPlugin." + key, properties[key])
+            layer.setCustomProperty(
+                ContourLayerRegistry.PropertyPrefix + key, properties[key]
+            )
+        self._registry.updateLayer(layer)
 
     def getContourProperties(self, layer):
-        if layer.type() != layer.VectorLayer or layer.dataProvider().name() != "memory":
-            return None
-        properties = {}
-        for key in [
-            "ContourId",
-            "SourceLayerId",
-            "SourceLayerAttr",
-            "Mode",
-            "Levels",
-            "ContourInterval",
-            "NContour",
-            "LabelPrecision",
-            "MinContour",
-            "MaxContour",
-            "Extend",
-            "Method",
-            "ApplyColors",
-            "ColorRamp",
-            "ReverseRamp",
-        ]:
-            properties[key] = str(layer.customProperty("ContourPlugin." + key))
-        if not properties["ContourId"]:
-            return None
-        return properties
+        return self._registry.properties(layer)
 
     def contourLayers(self, wanted={}):
-        for layer in list(QgsProject.instance().mapLayers().values()):
-            properties = self.getContourProperties(layer)
-            if not properties:
-                continue
-            ok = True
-            for key in list(wanted.keys()):
-                if properties.get(key) != wanted[key]:
-                    ok = False
-                    break
-            if ok:
-                yield layer
+        return self._registry.layers(wanted)
 
     def contourLayerSet(self, contourId):
-        layers = self.contourLayers({"ContourId": contourId})
-        layerSet = {}
-        for layer in layers:
-            properties = self.getContourProperties(layer)
-            layerSet[properties.get("Mode")] = layer
-        return layerSet
+        return self._registry.layerSet(contourId)
 
     def layerSetContourId(self, layerSet):
         if layerSet:
@@ -804,7 +972,10 @@ class ContourDialog(QDialog, Ui_ContourDialog):
             yield set
 
         for layer in self.contourLayers(
-            {"SourceLayerId": self._layer.id(), "SourceLayerAttr": self._zField}
+            {
+                "SourceLayerId": self._layer.id(),
+                "SourceLayerAttr": self._sourceAttr(),
+            }
         ):
             id = self.getContourProperties(layer).get("ContourId")
             if id in ids:
@@ -812,6 +983,22 @@ class ContourDialog(QDialog, Ui_ContourDialog):
             ids.append(id)
             yield self.contourLayerSet(id)
 
+    def writeFeatures(self, layer, features):
+        # Add features directly to the layer provider, bypassing the edit
+        # buffer
+        if len(features) == 0:
+            return
+        profile = self._generator.profile()
+        with profile.stage("write"):
+            provider = layer.dataProvider()
+            if not provider.addFeatures(features, QgsFeatureSink.FastInsert)[0]:
+                raise ContourError(
+                    tr("Could not write contours to layer: {0}").format(
+                        provider.lastError()
+                    )
+                )
+        profile.count("features_written", len(features))
+
     def makeContourLayer(self, ctype):
         try:
             self._generator.setContourType(ctype)
@@ -823,12 +1010,15 @@ class ContourDialog(QDialog, Ui_ContourDialog):
             crs = self._generator.crs()
             vl = self.createVectorLayer(geomtype, name, ctype, fields, crs)
             levels = []
-            vl.startEditing()
+            batch = []
             for feature in self._generator.contourFeatures():
-                vl.addFeature(feature)
                 levels.append((feature["index"], feature["label"]))
+                batch.append(feature)
+                if len(batch) >= self.WriteBatchSize:
+                    self.writeFeatures(vl, batch)
+                    batch = []
+            self.writeFeatures(vl, batch)
             vl.updateExtents()
-            vl.commitChanges()
         except (ContourError, ContourMethodError) as ex:
             self.warnUser(ex.message())
             return
@@ -842,10 +1032,10 @@ class ContourDialog(QDialog, Ui_ContourDialog):
         self.adviseUser(tr("Contour layer {0} created").format(vl.name()))
 
     def dataChanged(self):
-        x, y, z = self._generator.data()
-        if z is not None:
-            zmin = np.min(z)
-            zmax = np.max(z)
+        stats = self._generator.statistics()
+        if stats is not None:
+            zmin = stats.min
+            zmax = stats.max
             ndp = self.uPrecision.value()
             if zmax - zmin > 0:
                 ndp2 = ndp
@@ -862,19 +1052,38 @@ class ContourDialog(QDialog, Ui_ContourDialog):
                 self.uMinContour.setValue(zmin)
             if not self.uSetMaximum.isChecked():
                 self.uMaxContour.setValue(zmax)
+            self.showDataDescription()
+        else:
+            self.uLayerDescription.setText(tr("No data selected for contouring"))
+
+    def showDataDescription(self):
+        stats = self._generator.statistics()
+        if stats is None:
+            return
+        description = "Contouring {0} points".format(stats.count)
+        if self._generator.dataLoaded():
             gridded = self._generator.isGridded()
             self.uUseGrid.setEnabled(gridded)
             self.uUseGrid.setChecked(gridded)
             self.uUseGridLabel.setEnabled(gridded)
-            description = "Contouring {0} points".format(len(z))
             if gridded:
                 gridshape = self._generator.gridShape()
                 description = description + " in a {0} x {1} grid".format(*gridshape)
             else:
                 description = description + " (not in regular grid)"
-            self.uLayerDescription.setText(description)
         else:
-            self.uLayerDescription.setText(tr("No data selected for contouring"))
+            # Points are not loaded until contours are generated, so the grid
+            # is used if the data turn out to be gridded.
+            self.uUseGrid.setEnabled(True)
+            self.uUseGrid.setChecked(True)
+            self.uUseGridLabel.setEnabled(True)
+        self.uLayerDescription.setText(description)
+
+    def zRange(self):
+        stats = self._generator.statistics()
+        if stats is None:
+            return None, None
+        return stats.min, stats.max
 
     def setLabelFormat(self):
         ndp = self.uPrecision.value()
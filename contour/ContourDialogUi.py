@@ -44,6 +44,14 @@ class Ui_ContourDialog(object):
         self.formLayout_2.setWidget(
             1, QtWidgets.QFormLayout.FieldRole, self.uSourceLayer
         )
+        self.label_16 = QtWidgets.QLabel(self.groupBox_2)
+        self.label_16.setObjectName("label_16")
+        self.formLayout_2.setWidget(2, QtWidgets.QFormLayout.LabelRole, self.label_16)
+        self.uValueSource = QtWidgets.QComboBox(self.groupBox_2)
+        self.uValueSource.setObjectName("uValueSource")
+        self.formLayout_2.setWidget(
+            2, QtWidgets.QFormLayout.FieldRole, self.uValueSource
+        )
         self.label_4 = QtWidgets.QLabel(self.groupBox_2)
         self.label_4.setObjectName("label_4")
         self.formLayout_2.setWidget(3, QtWidgets.QFormLayout.LabelRole, self.label_4)
@@ -352,6 +360,9 @@ class Ui_ContourDialog(object):
         self.progressBar.setTextVisible(True)
         self.progressBar.setObjectName("progressBar")
         self.horizontalLayout_8.addWidget(self.progressBar)
+        self.uPreview = QtWidgets.QCheckBox(ContourDialog)
+        self.uPreview.setObjectName("uPreview")
+        self.horizontalLayout_8.addWidget(self.uPreview)
         self.uHelpButton = QtWidgets.QPushButton(ContourDialog)
         self.uHelpButton.setAutoDefault(False)
         self.uHelpButton.setObjectName("uHelpButton")
@@ -365,6 +376,7 @@ class Ui_ContourDialog(object):
         self.verticalLayout.addLayout(self.horizontalLayout_8)
         self.verticalLayout.setStretch(0, 1)
         self.label_3.setBuddy(self.uSourceLayer)
+        self.label_16.setBuddy(self.uValueSource)
         self.label_4.setBuddy(self.uDataField)
         self.label_2.setBuddy(self.uRemoveDuplicates)
         self.label_11.setBuddy(self.uDuplicateTolerance)
@@ -383,7 +395,8 @@ class Ui_ContourDialog(object):
 
         self.retranslateUi(ContourDialog)
         QtCore.QMetaObject.connectSlotsByName(ContourDialog)
-        ContourDialog.setTabOrder(self.uSourceLayer, self.uSelectedOnly)
+        ContourDialog.setTabOrder(self.uSourceLayer, self.uValueSource)
+        ContourDialog.setTabOrder(self.uValueSource, self.uSelectedOnly)
         ContourDialog.setTabOrder(self.uSelectedOnly, self.uRemoveDuplicates)
         ContourDialog.setTabOrder(self.uRemoveDuplicates, self.uDuplicateTolerance)
         ContourDialog.setTabOrder(self.uDuplicateTolerance, self.uLinesContours)
@@ -406,7 +419,8 @@ class Ui_ContourDialog(object):
         ContourDialog.setTabOrder(self.uLabelUnits, self.uApplyColors)
         ContourDialog.setTabOrder(self.uApplyColors, self.uColorRamp)
         ContourDialog.setTabOrder(self.uColorRamp, self.uReverseRamp)
-        ContourDialog.setTabOrder(self.uReverseRamp, self.uAddButton)
+        ContourDialog.setTabOrder(self.uReverseRamp, self.uPreview)
+        ContourDialog.setTabOrder(self.uPreview, self.uAddButton)
         ContourDialog.setTabOrder(self.uAddButton, self.uCloseButton)
 
     def retranslateUi(self, ContourDialog):
@@ -414,6 +428,7 @@ class Ui_ContourDialog(object):
         ContourDialog.setWindowTitle(_translate("ContourDialog", "Contour"))
         self.groupBox_2.setTitle(_translate("ContourDialog", "Input"))
         self.label_3.setText(_translate("ContourDialog", "Point layer"))
+        self.label_16.setText(_translate("ContourDialog", "Value source"))
         self.label_4.setText(_translate("ContourDialog", "Data value"))
         self.uSelectedOnly.setText(
             _translate("ContourDialog", "Use selected points only")
@@ -452,6 +467,7 @@ class Ui_ContourDialog(object):
         self.label_9.setText(_translate("ContourDialog", "Label precision"))
         self.uReverseRamp.setText(_translate("ContourDialog", "reverse"))
         self.label_13.setText(_translate("ContourDialog", "Apply colours"))
+        self.uPreview.setText(_translate("ContourDialog", "Preview"))
         self.uHelpButton.setText(_translate("ContourDialog", "Help"))
         self.uAddButton.setText(_translate("ContourDialog", "Add"))
         self.uCloseButton.setText(_translate("ContourDialog", "Close"))
@@ -0,0 +1,235 @@
+import numpy as np
+
+from PyQt5.QtCore import QVariant
+from qgis.core import (
+    QgsExpression,
+    QgsExpressionNode,
+    QgsExpressionNodeBinaryOperator,
+    QgsExpressionNodeUnaryOperator,
+)
+
+"""
+ContourExpression compiles simple QGIS expressions for the contour value
+into functions evaluated with numpy over arrays of field values, so that
+values can be calculated for all points in one pass rather than by
+evaluating the expression for each feature.
+
+Only the arithmetic operators and common maths functions applied to
+numeric fields and literal values are supported.  Null values are
+represented by NaN.
+"""
+
+
+class ContourExpressionError(Exception):
+    pass
+
+
+def _divide(a, b):
+    # Division by zero is null in QGIS expressions
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(b == 0, np.nan, np.true_divide(a, np.where(b == 0, 1, b)))
+
+
+def _intDivide(a, b):
+    return np.floor(_divide(a, b))
+
+
+def _modulus(a, b):
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(b == 0, np.nan, np.fmod(a, np.where(b == 0, 1, b)))
+
+
+def _power(a, b):
+    with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+        return np.power(a, b)
+
+
+_binaryOperators = {
+    QgsExpressionNodeBinaryOperator.boPlus: np.add,
+    QgsExpressionNodeBinaryOperator.boMinus: np.subtract,
+    QgsExpressionNodeBinaryOperator.boMul: np.multiply,
+    QgsExpressionNodeBinaryOperator.boDiv: _divide,
+    QgsExpressionNodeBinaryOperator.boIntDiv: _intDivide,
+    QgsExpressionNodeBinaryOperator.boMod: _modulus,
+    QgsExpressionNodeBinaryOperator.boPow: _power,
+}
+
+
+def _unsafe(func):
+    # Functions returning null (NaN) for invalid arguments
+    def evaluate(*args):
+        with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+            result = func(*args)
+        return np.where(np.isfinite(result), result, np.nan)
+
+    return evaluate
+
+
+def _round(value, places=0.0):
+    # QGIS rounds halves away from zero, whereas np.round rounds them to even
+    places = np.nan_to_num(places)
+    if np.ndim(places) == 0:
+        places = int(places)
+    factor = np.power(10.0, places)
+    return np.sign(value) * np.floor(np.abs(value) * factor + 0.5) / factor
+
+
+def _log(base, value):
+    return np.log(value) / np.log(base)
+
+
+def _coalesce(*args):
+    result = args[0]
+    for arg in args[1:]:
+        result = np.where(np.isnan(result), arg, result)
+    return result
+
+
+def _maximum(*args):
+    result = args[0]
+    for arg in args[1:]:
+        result = np.fmax(result, arg)
+    return result
+
+
+def _minimum(*args):
+    result = args[0]
+    for arg in args[1:]:
+        result = np.fmin(result, arg)
+    return result
+
+
+def _clamp(minimum, value, maximum):
+    return np.minimum(np.maximum(value, minimum), maximum)
+
+
+# Functions by name, with the number of arguments (None for any number)
+
+_functions = {
+    "abs": (np.abs, 1),
+    "sqrt": (_unsafe(np.sqrt), 1),
+    "sin": (np.sin, 1),
+    "cos": (np.cos, 1),
+    "tan": (np.tan, 1),
+    "asin": (_unsafe(np.arcsin), 1),
+    "acos": (_unsafe(np.arccos), 1),
+    "atan": (np.arctan, 1),
+    "atan2": (np.arctan2, 2),
+    "exp": (np.exp, 1),
+    "ln": (_unsafe(np.log), 1),
+    "log10": (_unsafe(np.log10), 1),
+    "log": (_unsafe(_log), 2),
+    "round": (_round, None),
+    "floor": (np.floor, 1),
+    "ceil": (np.ceil, 1),
+    "pi": (lambda: np.pi, 0),
+    "degrees": (np.degrees, 1),
+    "radians": (np.radians, 1),
+    "to_real": (lambda value: value, 1),
+    "coalesce": (_coalesce, None),
+    "max": (_maximum, None),
+    "min": (_minimum, None),
+    "clamp": (_clamp, 3),
+}
+
+
+class CompiledExpression:
+    """
+    A QGIS expression compiled to a function of numpy arrays of field
+    values.  Raises ContourExpressionError if the expression uses anything
+    other than numeric fields, numeric literals, arithmetic operators, and
+    the supported maths functions.
+    """
+
+    def __init__(self, expression, fields):
+        if isinstance(expression, str):
+            expression = QgsExpression(expression)
+        if expression.hasParserError() or expression.rootNode() is None:
+            raise ContourExpressionError("Cannot parse expression")
+        self._fields = fields
+        self._columns = []
+        self._function = self._compile(expression.rootNode())
+
+    @staticmethod
+    def compile(expression, fields):
+        """
+        Returns the CompiledExpression for expression, or None if it cannot
+        be compiled.
+        """
+        try:
+            return CompiledExpression(expression, fields)
+        except ContourExpressionError:
+            return None
+
+    def _column(self, name):
+        index = self._fields.lookupField(name)
+        if index < 0:
+            raise ContourExpressionError("Invalid field {0}".format(name))
+        if not self._fields.at(index).isNumeric():
+            raise ContourExpressionError("Field {0} is not numeric".format(name))
+        if index not in self._columns:
+            self._columns.append(index)
+        column = self._columns.index(index)
+        return lambda values: values[column]
+
+    def _compile(self, node):
+        nodeType = node.nodeType()
+        if nodeType == QgsExpressionNode.ntLiteral:
+            value = node.value()
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                raise ContourExpressionError("Unsupported literal value")
+            value = float(value)
+            return lambda values: value
+        if nodeType == QgsExpressionNode.ntColumnRef:
+            return self._column(node.name())
+        if nodeType == QgsExpressionNode.ntUnaryOperator:
+            if node.op() != QgsExpressionNodeUnaryOperator.uoMinus:
+                raise ContourExpressionError("Unsupported operator")
+            operand = self._compile(node.operand())
+            return lambda values: np.negative(operand(values))
+        if nodeType == QgsExpressionNode.ntBinaryOperator:
+            operator = _binaryOperators.get(node.op())
+            if operator is None:
+                raise ContourExpressionError("Unsupported operator")
+            left = self._compile(node.opLeft())
+            right = self._compile(node.opRight())
+            return lambda values: operator(left(values), right(values))
+        if nodeType == QgsExpressionNode.ntFunction:
+            name = QgsExpression.Functions()[node.fnIndex()].name().lower()
+            if name not in _functions:
+                raise ContourExpressionError("Unsupported function {0}".format(name))
+            function, nargs = _functions[name]
+            args = node.args()
+            args = [] if args is None else [self._compile(arg) for arg in args.list()]
+            if nargs is not None and len(args) != nargs:
+                raise ContourExpressionError("Unsupported function {0}".format(name))
+            return lambda values: function(*[arg(values) for arg in args])
+        raise ContourExpressionError("Unsupported expression")
+
+    def attributeIndexes(self):
+        """
+        The indexes of the fields used by the expression, in the order in
+        which their values are passed to evaluate
+        """
+        return list(self._columns)
+
+    def evaluate(self, values, size):
+        """
+        Evaluate the expression for a list of arrays of size values of the
+        fields listed by attributeIndexes, with NaN for null values.
+        Returns an array of values, with NaN where the result is null.
+        """
+        result = self._function(values)
+        return np.broadcast_to(np.asarray(result, dtype=np.float64), (size,))
+
+    @staticmethod
+    def attributeValue(value):
+        """
+        Convert a feature attribute value to a float, or NaN if null
+        """
+        if value is None or (isinstance(value, QVariant) and value.isNull()):
+            return np.nan
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return np.nan
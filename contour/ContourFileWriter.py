@@ -0,0 +1,205 @@
+import os
+
+from PyQt5.QtCore import QVariant
+from qgis.core import QgsCoordinateReferenceSystem
+
+from .ContourGenerator import ContourError, tr
+
+_ogrAvailable = False
+try:
+    from osgeo import gdal, ogr, osr
+
+    _ogrAvailable = True
+except ImportError:
+    _ogrAvailable = False
+
+"""
+ContourFileWriter streams contour features directly to a GeoPackage or
+FlatGeobuf file with OGR.  Features are written in batched transactions
+and the spatial index is built once after all the features are written
+rather than being updated for each insert, so that very large contour
+layers can be written without holding them in memory.
+"""
+
+
+def _gdalError():
+    return gdal.GetLastErrorMsg() or tr("Unknown error")
+
+
+class ContourFileWriter:
+    """
+    Writer of contour features to a GeoPackage (.gpkg) or FlatGeobuf
+    (.fgb) file, chosen by the file extension.  Any existing file is
+    replaced.
+
+    Features are committed every commitSize features.  The GeoPackage
+    spatial index is created when the writer is closed.  FlatGeobuf files
+    are written by the driver in a single pass, which sorts the features
+    and builds the packed spatial index when the file is closed.
+
+    The writer should be closed with close(), or used as a context
+    manager, or discarded with discard() if the output is not complete.
+    """
+
+    Formats = {".gpkg": "GPKG", ".fgb": "FlatGeobuf"}
+    FileFilter = "GeoPackage (*.gpkg);;FlatGeobuf (*.fgb)"
+    DefaultCommitSize = 10000
+
+    _fieldTypes = {
+        QVariant.Int: "OFTInteger",
+        QVariant.LongLong: "OFTInteger64",
+        QVariant.Double: "OFTReal",
+    }
+
+    def __init__(self, filename, fields, wkbtype, crs, layerName=None, commitSize=None):
+        if not _ogrAvailable:
+            raise ContourError(tr("python osgeo (GDAL) module not available"))
+        ext = os.path.splitext(filename)[1].lower()
+        driverName = self.Formats.get(ext)
+        if driverName is None:
+            raise ContourError(
+                tr("Contour output file must be a GeoPackage or FlatGeobuf file")
+            )
+        self._filename = filename
+        self._extension = ext
+        self._commitSize = max(1, int(commitSize or self.DefaultCommitSize))
+        self._layerName = layerName or os.path.splitext(os.path.basename(filename))[0]
+        self._count = 0
+        self._pending = 0
+        self._dataset = None
+        self._layer = None
+
+        driver = ogr.GetDriverByName(driverName)
+        if driver is None:
+            raise ContourError(tr("OGR driver {0} not available").format(driverName))
+        # OGR raises RuntimeError if exceptions are enabled, otherwise
+        # returns None or an error code
+        try:
+            if os.path.exists(filename):
+                driver.DeleteDataSource(filename)
+            self._dataset = driver.CreateDataSource(filename)
+            if self._dataset is None:
+                raise RuntimeError(_gdalError())
+            srs = None
+            if crs is not None and crs.isValid():
+                srs = osr.SpatialReference()
+                wkt = crs.toWkt(QgsCoordinateReferenceSystem.WKT_PREFERRED_GDAL)
+                srs.ImportFromWkt(wkt)
+                if hasattr(srs, "SetAxisMappingStrategy"):
+                    srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+            options = ["SPATIAL_INDEX=NO"] if driverName == "GPKG" else []
+            self._layer = self._dataset.CreateLayer(
+                self._layerName, srs, int(wkbtype), options
+            )
+            if self._layer is None:
+                raise RuntimeError(_gdalError())
+            for field in fields:
+                fieldType = self._fieldTypes.get(field.type(), "OFTString")
+                fieldDefn = ogr.FieldDefn(field.name(), getattr(ogr, fieldType))
+                if self._layer.CreateField(fieldDefn) != 0:
+                    raise RuntimeError(_gdalError())
+            self._defn = self._layer.GetLayerDefn()
+            self._transactions = bool(
+                self._dataset.TestCapability(ogr.ODsCTransactions)
+            )
+            self._startTransaction()
+        except RuntimeError as ex:
+            self._layer = None
+            self._dataset = None
+            raise ContourError(
+                tr("Cannot create contour file {0}: {1}").format(filename, ex)
+            )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exctype, *exc):
+        if exctype is None:
+            self.close()
+        else:
+            self.discard()
+
+    def _startTransaction(self):
+        if self._transactions:
+            self._dataset.StartTransaction()
+        self._pending = 0
+
+    def _commit(self):
+        if self._transactions:
+            self._dataset.CommitTransaction()
+
+    def addFeature(self, feature, flags=None):
+        """
+        Write a QgsFeature to the file.  flags is ignored, and is accepted
+        so that the writer can be used in place of a QgsFeatureSink.
+        """
+        ogrFeature = ogr.Feature(self._defn)
+        for i, value in enumerate(feature.attributes()):
+            if value is None or (isinstance(value, QVariant) and value.isNull()):
+                continue
+            ogrFeature.SetField(i, value)
+        geom = feature.geometry()
+        if not geom.isNull():
+            ogrFeature.SetGeometry(ogr.CreateGeometryFromWkb(bytes(geom.asWkb())))
+        try:
+            if self._layer.CreateFeature(ogrFeature) != 0:
+                raise RuntimeError(_gdalError())
+        except RuntimeError as ex:
+            raise ContourError(
+                tr("Cannot write contour to {0}: {1}").format(self._filename, ex)
+            )
+        self._count += 1
+        self._pending += 1
+        if self._pending >= self._commitSize:
+            self._commit()
+            self._startTransaction()
+        return True
+
+    def featureCount(self):
+        return self._count
+
+    def close(self):
+        """
+        Commit the remaining features, build the spatial index, and close
+        the file
+        """
+        if self._dataset is None:
+            return
+        try:
+            self._commit()
+            if self._dataset.GetDriver().GetName() == "GPKG":
+                geomColumn = self._layer.GetGeometryColumn() or "geom"
+                result = self._dataset.ExecuteSQL(
+                    "SELECT CreateSpatialIndex('{0}', '{1}')".format(
+                        self._layerName.replace("'", "''"),
+                        geomColumn.replace("'", "''"),
+                    )
+                )
+                if result is not None:
+                    self._dataset.ReleaseResultSet(result)
+        finally:
+            self._layer = None
+            self._dataset = None
+
+    def discard(self):
+        """
+        Close the file without committing the pending features, and delete
+        it so that an incomplete file is not left behind
+        """
+        if self._dataset is None:
+            return
+        try:
+            if self._transactions:
+                self._dataset.RollbackTransaction()
+        except RuntimeError:
+            pass
+        finally:
+            self._layer = None
+            self._dataset = None
+        driver = ogr.GetDriverByName(self.Formats[self._extension])
+        try:
+            driver.DeleteDataSource(self._filename)
+        except RuntimeError:
+            pass
+        if os.path.exists(self._filename):
+            os.remove(self._filename)
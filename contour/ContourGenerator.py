@@ -1,11 +1,21 @@
+import os
 import platform
 import re
+import shutil
 import sys
+import tempfile
+import threading
 import traceback
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait
 from .DataGridder import DataGridder
 from . import ContourUtils
 from . import ContourMethod
 from .ContourMethod import ContourMethodError
+from .ContourProfile import ContourProfile
+from .ContourExpression import CompiledExpression
+from .ContourLevelIndex import ContourLevelIndex
+from .ContourParallel import ContourPool, partitionBlocks
 
 qgis_qhull_fails = platform.platform().startswith("Linux")
 
@@ -18,15 +28,16 @@ from qgis.core import (
     QgsGeometry,
     QgsPointXY,
     QgsFields,
+    QgsVectorLayer,
+    QgsVectorLayerFeatureSource,
     QgsWkbTypes,
 )
-from PyQt5.QtCore import QObject, QVariant, QCoreApplication
+from PyQt5.QtCore import QObject, QVariant, QCoreApplication, QThread
 
 _mplAvailable = False
 try:
     import numpy as np
     from matplotlib.pyplot import contour, contourf, tricontour, tricontourf
-    from matplotlib.tri import Triangulation, TriAnalyzer
 
     _mplAvailable = True
 except ImportError:
@@ -122,6 +133,47 @@ class ContourType:
         return ContourType._wkbtype.get(type)
 
 
+class ContourValueSource:
+    field = "field"
+    geometryZ = "geometry_z"
+    geometryM = "geometry_m"
+
+    _sources = [field, geometryZ, geometryM]
+
+    _description = {
+        field: tr("Field or expression"),
+        geometryZ: tr("Geometry Z value"),
+        geometryM: tr("Geometry M value"),
+    }
+
+    _fieldName = {
+        geometryZ: "z",
+        geometryM: "m",
+    }
+
+    def sources():
+        return ContourValueSource._sources
+
+    def valid(source):
+        return source in ContourValueSource._sources
+
+    def description(source):
+        return ContourValueSource._description.get(
+            source, tr("Invalid value source {0}").format(source)
+        )
+
+    def fieldName(source):
+        return ContourValueSource._fieldName.get(source)
+
+
+ZStatistics = namedtuple("ZStatistics", "count min max sample exact complete")
+
+# Points of the whole source layer sorted by feature id, and the source
+# and value definition from which they were read
+
+LayerCache = namedtuple("LayerCache", "source key fids x y z")
+
+
 class _DummyFeedback:
 
     def isCanceled(self):
@@ -139,7 +191,63 @@ class _DummyFeedback:
 
 class ContourGenerator(QObject):
 
-    MaxContours = 100
+    SampleSize = 10000
+
+    # Limit on the maximum number of contour levels calculated by the
+    # interval method for line contours calculated with the level index
+    # engine, which is not slowed down by large numbers of levels.  The
+    # maximum number of contours parameter applies if it is smaller.
+
+    IndexedMaxContours = 100000
+
+    # Minimum number of points for which contours are calculated in
+    # parallel, below which starting the worker processes takes longer than
+    # contouring
+
+    ParallelMinPoints = 100000
+
+    # Partitioned triangulation splits the data into blocks buffered by
+    # PartitionBufferSpacing times the mean point spacing, with
+    # PartitionBlocksPerWorker blocks for each worker process (or more if
+    # required to triangulate each block within the memory limit)
+
+    PartitionBufferSpacing = 10.0
+    PartitionBlocksPerWorker = 2
+
+    # Features are read on multiple threads only for layers with at least
+    # ParallelReadMinFeatures features, split into ReadChunksPerThread
+    # ranges of feature ids per thread.
+
+    ParallelReadMinFeatures = 50000
+    ReadChunksPerThread = 4
+
+    # Approximate memory required for contouring per point, used to apply
+    # the memory limit.  Triangulation holds the triangles, neighbours and
+    # edges as well as copies of the coordinates.
+
+    GridBytesPerPoint = 64
+    TrigBytesPerPoint = 200
+
+    # The layer cache is only built if it needs no more than
+    # LayerCacheMaxBytes (or the memory limit if that is smaller), at
+    # LayerCacheBytesPerPoint for the feature id and coordinates of each
+    # point.  With selected features it is only built for layers of up to
+    # LayerCacheSmallLayer features, or if the selection is at least
+    # LayerCacheMinFraction of the layer, as otherwise reading the whole
+    # layer costs much more than reading the selection.
+
+    LayerCacheMaxBytes = 512 * 1024 * 1024
+    LayerCacheBytesPerPoint = 32
+    LayerCacheSmallLayer = 200000
+    LayerCacheMinFraction = 0.25
+
+    # Maximum coordinate rounding error (in CRS units for projected and
+    # degrees for geographic coordinate systems) and relative z error
+    # accepted for compact float32 storage.
+
+    CompactResolution = 0.001
+    CompactGeographicResolution = 1.0e-8
+    CompactZRelativeError = 1.0e-6
     translateExtend = lambda self, x: {
         "none": "neither",
         "below": "min",
@@ -162,13 +270,32 @@ class ContourGenerator(QObject):
         self._x = None
         self._y = None
         self._z = None
-        self._origin = [0, 0]  # NOTE: calculate in data()
+        self._origin = [0, 0]
+        self._compactStorage = False
+        self._resampleCellSize = None
+        self._resampledGrid = None
+        self._levelIndex = False
+        self._parallelWorkers = 0
+        self._partitioned = False
+        self._readThreads = 0
+        self._readSnapshots = None
+        self._scratchDirectory = None
+        self._scratchPath = None
+        self._scratchCount = 0
         self._source = None
         self._sourceFids = None
+        self._useLayerCache = False
+        self._layerCache = None
+        self._clipArea = None
+        self._clipEngine = None
+        self._filterRect = None
         self._zField = None
         self._zFieldName = None
+        self._valueSource = ContourValueSource.field
         self._discardTolerance = 0
         self._dataLoaded = False
+        self._statistics = None
+        self._previewTrig = None
         self._gridTested = False
         self._gridShape = None
         self._gridOrder = None
@@ -176,6 +303,7 @@ class ContourGenerator(QObject):
         self._contourMethod = None
         self._contourMethodParams = None
         self._levels = None
+        self._levelsFromSample = False
         self._contourType = ContourType.line
         self._extendFilled = ContourExtendOption.both
         self._labelNdp = -1
@@ -183,6 +311,8 @@ class ContourGenerator(QObject):
         self._labelTrimZeros = False
         self._labelUnits = ""
         self._feedback = feedback or _DummyFeedback()
+        self._profile = ContourProfile()
+        self._memoryLimit = None
         self.setDataSource(source, zField)
 
     def _dataDef(self):
@@ -215,9 +345,295 @@ class ContourGenerator(QObject):
             self._zFieldName = zFieldName
             self.setReloadData()
 
+    def setValueSource(self, valueSource):
+        """
+        Set the source of the values to contour, one of the
+        ContourValueSource values.  For geometry Z or M values the z field
+        is not used, and the coordinates and values are parsed directly
+        from the point geometries without reading any attributes.
+        """
+        if not ContourValueSource.valid(valueSource):
+            raise ContourError(tr("Invalid value source {0}").format(valueSource))
+        if valueSource != self._valueSource:
+            self._valueSource = valueSource
+            self.setReloadData()
+
+    def _hasValueSource(self):
+        if self._source is None:
+            return False
+        if self._valueSource != ContourValueSource.field:
+            return True
+        return self._zField is not None and self._zField != ""
+
+    def setLayerCache(self, useCache):
+        """
+        If useCache is True then the points of the whole source are read
+        once and kept with their feature ids, and the points of the
+        features selected by the sourceFids of setDataSource are looked up
+        from them by feature id rather than read from the source again.
+        This makes changing the selection fast at the cost of holding the
+        points of the whole layer in memory.  The cache is only built where
+        it pays off and fits in memory (see _layerCacheWorthwhile).
+        """
+        if useCache != self._useLayerCache:
+            self._useLayerCache = useCache
+            self._layerCache = None
+            self.setReloadData()
+
+    def clearLayerCache(self):
+        """
+        Discard the cached points of the source, for example if the
+        source data have changed
+        """
+        self._layerCache = None
+        self.setReloadData()
+
+    def _layerCacheKey(self):
+        rect = self._filterRect
+        return (
+            self._zField,
+            self._valueSource,
+            None if rect is None else rect.toString(12),
+        )
+
+    def _layerCacheValid(self):
+        cache = self._layerCache
+        return (
+            self._useLayerCache
+            and cache is not None
+            and cache.source is self._source
+            and cache.key == self._layerCacheKey()
+        )
+
+    def _layerCacheWorthwhile(self, source):
+        # Whether to read the whole source into the layer cache rather than
+        # just the selected features
+        if not self._useLayerCache:
+            return False
+        nfeature = source.featureCount()
+        if nfeature < 0:
+            return self._sourceFids is None
+        limit = self.LayerCacheMaxBytes
+        if self._memoryLimit:
+            limit = min(limit, self._memoryLimit)
+        if nfeature * self.LayerCacheBytesPerPoint > limit:
+            return False
+        return (
+            self._sourceFids is None
+            or nfeature <= self.LayerCacheSmallLayer
+            or len(self._sourceFids) >= self.LayerCacheMinFraction * nfeature
+        )
+
+    def _cacheLayer(self, fids, x, y, z):
+        # Save the points read from the whole source in feature id order
+        if np.any(np.diff(fids) < 0):
+            order = np.argsort(fids, kind="stable")
+            fids, x, y, z = (self._take(a, order) for a in (fids, x, y, z))
+        self._layerCache = LayerCache(
+            self._source, self._layerCacheKey(), fids, x, y, z
+        )
+
+    def _cachedPoints(self):
+        # The points of the selected features from the layer cache
+        cache = self._layerCache
+        if self._sourceFids is None:
+            return cache.x, cache.y, cache.z
+        with self._profile.stage("select"):
+            selected = np.unique(np.fromiter(self._sourceFids, dtype=np.int64))
+            index = np.searchsorted(cache.fids, selected)
+            index = index[index < len(cache.fids)]
+            index = index[cache.fids[index] == selected[: len(index)]]
+            return tuple(self._take(a, index) for a in (cache.x, cache.y, cache.z))
+
+    def setClipArea(self, extent=None, mask=None, buffer=0.0):
+        """
+        Restrict contouring to an extent (a QgsRectangle) and/or a mask
+        polygon (a QgsGeometry), both in the coordinate system of the data
+        source.  Only points within the bounding box of the area expanded
+        by buffer are read, using the spatial index of the provider, and
+        the contour geometries are clipped to the area.  The buffer should
+        be large enough to include the points needed to contour the edge of
+        the area correctly.  Calling with no extent or mask removes the
+        restriction.
+        """
+        if extent is not None and extent.isNull():
+            extent = None
+        if mask is not None and (mask.isNull() or mask.isEmpty()):
+            mask = None
+        clip = None
+        if extent is not None:
+            clip = QgsGeometry.fromRect(extent)
+        if mask is not None:
+            clip = mask if clip is None else mask.intersection(clip)
+        self._clipArea = clip
+        self._clipEngine = None
+        self._filterRect = None
+        if clip is not None:
+            self._filterRect = clip.boundingBox().buffered(buffer or 0.0)
+            self._clipEngine = QgsGeometry.createGeometryEngine(clip.constGet())
+            self._clipEngine.prepareGeometry()
+        self.setReloadData()
+
+    def _clipToArea(self, geom):
+        # Clip a contour geometry to the clip area with the prepared
+        # geometry engine.  Geometries entirely inside the area are returned
+        # unchanged.  Returns None if nothing is left.
+        engine = self._clipEngine
+        if engine is None or geom.isEmpty():
+            return geom
+        with self._profile.stage("clip"):
+            if engine.contains(geom.constGet()):
+                return geom
+            if not engine.intersects(geom.constGet()):
+                return None
+            clipped = QgsGeometry(engine.intersection(geom.constGet()))
+            clipped = clipped.convertToType(geom.type(), True)
+        if clipped is None or clipped.isNull() or clipped.isEmpty():
+            return None
+        return clipped
+
     def setUseGrid(self, usegrid):
         self._useGrid = usegrid
 
+    def setReadThreads(self, nthreads, snapshots=None):
+        """
+        Read features on nthreads threads, each reading ranges of feature
+        ids from its own snapshot of the layer.  0 or 1 reads the features
+        sequentially.
+
+        Snapshots (QgsVectorLayerFeatureSource) must be created on the
+        thread of the layer.  If the data source is a vector layer and the
+        data are read on the layer's thread the snapshots are created when
+        the data are read.  Otherwise, for example in a processing
+        algorithm, a list of snapshots of the layer of the data source can
+        be supplied in snapshots, and the features are read sequentially if
+        they are not.
+        """
+        self._readThreads = nthreads or 0
+        self._readSnapshots = list(snapshots) if snapshots else None
+
+    def setResampleCellSize(self, cellsize):
+        """
+        If cellsize is greater than zero then data that are not on a
+        regular grid are linearly interpolated from their triangulation
+        onto a grid with this spacing, which is then contoured with the
+        grid contouring algorithms.  None or 0 contours the triangulation
+        directly.
+        """
+        cellsize = cellsize or None
+        if cellsize != self._resampleCellSize:
+            self._resampleCellSize = cellsize
+            self._resampledGrid = None
+
+    def setLevelIndex(self, useIndex):
+        """
+        If useIndex is True then line contours are calculated with
+        ContourLevelIndex, which buckets triangles (or grid cells) by the
+        contour levels crossing them so that each level only visits the
+        cells it crosses.  This is much faster than matplotlib for large
+        numbers of levels.  The number of levels generated by the interval
+        method for line contours is limited to IndexedMaxContours as well as
+        by the maximum number of contours parameter.  Filled and layer
+        contours are not affected.
+        """
+        if useIndex != self._levelIndex:
+            self._levelIndex = useIndex
+            self._levels = None
+
+    def setParallelWorkers(self, nworkers):
+        """
+        Calculate contours on a pool of nworkers worker processes, each
+        contouring a subset of the levels from a copy of the triangulation
+        or grid in shared memory.  The number of workers is limited to the
+        number of processors.  0 or 1 calculates contours in this process.
+        Data sets with fewer than ParallelMinPoints points are always
+        contoured in this process.
+        """
+        self._parallelWorkers = nworkers or 0
+
+    def setPartitionedTriangulation(self, partitioned):
+        """
+        If partitioned is True then line contours of scattered data are
+        calculated by splitting the data into spatial blocks which are
+        triangulated and contoured separately on worker processes (see
+        setParallelWorkers).  The blocks overlap so that the triangulation
+        is the same as that of the whole data set except near the edge of
+        the data, and the contour lines are joined along block boundaries.
+        Blocks are made small enough to triangulate within the memory
+        limit, so the data are not thinned.  This does not apply to gridded
+        or resampled data, or to filled and layer contours.
+        """
+        self._partitioned = partitioned
+
+    def _partitionedLines(self, levels):
+        # Contour lines calculated by partitioned triangulation, as a list of
+        # (level, lines)
+        x, y, z = self.data()
+        npt = len(z)
+        nworkers = max(1, min(self._parallelWorkers, os.cpu_count() or 1))
+        nblocks = nworkers * self.PartitionBlocksPerWorker
+        limit = self._memoryLimit
+        if limit:
+            nblocks = max(nblocks, int(np.ceil(npt * self.TrigBytesPerPoint / limit)))
+        width = np.ptp(x)
+        height = np.ptp(y)
+        area = max(width * height, np.finfo(float).tiny)
+        buffer = self.PartitionBufferSpacing * np.sqrt(area / npt)
+        self._feedback.pushInfo(
+            tr("Triangulating and contouring {0} points in {1} blocks").format(
+                npt, nblocks
+            )
+        )
+        with self._profile.stage("contour"):
+            blocks = partitionBlocks(x, y, nblocks, buffer)
+            with ContourPool(nworkers, {"x": x, "y": y, "z": z}) as pool:
+                return pool.partitionedLines(levels, blocks)
+
+    def _contourPool(self, usegrid):
+        # Returns the data to contour (from gridContourData or
+        # trigContourData) and a ContourPool for contouring it in parallel,
+        # or None for the pool if parallel contouring is not being used.
+        if usegrid:
+            gx, gy, gz = data = self.gridContourData()
+            npoints = gz.size
+        else:
+            trig, z = data = self.trigContourData()
+            npoints = len(z)
+        nworkers = min(self._parallelWorkers, os.cpu_count() or 1)
+        if nworkers < 2 or npoints < self.ParallelMinPoints:
+            return data, None
+        if usegrid:
+            arrays = {
+                "x": gx,
+                "y": gy,
+                "z": np.ma.getdata(gz),
+                "zmask": np.ma.getmask(gz) if np.ma.is_masked(gz) else None,
+            }
+        else:
+            arrays = {
+                "x": trig.x,
+                "y": trig.y,
+                "triangles": trig.triangles,
+                "mask": trig.mask,
+                "z": np.asarray(z),
+            }
+        self._feedback.pushInfo(
+            tr("Contouring with {0} worker processes").format(nworkers)
+        )
+        return data, ContourPool(nworkers, arrays)
+
+    def _poolResults(self, pool, results):
+        # Yield results from a ContourPool, timing the wait for each as
+        # contouring, and closing the pool when done
+        done = object()
+        with pool:
+            while True:
+                with self._profile.stage("contour"):
+                    result = next(results, done)
+                if result is done:
+                    break
+                yield result
+
     def setContourLevels(self, levels):
         self.setContourMethod("manual", {"levels": levels})
 
@@ -230,8 +646,15 @@ class ContourGenerator(QObject):
         contourType = contourType.lower()
         if not ContourType.valid(contourType):
             raise ContourError(tr("Invalid contour type {0}").format(contourType))
+        if self._levelIndex and contourType != self._contourType:
+            # The limit on the number of levels depends on the type
+            self._levels = None
         self._contourType = contourType
 
+    def _useLevelIndex(self):
+        # The level index engine is only used for line contours
+        return self._levelIndex and self._contourType == ContourType.line
+
     def setContourExtendOption(self, extend):
         extend = extend.lower()
         if not ContourExtendOption.valid(extend):
@@ -245,15 +668,576 @@ class ContourGenerator(QObject):
         self._labelTrimZeros = trim
         self._labelUnits = units
 
+    def setCompactStorage(self, compact):
+        """
+        If compact is True then the loaded coordinates are stored as float32
+        offsets from an origin at the centre of the data (if this does not
+        lose precision), and z values are stored as float32 where that does
+        not lose significant precision.  Contouring is done in the local
+        coordinates and the origin is added back to the output geometries.
+        """
+        if compact != self._compactStorage:
+            self._compactStorage = compact
+            self.setReloadData()
+
+    def setScratchDirectory(self, directory):
+        """
+        If directory is not None then the point data arrays are stored in
+        memory mapped files in a temporary directory created within it, so
+        that the operating system can page the data in and out of memory.
+        The temporary directory is removed by release().
+        """
+        if directory != self._scratchDirectory:
+            self._scratchDirectory = directory or None
+            self.setReloadData()
+
+    def _allocate(self, size, dtype=np.float64):
+        # Allocate an array, memory mapped if a scratch directory is set.
+        # On systems that allow it the file is unlinked immediately so that
+        # the space is freed as soon as the array is no longer used.
+        if self._scratchDirectory is None:
+            return np.empty(size, dtype=dtype)
+        if self._scratchPath is None:
+            self._scratchPath = tempfile.mkdtemp(
+                prefix="contour_", dir=self._scratchDirectory
+            )
+        self._scratchCount += 1
+        filename = os.path.join(
+            self._scratchPath, "array{0}.dat".format(self._scratchCount)
+        )
+        array = np.memmap(filename, dtype=dtype, mode="w+", shape=(max(size, 1),))
+        try:
+            os.remove(filename)
+        except OSError:
+            pass
+        return array[:size]
+
+    def _take(self, array, index):
+        # Equivalent to array[index], allocating the result with _allocate
+        result = self._allocate(len(index), array.dtype)
+        np.take(array, index, out=result)
+        return result
+
+    def _resize(self, array, size):
+        result = self._allocate(size, array.dtype)
+        ncopy = min(size, array.shape[0])
+        result[:ncopy] = array[:ncopy]
+        return result
+
+    def _removeScratch(self):
+        if self._scratchPath is not None:
+            shutil.rmtree(self._scratchPath, ignore_errors=True)
+            self._scratchPath = None
+
+    def setMemoryLimit(self, limit):
+        """
+        Set the approximate maximum memory in bytes to use for contouring.
+        If contouring the data would need more than this then the data
+        are thinned before contouring.  None or 0 means no limit.
+        """
+        self._memoryLimit = limit or None
+
+    def release(self):
+        """
+        Release the loaded point data and anything calculated from them.
+        The data will be reloaded from the source if they are required
+        again.
+        """
+        self._x = None
+        self._y = None
+        self._z = None
+        self._gridOrder = None
+        self._gridShape = None
+        self._previewTrig = None
+        self._resampledGrid = None
+        self._statistics = None
+        self._layerCache = None
+        self._removeScratch()
+        self.setReloadData()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+        return False
+
     def setReloadData(self):
         self._dataLoaded = False
+        self._statistics = None
+        self._previewTrig = None
         self._gridTested = False
         self._levels = None
 
+    def dataLoaded(self):
+        return self._dataLoaded
+
+    def profile(self):
+        """
+        The ContourProfile recording stage times and counters
+        """
+        return self._profile
+
+    def _zExpression(self, source, zField):
+        fields = source.fields()
+        if fields.lookupField(zField) >= 0:
+            zField = '"' + zField.replace('"', '""') + '"'
+        expression = QgsExpression(zField)
+        if expression.hasParserError():
+            raise ContourError(tr("Cannot parse") + " " + zField)
+        context = QgsExpressionContext()
+        context.setFields(fields)
+        if not expression.prepare(context):
+            raise ContourError(tr("Cannot evaluate value") + " " + zField)
+        return expression, context
+
+    def _zValue(self, expression, context, feat):
+        context.setFeature(feat)
+        zval = expression.evaluate(context)
+        if zval is None or (isinstance(zval, QVariant) and zval.isNull()):
+            return None
+        try:
+            return float(zval)
+        except ValueError:
+            raise ContourError(tr("Z value {0} is not number").format(zval))
+
+    def statistics(self):
+        """
+        Summary statistics of the z values used to suggest contour levels.
+
+        Returns a ZStatistics tuple (count, min, max, sample, exact,
+        complete), or None if there is no data source.  If the data are not
+        already loaded the statistics are obtained without loading the
+        points, using provider aggregates for the minimum and maximum of a
+        plain field and evaluating the z expression for a sample of up to
+        SampleSize features spread evenly by feature id.  exact is True if
+        min and max are those of the full data set, and complete is True if
+        the sample includes the value of every feature.
+        """
+        if self._statistics is not None:
+            return self._statistics
+        if not self._dataLoaded and self._layerCacheValid():
+            # Loading the selected points from the cache is fast
+            self.data()
+        if self._dataLoaded:
+            z = self._z
+            if z is None:
+                return None
+            self._statistics = ZStatistics(
+                len(z), float(np.min(z)), float(np.max(z)), z, True, True
+            )
+            return self._statistics
+
+        source = self._source
+        zField = self._zField
+        if not self._hasValueSource():
+            return None
+        useGeometry = self._valueSource != ContourValueSource.field
+
+        try:
+            fids = self._sourceFids
+            count = len(fids) if fids is not None else source.featureCount()
+            zmin = None
+            zmax = None
+            rect = self._filterRect
+            fieldIndex = -1 if useGeometry else source.fields().lookupField(zField)
+            if fieldIndex >= 0 and fids is None and rect is None:
+                zmin = source.minimumValue(fieldIndex)
+                zmax = source.maximumValue(fieldIndex)
+                try:
+                    zmin = float(zmin)
+                    zmax = float(zmax)
+                except (TypeError, ValueError):
+                    zmin = None
+                    zmax = None
+
+            request = QgsFeatureRequest()
+            if useGeometry:
+                request.setSubsetOfAttributes([])
+            else:
+                expression, context = self._zExpression(source, zField)
+                request.setFlags(QgsFeatureRequest.NoGeometry)
+                request.setSubsetOfAttributes(
+                    expression.referencedColumns(), source.fields()
+                )
+            if rect is not None:
+                request.setFilterRect(rect)
+            if (
+                fids is not None
+                or rect is not None
+                or not 0 <= count <= self.SampleSize
+            ):
+                fids, count = self._sampleFids(source, self.SampleSize)
+                request.setFilterFids(fids)
+            sample = []
+            if useGeometry:
+                sample = self._readGeometryValues(source, request, False)[2]
+                nread = len(sample)
+            else:
+                nread = 0
+                for feat in source.getFeatures(request):
+                    nread += 1
+                    zval = self._zValue(expression, context, feat)
+                    if zval is not None:
+                        sample.append(zval)
+            # The number of selected features does not account for the
+            # filter rectangle, but is known if the sample includes every
+            # selected feature
+            if rect is not None and self._sourceFids is not None:
+                if len(fids) == count:
+                    count = nread
+        except ContourError as ce:
+            self._feedback.reportError(ce.message())
+            return None
+
+        sample = np.array(sample)
+        complete = nread >= count
+        if zmin is not None:
+            exact = True
+        elif len(sample) > 0:
+            zmin = float(np.min(sample))
+            zmax = float(np.max(sample))
+            exact = complete
+        else:
+            return None
+        self._statistics = ZStatistics(count, zmin, zmax, sample, exact, complete)
+        return self._statistics
+
+    def _sampleFids(self, source, maxCount):
+        # Feature ids of at most maxCount features spread evenly through the
+        # selected features, or the features of the source within the
+        # filter rectangle, and the number of features they are taken from.
+        # Sampling by feature id rather than taking the first features
+        # avoids a biased sample from files ordered by survey line or tile.
+        if self._sourceFids is not None:
+            fids = np.fromiter(self._sourceFids, dtype=np.int64)
+        else:
+            request = QgsFeatureRequest()
+            request.setSubsetOfAttributes([])
+            if self._filterRect is not None:
+                request.setFilterRect(self._filterRect)
+            else:
+                request.setFlags(QgsFeatureRequest.NoGeometry)
+            fids = np.fromiter(
+                (feat.id() for feat in source.getFeatures(request)), dtype=np.int64
+            )
+        count = len(fids)
+        fids.sort()
+        if count > maxCount:
+            fids = fids[np.linspace(0, count - 1, maxCount).astype(int)]
+        return [int(fid) for fid in fids], count
+
+    def _levelData(self):
+        # Values used to calculate contour levels.  Uses the loaded data if
+        # available, otherwise the sample from statistics() extended with the
+        # minimum and maximum values.
+        if self._dataLoaded:
+            return self._z
+        stats = self.statistics()
+        if stats is None:
+            return None
+        return np.concatenate(([stats.min, stats.max], stats.sample))
+
+    def levelsApproximate(self):
+        """
+        True if the contour levels are calculated from the statistics of a
+        sample of the data which may not give the same levels as the full
+        data set.  Approximate levels are recalculated when the data are
+        loaded to generate the contours.
+        """
+        if self._dataLoaded or self._contourMethod == "manual":
+            return False
+        stats = self.statistics()
+        if stats is None:
+            return False
+        if self._contourMethod == "quantile":
+            return not stats.complete
+        return not stats.exact
+
+    def _featurePoint(self, feat):
+        fgeom = feat.geometry()
+        if QgsWkbTypes.flatType(fgeom.wkbType()) != QgsWkbTypes.Point:
+            raise ContourError(
+                tr("Invalid geometry type for contouring - must be point geometry")
+            )
+        return fgeom.asPoint()
+
+    def _valueStore(self, compiled, expression, context):
+        # Returns a function store(feat, arrays, i) that sets element i of
+        # arrays[2:] from feature feat, returning False if the feature has
+        # no value.  If the expression is compiled the arrays are the values
+        # of the fields it uses, otherwise the single array of z values.
+        if compiled is not None:
+            indexes = compiled.attributeIndexes()
+            value = CompiledExpression.attributeValue
+
+            def store(feat, arrays, i):
+                attributes = feat.attributes()
+                for array, index in zip(arrays[2:], indexes):
+                    array[i] = value(attributes[index])
+                return True
+
+        else:
+
+            def store(feat, arrays, i):
+                zval = self._zValue(expression, context, feat)
+                if zval is None:
+                    return False
+                arrays[2][i] = zval
+                return True
+
+        return store
+
+    def _valueArrayCount(self, compiled):
+        return 1 if compiled is None else len(compiled.attributeIndexes())
+
+    def _evaluateValues(self, compiled, npt, arrays, fids=None):
+        # Returns x, y, z, fids from the first npt elements of the arrays
+        # filled by the function from _valueStore and the optional array of
+        # feature ids.  For compiled expressions the z values are evaluated
+        # from the field values and points with null values are discarded.
+        if fids is not None:
+            arrays = arrays + [fids]
+        arrays = list(self._trimArrays(npt, *arrays))
+        if fids is not None:
+            fids = arrays.pop()
+        if compiled is None:
+            return arrays[0], arrays[1], arrays[2], fids
+        x, y = arrays[:2]
+        with self._profile.stage("evaluate"):
+            z = self._allocate(npt)
+            z[:] = compiled.evaluate(arrays[2:], npt)
+            valid = ~np.isnan(z)
+            if not np.all(valid):
+                index = np.flatnonzero(valid)
+                x = self._take(x, index)
+                y = self._take(y, index)
+                z = self._take(z, index)
+                if fids is not None:
+                    fids = self._take(fids, index)
+        return x, y, z, fids
+
+    def _requestFids(self, request):
+        # The feature ids requested, or None if not filtered by id
+        if request.filterType() == QgsFeatureRequest.FilterFids:
+            return request.filterFids()
+        return None
+
+    def _readFeatures(self, source, request, expression, context, withFids=False):
+        # Read point coordinates and z values from the source into
+        # contiguous float64 arrays x, y, z.  The arrays are preallocated
+        # from the feature count and grown if that is an underestimate.
+        # Simple expressions are compiled to be evaluated for all points
+        # at once from arrays of the field values.  Returns x, y, z, fids,
+        # where fids is the array of feature ids if withFids is True, or
+        # None otherwise.
+        feedback = self._feedback
+        total = source.featureCount()
+        requestFids = self._requestFids(request)
+        if requestFids is not None:
+            total = len(requestFids)
+        compiled = CompiledExpression.compile(expression, source.fields())
+        if total >= self.ParallelReadMinFeatures and request.limit() < 0:
+            snapshots = self._layerSnapshots(source)
+            if snapshots:
+                return self._readFeaturesParallel(
+                    source, snapshots, request, compiled, withFids
+                )
+        percent = 100.0 / total if total > 0 else 0
+        size = max(total, 16)
+        narray = 2 + self._valueArrayCount(compiled)
+        arrays = [self._allocate(size) for i in range(narray)]
+        fids = self._allocate(size, np.int64) if withFids else None
+        store = self._valueStore(compiled, expression, context)
+        npt = 0
+        for current, feat in enumerate(source.getFeatures(request)):
+            if feedback.isCanceled():
+                raise ContourError("Cancelled by user")
+            feedback.setProgress(int(current * percent))
+            if npt >= size:
+                size = size * 2
+                arrays = [self._resize(a, size) for a in arrays]
+                if fids is not None:
+                    fids = self._resize(fids, size)
+            if store(feat, arrays, npt):
+                geom = self._featurePoint(feat)
+                arrays[0][npt] = geom.x()
+                arrays[1][npt] = geom.y()
+                if fids is not None:
+                    fids[npt] = feat.id()
+                npt += 1
+        return self._evaluateValues(compiled, npt, arrays, fids)
+
+    def _layerSnapshots(self, source):
+        # Snapshots of the layer for reading on multiple threads, or None if
+        # features are to be read sequentially
+        nthreads = min(self._readThreads, os.cpu_count() or 1)
+        if nthreads < 2:
+            return None
+        if self._readSnapshots is not None:
+            return self._readSnapshots[:nthreads]
+        if (
+            isinstance(source, QgsVectorLayer)
+            and QThread.currentThread() == source.thread()
+        ):
+            return [QgsVectorLayerFeatureSource(source) for i in range(nthreads)]
+        return None
+
+    def _readFeaturesParallel(self, source, snapshots, request, compiled, withFids):
+        # Read the features on a pool of threads, one for each snapshot of
+        # the layer.  The feature ids are split into contiguous ranges, each
+        # read into its own slice of the arrays, and the ranges are shared
+        # between the threads so that each snapshot is only used by one
+        # thread.  Progress and cancellation are handled on this thread.
+        feedback = self._feedback
+        nthreads = len(snapshots)
+        fids = self._requestFids(request)
+        if fids is None:
+            idRequest = QgsFeatureRequest(request)
+            idRequest.setFlags(QgsFeatureRequest.NoGeometry)
+            idRequest.setNoAttributes()
+            fids = [feat.id() for feat in snapshots[0].getFeatures(idRequest)]
+        fids = np.array(sorted(fids), dtype=np.int64)
+        total = len(fids)
+        nchunk = max(1, min(total, nthreads * self.ReadChunksPerThread))
+        bounds = np.linspace(0, total, nchunk + 1).round().astype(int)
+        narray = 2 + self._valueArrayCount(compiled)
+        arrays = [self._allocate(max(total, 1)) for i in range(narray)]
+        pointFids = self._allocate(max(total, 1), np.int64) if withFids else None
+        # Each element of counts and progress is only updated by the thread
+        # reading that range
+        counts = [0] * nchunk
+        progress = [0] * nchunk
+        cancelled = threading.Event()
+
+        # Expressions and requests must be created on this thread
+        tasks = []
+        for t, snapshot in enumerate(snapshots):
+            chunks = []
+            for i in range(t, nchunk, nthreads):
+                expression, context = self._zExpression(source, self._zField)
+                store = self._valueStore(compiled, expression, context)
+                chunkRequest = QgsFeatureRequest(request)
+                chunkFids = fids[bounds[i] : bounds[i + 1]]
+                chunkRequest.setFilterFids([int(f) for f in chunkFids])
+                chunks.append((i, chunkRequest, store))
+            tasks.append((snapshot, chunks))
+
+        def readChunk(snapshot, i, chunkRequest, store):
+            npt = bounds[i]
+            for feat in snapshot.getFeatures(chunkRequest):
+                if cancelled.is_set():
+                    return
+                progress[i] += 1
+                if npt >= bounds[i + 1]:
+                    break
+                if not store(feat, arrays, npt):
+                    continue
+                geom = self._featurePoint(feat)
+                arrays[0][npt] = geom.x()
+                arrays[1][npt] = geom.y()
+                if pointFids is not None:
+                    pointFids[npt] = feat.id()
+                npt += 1
+            counts[i] = npt - bounds[i]
+
+        def readChunks(snapshot, chunks):
+            for i, chunkRequest, store in chunks:
+                readChunk(snapshot, i, chunkRequest, store)
+
+        percent = 100.0 / total if total > 0 else 0
+        with ThreadPoolExecutor(max_workers=nthreads) as executor:
+            futures = [executor.submit(readChunks, *task) for task in tasks]
+            pending = futures
+            while pending:
+                done, pending = wait(pending, timeout=0.1)
+                feedback.setProgress(int(sum(progress) * percent))
+                if feedback.isCanceled():
+                    cancelled.set()
+            if cancelled.is_set():
+                raise ContourError("Cancelled by user")
+            for future in futures:
+                future.result()
+
+        # Close up the gaps left by features without a z value
+        if pointFids is not None:
+            arrays.append(pointFids)
+        npt = 0
+        for i, count in enumerate(counts):
+            start = bounds[i]
+            if start != npt:
+                for a in arrays:
+                    a[npt : npt + count] = a[start : start + count]
+            npt += count
+        if pointFids is not None:
+            arrays.pop()
+        return self._evaluateValues(compiled, npt, arrays, pointFids)
+
+    def _readGeometryValues(self, source, request, showProgress=True, withFids=False):
+        # Read point coordinates and the geometry z or m values.  The WKB of
+        # the points is collected and parsed in bulk, and points without a
+        # value discarded.  Returns x, y, z, fids as for _readFeatures.
+        feedback = self._feedback
+        total = source.featureCount()
+        requestFids = self._requestFids(request)
+        if requestFids is not None:
+            total = len(requestFids)
+        percent = 100.0 / total if total > 0 and showProgress else 0
+        wkb = []
+        fids = []
+        for current, feat in enumerate(source.getFeatures(request)):
+            if feedback.isCanceled():
+                raise ContourError("Cancelled by user")
+            if percent:
+                feedback.setProgress(int(current * percent))
+            geom = feat.geometry()
+            if not geom.isNull():
+                wkb.append(geom.asWkb().data())
+                if withFids:
+                    fids.append(feat.id())
+        try:
+            px, py, pz, pm = ContourUtils.parsePointWkb(b"".join(wkb), len(wkb))
+        except ValueError:
+            raise ContourError(
+                tr("Invalid geometry type for contouring - must be point geometry")
+            )
+        del wkb
+        pvalue = pz if self._valueSource == ContourValueSource.geometryZ else pm
+        if pvalue is None:
+            raise ContourError(
+                tr("The point geometries do not have {0} values").format(
+                    self.zFieldName().upper()
+                )
+            )
+        index = np.flatnonzero(~np.isnan(pvalue))
+        if withFids:
+            fids = np.array(fids, dtype=np.int64)[index]
+        else:
+            fids = None
+        return (
+            self._take(px, index),
+            self._take(py, index),
+            self._take(pvalue, index),
+            fids,
+        )
+
+    def _trimArrays(self, npt, *arrays):
+        # Views of the first npt elements of the arrays, or copies if most
+        # of the allocated arrays would be unused
+        if npt * 10 < arrays[0].shape[0] * 9:
+            return tuple(self._resize(a, npt) for a in arrays)
+        return tuple(a[:npt] for a in arrays)
+
     def data(self):
         if self._dataLoaded:
             return self._x, self._y, self._z
         self._dataLoaded = True
+        self._statistics = None
+        if self._levelsFromSample:
+            self._levels = None
+        self._previewTrig = None
+        self._resampledGrid = None
+        self._origin = [0, 0]
         self._x = None
         self._y = None
         self._z = None
@@ -263,77 +1247,59 @@ class ContourGenerator(QObject):
 
         source = self._source
         zField = self._zField
-        if source is None or zField is None or zField == "":
+        if not self._hasValueSource():
             return self._x, self._y, self._z
 
         discardTolerance = self._discardTolerance
         feedback = self._feedback
 
-        total = source.featureCount()
-        percent = 100.0 / total if total > 0 else 0
-
-        count = 0
-        x = list()
-        y = list()
-        z = list()
+        profile = self._profile
         try:
-            if source.fields().lookupField(zField) >= 0:
-                zField = '"' + zField.replace('"', '""') + '"'
-            expression = QgsExpression(zField)
-            if expression.hasParserError():
-                raise ContourError(tr("Cannot parse") + " " + zField)
-            fields = source.fields()
-            context = QgsExpressionContext()
-            context.setFields(fields)
-            if not expression.prepare(context):
-                raise ContourError(tr("Cannot evaluate value") + " " + zField)
-            request = QgsFeatureRequest()
-            request.setSubsetOfAttributes(expression.referencedColumns(), fields)
-            if self._sourceFids is not None:
-                request.setFilterFids(self._sourceFids)
-            for current, feat in enumerate(source.getFeatures(request)):
-                try:
-                    if feedback.isCanceled():
-                        raise ContourError("Cancelled by user")
-                    feedback.setProgress(int(current * percent))
-                    context.setFeature(feat)
-                    zval = expression.evaluate(context)
-                    if zval is None or (isinstance(zval, QVariant) and zval.isNull()):
-                        continue
-                    try:
-                        zval = float(zval)
-                    except ValueError:
-                        raise ContourError(tr("Z value {0} is not number").format(zval))
-                    if zval is not None:
-                        fgeom = feat.geometry()
-                        if QgsWkbTypes.flatType(fgeom.wkbType()) != QgsWkbTypes.Point:
-                            raise ContourError(
-                                tr(
-                                    "Invalid geometry type for contouring - must be point geometry"
-                                )
-                            )
-                        geom = fgeom.asPoint()
-                        x.append(geom.x())
-                        y.append(geom.y())
-                        z.append(zval)
-                except Exception as ex:
-                    raise
-                count = count + 1
+            if not self._layerCacheValid():
+                # With the layer cache the whole source is read, and the
+                # selected points taken from it by feature id
+                useCache = self._layerCacheWorthwhile(source)
+                self._layerCache = None
+                request = QgsFeatureRequest()
+                if self._sourceFids is not None and not useCache:
+                    request.setFilterFids(self._sourceFids)
+                if self._filterRect is not None:
+                    request.setFilterRect(self._filterRect)
+                if self._valueSource == ContourValueSource.field:
+                    expression, context = self._zExpression(source, zField)
+                    fields = source.fields()
+                    request.setSubsetOfAttributes(
+                        expression.referencedColumns(), fields
+                    )
+                    with profile.stage("load"):
+                        x, y, z, fids = self._readFeatures(
+                            source, request, expression, context, useCache
+                        )
+                else:
+                    request.setSubsetOfAttributes([])
+                    with profile.stage("load"):
+                        x, y, z, fids = self._readGeometryValues(
+                            source, request, withFids=useCache
+                        )
+                profile.count("points_read", len(x))
+                if useCache:
+                    self._cacheLayer(fids, x, y, z)
+            if self._layerCacheValid():
+                x, y, z = self._cachedPoints()
 
             npt = len(x)
             if npt > 0:
-                x = np.array(x)
-                y = np.array(y)
-                z = np.array(z)
                 if discardTolerance > 0:
-                    index = ContourUtils.discardDuplicatePoints(
-                        x, y, discardTolerance, self.crs().isGeographic()
-                    )
+                    with profile.stage("deduplicate"):
+                        index = ContourUtils.discardDuplicatePoints(
+                            x, y, discardTolerance, self.crs().isGeographic()
+                        )
                     npt1 = len(index)
+                    profile.count("points_discarded", npt - npt1)
                     if npt1 < npt:
-                        x = x[index]
-                        y = y[index]
-                        z = z[index]
+                        x = self._take(x, index)
+                        y = self._take(y, index)
+                        z = self._take(z, index)
                         feedback.pushInfo(
                             tr(
                                 "{0} near duplicate points discarded - tolerance {1}"
@@ -349,19 +1315,62 @@ class ContourGenerator(QObject):
         if len(x) < 3:
             feedback.reportError(tr("Too few points to contour"))
             return self._x, self._y, self._z
+        if self._compactStorage:
+            x, y, z = self._compactData(x, y, z)
         self._x = x
         self._y = y
         self._z = z
+        profile.recordMemory("load", x, y, z)
         return self._x, self._y, self._z
 
+    def _compactData(self, x, y, z):
+        # Convert the data to float32 offsets from an origin, if this can be
+        # done without exceeding the compact storage resolution.
+        feedback = self._feedback
+        xmin = np.min(x)
+        xmax = np.max(x)
+        ymin = np.min(y)
+        ymax = np.max(y)
+        x0 = np.round((xmin + xmax) / 2.0)
+        y0 = np.round((ymin + ymax) / 2.0)
+        halfspan = max(xmax - x0, x0 - xmin, ymax - y0, y0 - ymin)
+        resolution = self.CompactResolution
+        if self.crs().isGeographic():
+            resolution = self.CompactGeographicResolution
+        if np.spacing(np.float32(halfspan)) <= resolution:
+            x32 = self._allocate(len(x), np.float32)
+            y32 = self._allocate(len(y), np.float32)
+            np.subtract(x, x0, out=x32)
+            np.subtract(y, y0, out=y32)
+            x = x32
+            y = y32
+            self._origin = [float(x0), float(y0)]
+        else:
+            feedback.pushInfo(
+                tr("Data extent too large to store coordinates as float32")
+            )
+        z32 = self._allocate(len(z), np.float32)
+        z32[:] = z
+        zerror = 0.0
+        blocksize = 1000000
+        for i in range(0, len(z), blocksize):
+            zblock = z[i : i + blocksize]
+            zerror = max(zerror, np.max(np.abs(z32[i : i + blocksize] - zblock)))
+        if zerror <= self.CompactZRelativeError * max(np.ptp(z), 1.0):
+            z = z32
+        return x, y, z
+
     def isGridded(self):
         """
         Check if points data are on a regular grid
         """
         if not self._gridTested:
             x, y, z = self.data()
-            self._gridShape, self._gridOrder = DataGridder(x, y).calcGrid()
+            with self._profile.stage("grid"):
+                self._gridShape, self._gridOrder = DataGridder(x, y).calcGrid()
+            self._profile.recordMemory("grid", self._gridOrder)
             self._gridTested = True
+            self._applyGridOrder()
         return self._gridShape is not None
 
     def gridShape(self):
@@ -369,14 +1378,27 @@ class ContourGenerator(QObject):
 
     def levels(self):
         if self._levels is None:
-            x, y, z = self.data()
+            z = self._levelData()
             if z is None:
                 raise ContourError(tr("Contour data not defined"))
             method = self._contourMethod
             params = self._contourMethodParams
             if method is None:
                 raise ContourError(tr("Contouring method not defined"))
+            if self._useLevelIndex() and "maxcontour" in params:
+                limit = self.IndexedMaxContours
+                maxcontour = params["maxcontour"]
+                if maxcontour is None or maxcontour > limit:
+                    params = dict(params, maxcontour=limit)
+            recalculated = self._levelsFromSample and self._dataLoaded
+            self._levelsFromSample = self.levelsApproximate()
             self._levels = ContourMethod.calculateLevels(z, method, **params)
+            if recalculated:
+                self._feedback.pushInfo(
+                    tr("Contour levels calculated from all {0} points").format(
+                        len(z)
+                    )
+                )
             self._defaultLabelNdp = None
         return self._levels
 
@@ -387,6 +1409,8 @@ class ContourGenerator(QObject):
         return ContourType.wkbtype(self._contourType)
 
     def zFieldName(self):
+        if self._valueSource != ContourValueSource.field:
+            return ContourValueSource.fieldName(self._valueSource)
         zfield = self._zFieldName or self._zField
         if zfield is None:
             zfield = "none"
@@ -424,6 +1448,10 @@ class ContourGenerator(QObject):
         return fields
 
     def contourFeatures(self):
+        if self._partitioned and self._contourType != ContourType.line:
+            self._feedback.pushInfo(
+                tr("Partitioned triangulation is only used for line contours")
+            )
         if self._contourType == ContourType.line:
             return self.lineContourFeatures()
         elif self._contourType == ContourType.filled:
@@ -433,68 +1461,223 @@ class ContourGenerator(QObject):
         else:
             return []
 
-    def gridContourData(self):
-        gx, gy, gz = self.data()
+    def _applyGridOrder(self):
+        # Reorder the loaded data into grid order once, so that the grid
+        # arrays are simply views of the data
         order = self._gridOrder
+        if order is None:
+            return
+        with self._profile.stage("grid"):
+            self._x = self._take(self._x, order)
+            self._y = self._take(self._y, order)
+            self._z = self._take(self._z, order)
+        self._gridOrder = None
+        self._previewTrig = None
+
+    def _gridArrays(self):
+        self.isGridded()
         shape = self._gridShape
-        if order is not None:
-            gx = gx[order]
-            gy = gy[order]
-            gz = gz[order]
-        gx = gx.reshape(shape)
-        gy = gy.reshape(shape)
-        gz = gz.reshape(shape)
+        gx, gy, gz = self.data()
+        return gx.reshape(shape), gy.reshape(shape), gz.reshape(shape)
+
+    def _memoryLimitMessage(self, npt, npt1):
+        self._feedback.pushInfo(
+            tr(
+                "Data thinned from {0} to {1} points to stay within memory limit of {2:.0f} MB"
+            ).format(npt, npt1, self._memoryLimit / (1024.0 * 1024.0))
+        )
+
+    def _useGridContouring(self):
+        # Contour with grid algorithms if the data are gridded or are to be
+        # resampled to a grid
+        if self.isGridded() and self._useGrid:
+            return True
+        return self._resampleCellSize is not None
+
+    def gridContourData(self):
+        if not (self.isGridded() and self._useGrid):
+            return self.resampledGridData()
+        gx, gy, gz = self._gridArrays()
+        npt = gz.size
+        limit = self._memoryLimit
+        if limit and npt * self.GridBytesPerPoint > limit:
+            step = int(np.ceil(np.sqrt(npt * self.GridBytesPerPoint / limit)))
+            gx = gx[::step, ::step]
+            gy = gy[::step, ::step]
+            gz = gz[::step, ::step]
+            self._memoryLimitMessage(npt, gz.size)
+        shape = gz.shape
         self._feedback.pushInfo("Contouring {0} by {1} grid".format(shape[0], shape[1]))
         return gx, gy, gz
 
-    def _buildtrig_workaround(self, x, y):
-        """
-        Workaround implemented as qhull fails when called from
-        within QGIS python in ubuntu 17.10, QGIS 3.1 :-(
-        """
-        import os
-        import sys
-        import subprocess
-        import tempfile
-
-        tfh, tfname = tempfile.mkstemp(".npy", "tmp_contour_generator")
-        tfh2, tfname2 = tempfile.mkstemp(".npy", "tmp_contour_generator")
-        os.close(tfh)
-        os.close(tfh2)
-        trig = None
-        try:
-            np.save(tfname, np.vstack((x, y)))
-            pydir = os.path.dirname(os.path.abspath(os.path.realpath(__file__)))
-            pyscript = os.path.join(pydir, "buildtrig_qhull_workaround.py")
-            python = sys.executable
-            result = subprocess.call([python, pyscript, tfname, tfname2])
-            triangles = np.load(tfname2)
-            trig = Triangulation(x, y, triangles)
-        finally:
-            os.remove(tfname)
-            os.remove(tfname2)
-        return trig
+    def _thinnedTrigData(self, x, y, z):
+        # Thin scattered data to a number of points that can be triangulated
+        # within the memory limit, by discarding points closer together than
+        # a progressively larger tolerance.
+        limit = self._memoryLimit
+        npt = len(x)
+        if not limit or npt * self.TrigBytesPerPoint <= limit:
+            return x, y, z
+        maxpt = max(3, int(limit / self.TrigBytesPerPoint))
+        with self._profile.stage("thin"):
+            area = max(np.ptp(x) * np.ptp(y), np.finfo(float).tiny)
+            tolerance = np.sqrt(area / maxpt)
+            while True:
+                index = ContourUtils.discardDuplicatePoints(x, y, tolerance)
+                if len(index) <= maxpt:
+                    break
+                tolerance *= 1.5
+        self._memoryLimitMessage(npt, len(index))
+        return x[index], y[index], z[index]
 
     def buildTriangulation(self, x, y):
-        trig = None
-        if qgis_qhull_fails:
-            trig = self._buildtrig_workaround(x, y)
-        else:
-            trig = Triangulation(x, y)
-        analyzer = TriAnalyzer(trig)
-        mask = analyzer.get_flat_tri_mask()
-        trig.set_mask(mask)
-        return trig
+        return ContourUtils.buildTriangulation(x, y, qgis_qhull_fails)
 
-    def trigContourData(self):
+    def resampledGridData(self):
+        """
+        Data interpolated from the triangulation onto a regular grid with
+        the resampling cell size.  Returns 1d arrays of grid x and y
+        coordinates and a 2d masked array of values.
+        """
+        if self._resampledGrid is None:
+            trig, z = self._triangulate()
+            x, y = trig.x, trig.y
+            cellsize = self._resampleCellSize
+            ncell = ((np.ptp(x) / cellsize) + 1) * ((np.ptp(y) / cellsize) + 1)
+            limit = self._memoryLimit
+            if limit and ncell * self.GridBytesPerPoint > limit:
+                cellsize *= np.sqrt(ncell * self.GridBytesPerPoint / limit)
+                self._feedback.pushInfo(
+                    tr(
+                        "Resampling cell size increased to {0} to stay within memory limit"
+                    ).format(cellsize)
+                )
+            with self._profile.stage("resample"):
+                self._resampledGrid = ContourUtils.resampleToGrid(trig, z, cellsize)
+            self._profile.recordMemory("resample", self._resampledGrid[2])
+        gx, gy, gz = self._resampledGrid
+        self._feedback.pushInfo(
+            "Contouring {0} by {1} resampled grid".format(gz.shape[0], gz.shape[1])
+        )
+        return gx, gy, gz
+
+    def _triangulate(self):
         x, y, z = self.data()
+        x, y, z = self._thinnedTrigData(x, y, z)
         self._feedback.pushInfo("Triangulating {0} points".format(len(x)))
-        trig = self.buildTriangulation(x, y)
+        with self._profile.stage("triangulate"):
+            trig = self.buildTriangulation(x, y)
+        self._profile.recordMemory("triangulate", trig.triangles, trig.mask)
+        self._profile.count("triangles", trig.triangles.shape[0])
+        if trig.mask is not None:
+            self._profile.count("masked_triangles", np.count_nonzero(trig.mask))
+        return trig, z
+
+    def trigContourData(self):
+        trig, z = self._triangulate()
         self._feedback.pushInfo(
             "Contouring {0} triangles".format(trig.triangles.shape[0])
         )
         return trig, z
-        return polygons
+
+    def _previewPoints(self, maxPoints):
+        # Points used for the preview, and the origin of their coordinates.
+        # Uses the loaded (or cached) points if available, otherwise reads at
+        # most maxPoints features so that the preview does not require
+        # loading the whole data set.
+        if self._dataLoaded or self._layerCacheValid():
+            x, y, z = self.data()
+            return x, y, z, self._origin
+        if not self._hasValueSource():
+            return None, None, None, [0, 0]
+        source = self._source
+        request = QgsFeatureRequest()
+        if self._sourceFids is not None:
+            fids = np.array(sorted(self._sourceFids), dtype=np.int64)
+            if len(fids) > maxPoints:
+                fids = fids[np.linspace(0, len(fids) - 1, maxPoints).astype(int)]
+            request.setFilterFids([int(f) for f in fids])
+        else:
+            request.setLimit(maxPoints)
+        if self._filterRect is not None:
+            request.setFilterRect(self._filterRect)
+        try:
+            if self._valueSource == ContourValueSource.field:
+                expression, context = self._zExpression(source, self._zField)
+                request.setSubsetOfAttributes(
+                    expression.referencedColumns(), source.fields()
+                )
+                x, y, z, fids = self._readFeatures(
+                    source, request, expression, context
+                )
+            else:
+                request.setSubsetOfAttributes([])
+                x, y, z, fids = self._readGeometryValues(source, request, False)
+        except ContourError:
+            return None, None, None, [0, 0]
+        finally:
+            self._feedback.setProgress(0)
+        return x, y, z, [0, 0]
+
+    def _previewTriangulation(self, maxPoints):
+        # Triangulation of a random subset of the points, cached so that
+        # changing levels does not require retriangulating.  Returns the
+        # triangulation, z values, and origin of the coordinates.
+        if self._previewTrig is None or self._previewTrig[0] != maxPoints:
+            x, y, z, origin = self._previewPoints(maxPoints)
+            if z is None or len(z) < 3:
+                return None, None, origin
+            if len(z) > maxPoints:
+                subset = np.random.RandomState(0).choice(
+                    len(z), maxPoints, replace=False
+                )
+                subset.sort()
+                x = x[subset]
+                y = y[subset]
+                z = z[subset]
+            trig = self.buildTriangulation(x, y)
+            self._previewTrig = (maxPoints, trig, z, origin)
+        return self._previewTrig[1:]
+
+    def previewLines(self, maxPoints=20000):
+        """
+        Approximate contour lines for previewing the contour levels.
+
+        The lines are calculated from a thinned subset of at most about
+        maxPoints points - a decimated grid for gridded data, or a random
+        subset of scattered data.  If the points are not loaded they are
+        not loaded for the preview, which is calculated from the first
+        maxPoints features (or a subset of the selected features).  Returns
+        a list of (level, lines) tuples, where lines is a list of (n,2)
+        arrays of coordinates in the source CRS.
+        """
+        levels = self.levels()
+        try:
+            if self._dataLoaded and self._z is None:
+                return []
+            if self._dataLoaded and self.isGridded() and self._useGrid:
+                x, y, z = self.data()
+                origin = self._origin
+                step = max(1, int(np.ceil(np.sqrt(len(z) / maxPoints))))
+                gx, gy, gz = self._gridArrays()
+                gx = gx[::step, ::step]
+                gy = gy[::step, ::step]
+                gz = gz[::step, ::step]
+                cs = contour(gx, gy, gz, levels)
+            else:
+                trig, tz, origin = self._previewTriangulation(maxPoints)
+                if trig is None:
+                    return []
+                cs = tricontour(trig, tz, levels)
+        except Exception:
+            raise ContourGenerationError.fromException(sys.exc_info())
+        dx, dy = origin
+        result = []
+        for level, segs in zip(cs.levels, cs.allsegs):
+            lines = [seg + [dx, dy] for seg in segs if len(seg) > 1]
+            result.append((float(level), lines))
+        ContourUtils.releaseContourSet(cs)
+        return result
 
     def calcLabelNdp(self):
         if self._labelNdp is not None and self._labelNdp > 0:
@@ -520,42 +1703,93 @@ class ContourGenerator(QObject):
     def _levelLabel(self, level):
         return self.formatLevel(level) + self._labelUnits
 
+    def _lineContourLines(self, levels):
+        # Returns a list of (level, lines) for each level, where lines is a
+        # list of (n,2) arrays of coordinates relative to the origin
+        usegrid = self._useGridContouring()
+        try:
+            if self._useLevelIndex():
+                if usegrid:
+                    gx, gy, gz = self.gridContourData()
+                    with self._profile.stage("index"):
+                        index = ContourLevelIndex.fromGrid(gx, gy, gz, levels)
+                else:
+                    trig, z = self.trigContourData()
+                    with self._profile.stage("index"):
+                        index = ContourLevelIndex.fromTriangulation(trig, z, levels)
+                with self._profile.stage("contour"):
+                    return [(float(level), lines) for level, lines in index.allLines()]
+            if self._partitioned and not usegrid:
+                return self._partitionedLines(levels)
+            data, pool = self._contourPool(usegrid)
+            if pool is not None:
+                return list(self._poolResults(pool, pool.lines(levels)))
+            with self._profile.stage("contour"):
+                if usegrid:
+                    cs = contour(*data, levels)
+                else:
+                    cs = tricontour(*data, levels)
+        except Exception:
+            raise ContourGenerationError.fromException(sys.exc_info())
+        result = list(zip([float(level) for level in cs.levels], cs.allsegs))
+        ContourUtils.releaseContourSet(cs)
+        return result
+
     def lineContourFeatures(self):
         x, y, z = self.data()
         levels = self.levels()
-        usegrid = self.isGridded() and self._useGrid
-        try:
-            if usegrid:
-                gx, gy, gz = self.gridContourData()
-                cs = contour(gx, gy, gz, levels)
-            else:
-                trig, z = self.trigContourData()
-                cs = tricontour(trig, z, levels)
-        except:
-            raise ContourGenerationError.fromException(sys.exc_info())
+        contourLines = self._lineContourLines(levels)
 
         fields = self.fields()
         zfield = self.zFieldName()
         dx, dy = self._origin
-        for i, layerLines in enumerate(cs.allsegs):
-            level = float(cs.levels[i])
+        # Tolerance for matching line ends when merging lines
+        tolerance = 1.0e-9 * max(np.ptp(x), np.ptp(y)) if len(x) else 0.0
+        nparts = [0, 0]
+        nvertices = [0, 0]
+        for i, (level, layerLines) in enumerate(contourLines):
             glines = []
             try:
-                for line in layerLines:
-                    points = [QgsPointXY(x, y) for x, y in line]
-                    if len(points) > 1:
-                        glines.append(points)
-                geom = QgsGeometry.fromMultiPolylineXY(glines)
-                geom.translate(dx, dy)
+                with self._profile.stage("merge"):
+                    merged = ContourUtils.mergeLines(layerLines, tolerance)
+                    nparts[0] += len(layerLines)
+                    nparts[1] += len(merged)
+                    nvertices[0] += sum(len(line) for line in layerLines)
+                    nvertices[1] += sum(len(line) for line in merged)
+                    layerLines = merged
+                with self._profile.stage("geometry"):
+                    for line in layerLines:
+                        points = [QgsPointXY(x, y) for x, y in line]
+                        if len(points) > 1:
+                            glines.append(points)
+                    geom = QgsGeometry.fromMultiPolylineXY(glines)
+                    geom.translate(dx, dy)
+                geom = self._clipToArea(geom)
+                if geom is None:
+                    geom = QgsGeometry.fromMultiPolylineXY([])
+                self._countFeature(geom)
                 feat = QgsFeature(fields)
                 feat.setGeometry(geom)
                 feat["index"] = i
                 feat[zfield] = level
                 feat["label"] = self._levelLabel(level)
                 yield feat
-            except:
+            except Exception:
                 message = sys.exc_info()[1]
                 self._feedback.reportError(message)
+        self._profile.count("merged_parts", nparts[0] - nparts[1])
+        self._profile.count("merged_vertices", nvertices[0] - nvertices[1])
+        if nparts[0] > nparts[1]:
+            self._feedback.pushInfo(
+                tr(
+                    "Merging lines reduced {0} line parts to {1} and {2} "
+                    "vertices to {3}"
+                ).format(nparts[0], nparts[1], nvertices[0], nvertices[1])
+            )
+
+    def _countFeature(self, geom):
+        self._profile.count("features")
+        self._profile.count("vertices", geom.constGet().nCoordinates())
 
     def _rangeLabel(self, min, max):
         op = " - "
@@ -591,25 +1825,41 @@ class ContourGenerator(QObject):
             mpoly.append(polypts)
         if len(mpoly) > 0:
             geom = QgsGeometry.fromMultiPolygonXY(mpoly)
-            geom = geom.makeValid()
+            if not geom.isGeosValid():
+                self._profile.count("invalid_geometries")
+                geom = geom.makeValid()
             return geom
         return None
 
+    def _filledContourPaths(self, levels, extend):
+        # Generator returning the list of matplotlib paths for each filled
+        # contour band in turn
+        usegrid = self._useGridContouring()
+        try:
+            data, pool = self._contourPool(usegrid)
+            if pool is not None:
+                yield from self._poolResults(pool, pool.filled(levels, extend))
+                return
+            with self._profile.stage("contour"):
+                if usegrid:
+                    cs = contourf(*data, levels, extend=extend)
+                else:
+                    cs = tricontourf(*data, levels, extend=extend)
+        except Exception:
+            raise ContourGenerationError.fromException(sys.exc_info())
+        try:
+            pathlists = [c.get_paths() for c in cs.collections]
+        except AttributeError:
+            pathlists = [[p] for p in cs.get_paths()]
+        ContourUtils.releaseContourSet(cs)
+        yield from pathlists
+
     def filledContourFeatures(self):
         levels = self.levels()
         extend = self._extendFilled
-        usegrid = self.isGridded() and self._useGrid
-        try:
-            if usegrid:
-                gx, gy, gz = self.gridContourData()
-                cs = contourf(gx, gy, gz, levels, extend=extend)
-            else:
-                trig, z = self.trigContourData()
-                cs = tricontourf(trig, z, levels, extend=extend)
-        except:
-            raise ContourGenerationError.fromException(sys.exc_info())
+        pathlists = self._filledContourPaths(levels, extend)
 
-        levels = [float(l) for l in cs.levels]
+        levels = [float(l) for l in levels]
         if ContourExtendOption.extendBelow(extend):
             levels = np.append(
                 [
@@ -632,24 +1882,24 @@ class ContourGenerator(QObject):
         zminfield = zfieldname + "_min"
         zmaxfield = zfieldname + "_max"
 
-        try:
-            pathlists = [c.get_paths() for c in cs.collections]
-        except AttributeError:
-            pathlists = [[p] for p in cs.get_paths()]
-
         for i, pathlist in enumerate(pathlists):
             level_min = levels[i]
             level_max = levels[i + 1]
             label = self._rangeLabel(level_min, level_max)
             try:
                 try:
-                    geom = self.buildQgsMultipolygon(pathlist)
+                    with self._profile.stage("geometry"):
+                        geom = self.buildQgsMultipolygon(pathlist)
+                        if geom is None:
+                            continue
+                        geom.translate(dx, dy)
+                    geom = self._clipToArea(geom)
                     if geom is None:
                         continue
-                    geom.translate(dx, dy)
                 except Exception as ex:
                     ninvalid += 1
                     continue
+                self._countFeature(geom)
                 feat = QgsFeature(fields)
                 feat.setGeometry(geom)
                 feat["index"] = i
@@ -662,59 +1912,78 @@ class ContourGenerator(QObject):
                 self._feedback.reportError(sys.exc_info()[1])
 
         if ninvalid > 0:
+            self._profile.count("invalid_geometries", ninvalid)
             self._feedback.pushInfo(
                 tr("{0} invalid contour geometries discarded").format(ninvalid)
             )
 
-    def layerContourFeatures(self):
-        levels = self.levels()
-        usegrid = self.isGridded() and self._useGrid
+    def _layerContourPaths(self, levels):
+        # Generator returning (index, level, paths) for each level above the
+        # minimum data value, where paths is the list of matplotlib paths
+        # of the area above the level, or None if there is none.
+        usegrid = self._useGridContouring()
         try:
-            if usegrid:
-                gx, gy, gz = self.gridContourData()
-            else:
-                trig, gz = self.trigContourData()
-        except:
+            data, pool = self._contourPool(usegrid)
+        except Exception:
             raise ContourGenerationError.fromException(sys.exc_info())
-
-        fields = self.fields()
-        ninvalid = 0
-        dx, dy = self._origin
-        zfield = self.zFieldName()
+        gz = data[-1]
         zmax = np.max(gz)
         zmax += 1.0 + abs(zmax)
         zmin = np.min(gz)
+        layers = [(i, level) for i, level in enumerate(levels) if level > zmin]
 
-        for i, level in enumerate(levels):
-            if level <= zmin:
-                continue
+        if pool is not None:
+            results = pool.layers([level for i, level in layers], zmax)
+            for (i, level), pathlist in zip(layers, self._poolResults(pool, results)):
+                yield i, level, pathlist
+            return
+
+        for i, level in layers:
             try:
-                if usegrid:
-                    cs = contourf(
-                        gx, gy, gz, [level, zmax], extend=ContourExtendOption.neither
-                    )
-                else:
-                    cs = tricontourf(
-                        trig, gz, [level, zmax], extend=ContourExtendOption.neither
-                    )
-            except:
+                with self._profile.stage("contour"):
+                    if usegrid:
+                        cs = contourf(
+                            *data,
+                            [level, zmax],
+                            extend=ContourExtendOption.neither,
+                        )
+                    else:
+                        cs = tricontourf(
+                            *data, [level, zmax], extend=ContourExtendOption.neither
+                        )
+            except Exception:
                 raise ContourGenerationError.fromException(sys.exc_info())
             try:
                 pathlists = [c.get_paths() for c in cs.collections]
             except AttributeError:
                 pathlists = [[p] for p in cs.get_paths()]
-            if len(pathlists) < 1:
+            ContourUtils.releaseContourSet(cs)
+            yield i, level, pathlists[0] if len(pathlists) > 0 else None
+
+    def layerContourFeatures(self):
+        levels = self.levels()
+        fields = self.fields()
+        ninvalid = 0
+        dx, dy = self._origin
+        zfield = self.zFieldName()
+
+        for i, level, pathlist in self._layerContourPaths(levels):
+            if pathlist is None:
                 continue
-            pathlist = pathlists[0]
             try:
                 try:
-                    geom = self.buildQgsMultipolygon(pathlist)
+                    with self._profile.stage("geometry"):
+                        geom = self.buildQgsMultipolygon(pathlist)
+                        if geom is None:
+                            continue
+                        geom.translate(dx, dy)
+                    geom = self._clipToArea(geom)
                     if geom is None:
                         continue
-                    geom.translate(dx, dy)
                 except Exception as ex:
                     ninvalid += 1
                     continue
+                self._countFeature(geom)
                 feat = QgsFeature(fields)
                 feat.setGeometry(geom)
                 feat["index"] = i
@@ -725,6 +1994,7 @@ class ContourGenerator(QObject):
                 self._feedback.reportError(ex.message)
 
         if ninvalid > 0:
+            self._profile.count("invalid_geometries", ninvalid)
             self._feedback.pushInfo(
                 tr("{0} invalid contour geometries discarded").format(ninvalid)
             )
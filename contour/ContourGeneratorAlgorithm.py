@@ -30,25 +30,48 @@ __copyright__ = "(C) 2018 by Chris Crook"
 
 __revision__ = "$Format:%H$"
 
+import json
+import os
 import os.path
-from PyQt5.QtCore import QCoreApplication, QUrl
+import re
+import numpy as np
+from PyQt5.QtCore import QCoreApplication, QUrl, QVariant
 from PyQt5.QtGui import QIcon
 from qgis.core import (
+    QgsCoordinateReferenceSystem,
+    QgsCoordinateTransform,
+    QgsCsException,
+    QgsFeature,
+    QgsField,
     QgsProcessing,
     QgsFeatureSink,
     QgsProcessingAlgorithm,
+    QgsProcessingFeatureSourceDefinition,
     QgsProcessingParameterFeatureSource,
     QgsProcessingParameterEnum,
+    QgsProcessingParameterExtent,
     QgsProcessingParameterExpression,
     QgsProcessingParameterNumber,
     QgsProcessingParameterBoolean,
+    QgsProcessingParameterFile,
+    QgsProcessingParameterFileDestination,
     QgsProcessingParameterString,
     QgsProcessingParameterFeatureSink,
+    QgsProcessingOutputNumber,
+    QgsProcessingOutputString,
+    QgsFeatureRequest,
+    QgsVectorLayerFeatureSource,
+    QgsGeometry,
+    QgsUnitTypes,
     QgsWkbTypes,
 )
 from .ContourGenerator import ContourGenerator, ContourType, ContourExtendOption
+from .ContourGenerator import ContourValueSource
 from .ContourGenerator import ContourError, ContourMethodError
 from . import ContourMethod
+from .ContourFileWriter import ContourFileWriter
+from .ContourProfile import cprofileFromEnvironment
+from .ContourTiles import ContourTileWriter
 from . import resources
 
 
@@ -71,8 +94,17 @@ class ContourGeneratorAlgorithm(QgsProcessingAlgorithm):
     # calling from the QGIS console.
 
     PrmOutputLayer = "OutputLayer"
+    PrmOutputFile = "OutputFile"
+    PrmCommitSize = "CommitSize"
+    PrmOutputTiles = "OutputTiles"
+    PrmTileMinZoom = "TileMinZoom"
+    PrmTileMaxZoom = "TileMaxZoom"
+    PrmTileTolerance = "TileTolerance"
+    PrmScales = "GeneralisedScales"
+    PrmScaleTolerance = "GeneralisationTolerance"
     PrmInputLayer = "InputLayer"
     PrmInputField = "InputField"
+    PrmValueSource = "ValueSource"
     PrmContourMethod = "ContourMethod"
     PrmNContour = "NContour"
     PrmMinContourValue = "MinContourValue"
@@ -85,6 +117,49 @@ class ContourGeneratorAlgorithm(QgsProcessingAlgorithm):
     PrmLabelTrimZeros = "LabelTrimZeros"
     PrmLabelUnits = "LabelUnits"
     PrmDuplicatePointTolerance = "DuplicatePointTolerance"
+    PrmMemoryLimit = "MemoryLimit"
+    PrmCompactStorage = "CompactStorage"
+    PrmScratchDirectory = "ScratchDirectory"
+    PrmResampleCellSize = "ResampleCellSize"
+    PrmLevelIndex = "LevelIndex"
+    PrmParallelWorkers = "ParallelWorkers"
+    PrmPartitioned = "PartitionedTriangulation"
+    PrmReadThreads = "ReadThreads"
+    PrmClipExtent = "ClipExtent"
+    PrmClipMask = "ClipMask"
+    PrmClipBuffer = "ClipBuffer"
+
+    # Additional outputs reporting the work done by the generator, as
+    # (output name, profile counter, description)
+
+    OutProfile = "Profile"
+    OutCounters = [
+        ("PointsRead", "points_read", tr("Number of points read")),
+        ("PointsDiscarded", "points_discarded", tr("Number of points discarded")),
+        ("Triangles", "triangles", tr("Number of triangles")),
+        ("MaskedTriangles", "masked_triangles", tr("Number of masked triangles")),
+        ("VerticesEmitted", "vertices", tr("Number of contour vertices")),
+        (
+            "MergedParts",
+            "merged_parts",
+            tr("Number of line parts removed by merging"),
+        ),
+        (
+            "MergedVertices",
+            "merged_vertices",
+            tr("Number of vertices removed by merging"),
+        ),
+        (
+            "InvalidGeometries",
+            "invalid_geometries",
+            tr("Number of invalid geometries repaired or discarded"),
+        ),
+        ("FeaturesWritten", "features_written", tr("Number of features written")),
+    ]
+
+    # Snapshots of the input layer created by prepareAlgorithm
+
+    _readSnapshots = None
 
     TypeValues = ContourType.types()
     TypeOptions = [ContourType.description(t) for t in TypeValues]
@@ -92,6 +167,9 @@ class ContourGeneratorAlgorithm(QgsProcessingAlgorithm):
     ExtendValues = ContourExtendOption.options()
     ExtendOptions = [ContourExtendOption.description(t) for t in ExtendValues]
 
+    ValueSourceValues = ContourValueSource.sources()
+    ValueSourceOptions = [ContourValueSource.description(v) for v in ValueSourceValues]
+
     MethodValues = [m.id for m in ContourMethod.methods]
     MethodOptions = [m.name for m in ContourMethod.methods]
 
@@ -99,6 +177,7 @@ class ContourGeneratorAlgorithm(QgsProcessingAlgorithm):
         PrmContourMethod: (MethodValues, MethodOptions),
         PrmContourType: (TypeValues, TypeOptions),
         PrmExtendContour: (ExtendValues, ExtendOptions),
+        PrmValueSource: (ValueSourceValues, ValueSourceOptions),
     }
 
     def _enumParameter(self, name, description, optional=False):
@@ -139,13 +218,53 @@ class ContourGeneratorAlgorithm(QgsProcessingAlgorithm):
             )
         )
 
-        # Define the field/expression to contour
+        # Define the source of the values to contour, either a field or
+        # expression, or the geometry Z or M values
+
+        self.addParameter(
+            self._enumParameter(
+                self.PrmValueSource, tr("Source of values to contour"), optional=True
+            )
+        )
 
         self.addParameter(
             QgsProcessingParameterExpression(
                 self.PrmInputField,
-                tr("Value to contour"),
+                tr("Value to contour (if using field or expression)"),
                 parentLayerParameterName=self.PrmInputLayer,
+                optional=True,
+            )
+        )
+
+        # Area to contour, defined by an extent and/or mask polygons, and
+        # the buffer around it within which points are read so that the
+        # contours are correct at the edge of the area
+
+        self.addParameter(
+            QgsProcessingParameterExtent(
+                self.PrmClipExtent,
+                tr("Extent to contour (omit to contour all data)"),
+                optional=True,
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterFeatureSource(
+                self.PrmClipMask,
+                tr("Mask polygon layer (omit to contour all data)"),
+                [QgsProcessing.TypeVectorPolygon],
+                optional=True,
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.PrmClipBuffer,
+                tr("Buffer around extent or mask within which points are used"),
+                QgsProcessingParameterNumber.Double,
+                minValue=0.0,
+                defaultValue=0.0,
+                optional=True,
             )
         )
 
@@ -163,6 +282,104 @@ class ContourGeneratorAlgorithm(QgsProcessingAlgorithm):
             )
         )
 
+        # Approximate memory limit in MB for contouring.  If the data would
+        # need more than this they are thinned.  0 means no limit.
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.PrmMemoryLimit,
+                tr("Memory limit for contouring in MB (0 for no limit)"),
+                QgsProcessingParameterNumber.Double,
+                minValue=0.0,
+                defaultValue=0.0,
+                optional=True,
+            )
+        )
+
+        # Store coordinates as float32 offsets from an origin to reduce
+        # memory use for large data sets
+
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+                self.PrmCompactStorage,
+                tr("Compact storage of coordinates (float32 relative to origin)"),
+                False,
+                optional=True,
+            )
+        )
+
+        # Directory for memory mapped files holding the point data, for
+        # data sets too large to hold in memory
+
+        self.addParameter(
+            QgsProcessingParameterFile(
+                self.PrmScratchDirectory,
+                tr("Directory for memory mapped data files (omit to use memory)"),
+                behavior=QgsProcessingParameterFile.Folder,
+                optional=True,
+            )
+        )
+
+        # Resample data not on a grid onto a regular grid before contouring
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.PrmResampleCellSize,
+                tr("Resample scattered data to a grid with this cell size (0 for no resampling)"),
+                QgsProcessingParameterNumber.Double,
+                minValue=0.0,
+                defaultValue=0.0,
+                optional=True,
+            )
+        )
+
+        # Index triangles by the levels crossing them, for contouring with
+        # many levels
+
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+                self.PrmLevelIndex,
+                tr("Index contour levels (faster for many line contour levels)"),
+                False,
+                optional=True,
+            )
+        )
+
+        # Contour on a pool of worker processes
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.PrmParallelWorkers,
+                tr("Number of worker processes for contouring (0 to contour in QGIS)"),
+                minValue=0,
+                defaultValue=0,
+                optional=True,
+            )
+        )
+
+        # Triangulate scattered data in blocks on the worker processes
+
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+                self.PrmPartitioned,
+                tr("Triangulate scattered data in blocks (line contours only)"),
+                False,
+                optional=True,
+            )
+        )
+
+        # Read the input layer on multiple threads
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.PrmReadThreads,
+                tr("Number of threads reading the input layer (0 to read sequentially)"),
+                minValue=0,
+                defaultValue=0,
+                optional=True,
+            )
+        )
+
         # Define the contour type
 
         self.addParameter(self._enumParameter(self.PrmContourType, tr("Contour type")))
@@ -267,19 +484,269 @@ class ContourGeneratorAlgorithm(QgsProcessingAlgorithm):
         # Output layer for the contours
 
         self.addParameter(
-            QgsProcessingParameterFeatureSink(self.PrmOutputLayer, tr("Output layer"))
+            QgsProcessingParameterFeatureSink(
+                self.PrmOutputLayer,
+                tr("Output layer"),
+                optional=True,
+                createByDefault=True,
+            )
+        )
+
+        # Alternatively write the contours directly to a GeoPackage or
+        # FlatGeobuf file, committing every CommitSize features
+
+        self.addParameter(
+            QgsProcessingParameterFileDestination(
+                self.PrmOutputFile,
+                tr("Write contours directly to file (replaces output layer)"),
+                ContourFileWriter.FileFilter,
+                optional=True,
+                createByDefault=False,
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.PrmCommitSize,
+                tr("Number of features written to file per transaction"),
+                minValue=1,
+                defaultValue=ContourFileWriter.DefaultCommitSize,
+                optional=True,
+            )
+        )
+
+        # Generalised versions of the contours for a list of map scales,
+        # identified by a scale attribute
+
+        self.addParameter(
+            QgsProcessingParameterString(
+                self.PrmScales,
+                tr("Scales of generalised versions (eg 5000 25000 100000)"),
+                "",
+                optional=True,
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.PrmScaleTolerance,
+                tr("Generalisation tolerance in mm at each scale"),
+                QgsProcessingParameterNumber.Double,
+                minValue=0.0,
+                defaultValue=0.2,
+                optional=True,
+            )
         )
 
+        # Vector tile (MBTiles) output, simplified for each zoom level
+
+        self.addParameter(
+            QgsProcessingParameterFileDestination(
+                self.PrmOutputTiles,
+                tr("Vector tile (MBTiles) file"),
+                "MBTiles (*.mbtiles)",
+                optional=True,
+                createByDefault=False,
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.PrmTileMinZoom,
+                tr("Minimum vector tile zoom level"),
+                minValue=0,
+                maxValue=24,
+                defaultValue=0,
+                optional=True,
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.PrmTileMaxZoom,
+                tr("Maximum vector tile zoom level"),
+                minValue=0,
+                maxValue=24,
+                defaultValue=14,
+                optional=True,
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.PrmTileTolerance,
+                tr("Vector tile simplification tolerance (tile units of 4096)"),
+                QgsProcessingParameterNumber.Double,
+                minValue=0.0,
+                defaultValue=ContourTileWriter.Tolerance,
+                optional=True,
+            )
+        )
+
+        # Statistics of the contour generation
+
+        for name, counter, description in self.OutCounters:
+            self.addOutput(QgsProcessingOutputNumber(name, description))
+        self.addOutput(
+            QgsProcessingOutputString(
+                self.OutProfile, tr("Time spent in each stage (JSON)")
+            )
+        )
+
+    def _plainSourceDefinition(self, definition):
+        # True unless the input source definition selects a subset of the
+        # features or overrides the invalid geometry check
+        if not isinstance(definition, QgsProcessingFeatureSourceDefinition):
+            return True
+        return not (
+            definition.selectedFeaturesOnly
+            or definition.featureLimit >= 0
+            or getattr(definition, "filterExpression", "")
+            or definition.flags
+            & QgsProcessingFeatureSourceDefinition.FlagOverrideDefaultGeometryCheck
+        )
+
+    def prepareAlgorithm(self, parameters, context, feedback):
+        # Snapshots of the input layer for reading features on multiple
+        # threads must be created on the thread of the layer.  They are only
+        # used if the feature source is the whole layer, as they do not
+        # apply the options of the source definition.
+        self._readSnapshots = None
+        readThreads = self.parameterAsInt(parameters, self.PrmReadThreads, context)
+        nthreads = min(readThreads, os.cpu_count() or 1)
+        if nthreads > 1 and self._plainSourceDefinition(
+            parameters.get(self.PrmInputLayer)
+        ):
+            layer = self.parameterAsVectorLayer(
+                parameters, self.PrmInputLayer, context
+            )
+            if layer is not None:
+                self._readSnapshots = [
+                    QgsVectorLayerFeatureSource(layer) for i in range(nthreads)
+                ]
+        return True
+
+    def _maskGeometry(self, parameters, context, crs):
+        # Union of the mask polygons in the coordinate system crs, or None
+        # if there is no mask layer
+        mask = self.parameterAsSource(parameters, self.PrmClipMask, context)
+        if mask is None:
+            return None
+        request = QgsFeatureRequest()
+        request.setSubsetOfAttributes([])
+        request.setDestinationCrs(crs, context.transformContext())
+        geoms = [f.geometry() for f in mask.getFeatures(request) if f.hasGeometry()]
+        if len(geoms) == 0:
+            raise ContourGeneratorAlgorithmError(tr("The mask layer has no polygons"))
+        return QgsGeometry.unaryUnion(geoms)
+
+    def _parseScales(self, text):
+        # Scales from a list of values such as "5000 1:25000"
+        scales = []
+        for item in re.split(r"[\s,;]+", text.strip()):
+            if not item:
+                continue
+            value = item.split(":")[-1]
+            try:
+                scale = float(value)
+            except ValueError:
+                scale = 0.0
+            if not scale > 0:
+                raise ContourGeneratorAlgorithmError(
+                    tr("Invalid scale {0}").format(item)
+                )
+            scales.append(scale)
+        return sorted(set(scales))
+
+    def _scaleFeatures(self, feature, fields, tolerances):
+        # Generalised versions of a contour feature for each (scale,
+        # tolerance), each simplified from the version for the previous
+        # scale
+        geom = feature.geometry()
+        for scale, tolerance in tolerances:
+            geom = geom.simplify(tolerance)
+            if geom.isNull() or geom.isEmpty():
+                break
+            if not geom.isMultipart():
+                geom.convertToMultiType()
+            scaled = QgsFeature(fields)
+            scaled.setAttributes(feature.attributes() + [int(round(scale))])
+            scaled.setGeometry(geom)
+            yield scaled
+
+    def _addTileFeature(self, tileWriter, feature, transform):
+        # Add a contour feature to the vector tiles in web mercator
+        # coordinates
+        geom = feature.geometry()
+        if geom.isEmpty():
+            return
+        geom = QgsGeometry(geom)
+        geom.transform(transform)
+        attributes = {}
+        for field, value in zip(feature.fields(), feature.attributes()):
+            if value is None or (hasattr(value, "isNull") and value.isNull()):
+                continue
+            attributes[field.name()] = value
+        if QgsWkbTypes.geometryType(geom.wkbType()) == QgsWkbTypes.LineGeometry:
+            lines = [
+                np.array([(p.x(), p.y()) for p in line])
+                for line in geom.asMultiPolyline()
+            ]
+            tileWriter.addLine(lines, attributes)
+        else:
+            polygons = [
+                [np.array([(p.x(), p.y()) for p in ring]) for ring in polygon]
+                for polygon in geom.asMultiPolygon()
+            ]
+            tileWriter.addPolygon(polygons, attributes)
+
     def processAlgorithm(self, parameters, context, feedback):
 
         # Retrieve the contour parameters
 
         source = self.parameterAsSource(parameters, self.PrmInputLayer, context)
         field = self.parameterAsExpression(parameters, self.PrmInputField, context)
+        valueSource = self._getEnumValue(parameters, self.PrmValueSource, context)
+        if valueSource == ContourValueSource.field and not field:
+            raise ContourGeneratorAlgorithmError(
+                tr("The value to contour is not defined")
+            )
         DuplicatePointTolerance = self.parameterAsDouble(
             parameters, self.PrmDuplicatePointTolerance, context
         )
 
+        memoryLimit = self.parameterAsDouble(parameters, self.PrmMemoryLimit, context)
+        compactStorage = self.parameterAsBool(
+            parameters, self.PrmCompactStorage, context
+        )
+        scratchDirectory = self.parameterAsFile(
+            parameters, self.PrmScratchDirectory, context
+        )
+        resampleCellSize = self.parameterAsDouble(
+            parameters, self.PrmResampleCellSize, context
+        )
+        levelIndex = self.parameterAsBool(parameters, self.PrmLevelIndex, context)
+        parallelWorkers = self.parameterAsInt(
+            parameters, self.PrmParallelWorkers, context
+        )
+        partitioned = self.parameterAsBool(parameters, self.PrmPartitioned, context)
+        readThreads = self.parameterAsInt(parameters, self.PrmReadThreads, context)
+        if readThreads > 1 and not self._readSnapshots:
+            feedback.pushInfo(
+                tr(
+                    "Features are read on a single thread as the input is not "
+                    "a plain vector layer"
+                )
+            )
+
+        clipExtent = None
+        if parameters.get(self.PrmClipExtent):
+            clipExtent = self.parameterAsExtent(
+                parameters, self.PrmClipExtent, context, source.sourceCrs()
+            )
+        clipMask = self._maskGeometry(parameters, context, source.sourceCrs())
+        clipBuffer = self.parameterAsDouble(parameters, self.PrmClipBuffer, context)
+
         method = self._getEnumValue(parameters, self.PrmContourMethod, context)
 
         ncontour = self.parameterAsInt(parameters, self.PrmNContour, context)
@@ -297,6 +764,26 @@ class ContourGeneratorAlgorithm(QgsProcessingAlgorithm):
         labelndp = self.parameterAsInt(parameters, self.PrmLabelDecimalPlaces, context)
         labeltrim = self.parameterAsBool(parameters, self.PrmLabelTrimZeros, context)
         labelunits = self.parameterAsString(parameters, self.PrmLabelUnits, context)
+        outputFile = self.parameterAsFileOutput(parameters, self.PrmOutputFile, context)
+        commitSize = self.parameterAsInt(parameters, self.PrmCommitSize, context)
+        scales = self._parseScales(
+            self.parameterAsString(parameters, self.PrmScales, context)
+        )
+        scaleTolerance = self.parameterAsDouble(
+            parameters, self.PrmScaleTolerance, context
+        )
+        outputTiles = self.parameterAsFileOutput(
+            parameters, self.PrmOutputTiles, context
+        )
+        tileMinZoom = self.parameterAsInt(parameters, self.PrmTileMinZoom, context)
+        tileMaxZoom = self.parameterAsInt(parameters, self.PrmTileMaxZoom, context)
+        tileTolerance = self.parameterAsDouble(
+            parameters, self.PrmTileTolerance, context
+        )
+        if outputTiles and tileMaxZoom < tileMinZoom:
+            raise ContourGeneratorAlgorithmError(
+                tr("The maximum tile zoom level is less than the minimum")
+            )
 
         # Construct and configure the contour generator
 
@@ -309,33 +796,143 @@ class ContourGeneratorAlgorithm(QgsProcessingAlgorithm):
             "levels": levels,
         }
 
-        generator = ContourGenerator(source, field, feedback)
+        generator = ContourGenerator(feedback=feedback)
+        generator.setValueSource(valueSource)
+        generator.setDataSource(source, field)
+        if clipExtent is not None or clipMask is not None:
+            generator.setClipArea(clipExtent, clipMask, clipBuffer)
         generator.setDuplicatePointTolerance(DuplicatePointTolerance)
+        generator.setMemoryLimit(memoryLimit * 1024 * 1024)
+        generator.setCompactStorage(compactStorage)
+        generator.setScratchDirectory(scratchDirectory or None)
+        generator.setResampleCellSize(resampleCellSize)
+        generator.setLevelIndex(levelIndex)
+        generator.setParallelWorkers(parallelWorkers)
+        generator.setPartitionedTriangulation(partitioned)
+        generator.setReadThreads(readThreads, self._readSnapshots)
         generator.setContourMethod(method, params)
         generator.setContourType(contourtype)
         generator.setContourExtendOption(extend)
         generator.setLabelFormat(labelndp, labeltrim, labelunits)
 
-        # Create the destination layer
+        # Create the destination layer.  The generator is released and any
+        # output file which has not been completed is removed however the
+        # generation ends.
 
         dest_id = None
-        try:
-            wkbtype = generator.wkbtype()
-            fields = generator.fields()
-            crs = generator.crs()
-
-            (sink, dest_id) = self.parameterAsSink(
-                parameters, self.PrmOutputLayer, context, fields, wkbtype, crs
-            )
-
-            # Add features to the sink
-            for feature in generator.contourFeatures():
-                sink.addFeature(feature, QgsFeatureSink.FastInsert)
-
-        except (ContourError, ContourMethodError) as ex:
-            feedback.reportError(ex.message())
-
-        return {self.PrmOutputLayer: dest_id}
+        fileWriter = None
+        tileWriter = None
+        with generator:
+            try:
+                wkbtype = generator.wkbtype()
+                fields = generator.fields()
+                crs = generator.crs()
+
+                # Tolerances for generalised versions, converted from mm at
+                # each scale to map units
+                tolerances = []
+                if scales:
+                    fields.append(QgsField("scale", QVariant.Int, "Int"))
+                    factor = QgsUnitTypes.fromUnitToUnitFactor(
+                        QgsUnitTypes.DistanceMeters, crs.mapUnits()
+                    )
+                    tolerances = [
+                        (scale, scaleTolerance * scale / 1000.0 * factor)
+                        for scale in scales
+                    ]
+
+                if outputFile:
+                    fileWriter = ContourFileWriter(
+                        outputFile, fields, wkbtype, crs, commitSize=commitSize
+                    )
+                    sink = fileWriter
+                else:
+                    (sink, dest_id) = self.parameterAsSink(
+                        parameters, self.PrmOutputLayer, context, fields, wkbtype, crs
+                    )
+                if outputTiles:
+                    tileWriter = ContourTileWriter(
+                        outputTiles,
+                        "contours",
+                        tileMinZoom,
+                        tileMaxZoom,
+                        tolerance=tileTolerance,
+                    )
+                    tileTransform = QgsCoordinateTransform(
+                        crs,
+                        QgsCoordinateReferenceSystem("EPSG:3857"),
+                        context.transformContext(),
+                    )
+                if sink is None and tileWriter is None:
+                    raise ContourGeneratorAlgorithmError(tr("No output is selected"))
+
+                # Add features to the sink and vector tiles
+                profile = generator.profile()
+                with cprofileFromEnvironment():
+                    for feature in generator.contourFeatures():
+                        if feedback.isCanceled():
+                            break
+                        outputs = [feature]
+                        if tolerances:
+                            with profile.stage("generalise"):
+                                outputs = list(
+                                    self._scaleFeatures(feature, fields, tolerances)
+                                )
+                        with profile.stage("write"):
+                            for output in outputs:
+                                if sink is not None and sink.addFeature(
+                                    output, QgsFeatureSink.FastInsert
+                                ):
+                                    profile.count("features_written")
+                        if tileWriter is not None:
+                            with profile.stage("tiles"):
+                                try:
+                                    self._addTileFeature(
+                                        tileWriter, feature, tileTransform
+                                    )
+                                except QgsCsException:
+                                    feedback.reportError(
+                                        tr("Cannot transform contour to web mercator")
+                                    )
+                if feedback.isCanceled():
+                    raise ContourError(tr("Cancelled by user"))
+                if fileWriter is not None:
+                    with profile.stage("write"):
+                        fileWriter.close()
+                    fileWriter = None
+                if tileWriter is not None:
+                    with profile.stage("tiles"):
+                        ntiles = tileWriter.close(feedback.setProgress)
+                    tileWriter = None
+                    feedback.pushInfo(tr("{0} vector tiles written").format(ntiles))
+
+            except (ContourError, ContourMethodError) as ex:
+                feedback.reportError(ex.message())
+
+            finally:
+                # Writers still open here did not complete
+                if fileWriter is not None:
+                    fileWriter.discard()
+                    outputFile = None
+                if tileWriter is not None:
+                    tileWriter.discard()
+                    outputTiles = None
+                # Release the layer snapshots and their provider connections
+                generator.setReadThreads(0)
+                self._readSnapshots = None
+                profile = generator.profile()
+                profile.report(feedback)
+                profile.writeJsonFromEnvironment()
+
+        result = {
+            self.PrmOutputLayer: dest_id,
+            self.PrmOutputFile: outputFile or None,
+            self.PrmOutputTiles: outputTiles or None,
+        }
+        for name, counter, description in self.OutCounters:
+            result[name] = profile.counter(counter)
+        result[self.OutProfile] = json.dumps(profile.times())
+        return result
 
     def icon(self):
         return QIcon(":/plugins/contour/contour.png")
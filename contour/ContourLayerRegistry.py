@@ -0,0 +1,181 @@
+from PyQt5.QtCore import QObject
+from qgis.core import QgsMapLayer, QgsProject
+
+"""
+ContourLayerRegistry maintains an index of the contour layers in the
+project, identified by the ContourPlugin custom properties set on the
+layers created by the contour dialog.  The index is kept current from the
+project's layer added and removed signals so that finding the layers of a
+contour set does not require reading the properties of every layer in the
+project.
+"""
+
+
+class ContourLayerRegistry(QObject):
+    """
+    Index of the contour layers of a project by ContourId and by
+    SourceLayerId and SourceLayerAttr.  Layers whose contour properties are
+    changed after they are added to the project must be updated with
+    updateLayer().
+    """
+
+    PropertyPrefix = "ContourPlugin."
+
+    PropertyKeys = [
+        "ContourId",
+        "SourceLayerId",
+        "SourceLayerAttr",
+        "Mode",
+        "Levels",
+        "ContourInterval",
+        "NContour",
+        "LabelPrecision",
+        "MinContour",
+        "MaxContour",
+        "Extend",
+        "Method",
+        "ApplyColors",
+        "ColorRamp",
+        "ReverseRamp",
+    ]
+
+    def __init__(self, project=None):
+        QObject.__init__(self)
+        self._project = project or QgsProject.instance()
+        self._layers = {}
+        self._properties = {}
+        self._byContourId = {}
+        self._bySource = {}
+        self._project.layersAdded.connect(self._layersAdded)
+        self._project.layersWillBeRemoved.connect(self._layersRemoved)
+        self.rebuild()
+
+    def release(self):
+        """
+        Disconnect from the project signals and clear the index
+        """
+        try:
+            self._project.layersAdded.disconnect(self._layersAdded)
+            self._project.layersWillBeRemoved.disconnect(self._layersRemoved)
+        except (TypeError, RuntimeError):
+            pass
+        self._clear()
+
+    @staticmethod
+    def readProperties(layer):
+        """
+        The contour properties of a layer, or None if it is not a contour
+        layer
+        """
+        if (
+            layer.type() != QgsMapLayer.VectorLayer
+            or layer.dataProvider() is None
+            or layer.dataProvider().name() != "memory"
+        ):
+            return None
+        prefix = ContourLayerRegistry.PropertyPrefix
+        # Unset properties are None, which must not be read as the string
+        # "None" for the contour id
+        if not layer.customProperty(prefix + "ContourId"):
+            return None
+        properties = {}
+        for key in ContourLayerRegistry.PropertyKeys:
+            properties[key] = str(layer.customProperty(prefix + key))
+        return properties
+
+    def _clear(self):
+        self._layers = {}
+        self._properties = {}
+        self._byContourId = {}
+        self._bySource = {}
+
+    def rebuild(self):
+        """
+        Rebuild the index from all the layers in the project
+        """
+        self._clear()
+        for layer in self._project.mapLayers().values():
+            self._addLayer(layer)
+
+    def _sourceKey(self, properties):
+        return (properties["SourceLayerId"], properties["SourceLayerAttr"])
+
+    def _addLayer(self, layer):
+        properties = self.readProperties(layer)
+        if properties is None:
+            return
+        layerId = layer.id()
+        self._layers[layerId] = layer
+        self._properties[layerId] = properties
+        self._byContourId.setdefault(properties["ContourId"], set()).add(layerId)
+        self._bySource.setdefault(self._sourceKey(properties), set()).add(layerId)
+
+    def _removeLayer(self, layerId):
+        properties = self._properties.pop(layerId, None)
+        self._layers.pop(layerId, None)
+        if properties is None:
+            return
+        for index, key in (
+            (self._byContourId, properties["ContourId"]),
+            (self._bySource, self._sourceKey(properties)),
+        ):
+            ids = index.get(key)
+            if ids is not None:
+                ids.discard(layerId)
+                if not ids:
+                    del index[key]
+
+    def _layersAdded(self, layers):
+        for layer in layers:
+            self._removeLayer(layer.id())
+            self._addLayer(layer)
+
+    def _layersRemoved(self, layerIds):
+        for layerId in layerIds:
+            self._removeLayer(layerId)
+
+    def updateLayer(self, layer):
+        """
+        Update the index after the contour properties of a layer are
+        changed.  Layers that are not in the project are ignored, and will
+        be indexed when they are added.
+        """
+        self._removeLayer(layer.id())
+        if self._project.mapLayer(layer.id()) is layer:
+            self._addLayer(layer)
+
+    def properties(self, layer):
+        """
+        The contour properties of a layer, or None if it is not a contour
+        layer.  Properties of layers in the project are taken from the
+        index.
+        """
+        properties = self._properties.get(layer.id())
+        if properties is None and layer.id() not in self._layers:
+            properties = self.readProperties(layer)
+        return properties
+
+    def layers(self, wanted={}):
+        """
+        Generator returning the contour layers whose properties match the
+        values in wanted
+        """
+        if "ContourId" in wanted:
+            layerIds = self._byContourId.get(wanted["ContourId"], ())
+        elif "SourceLayerId" in wanted and "SourceLayerAttr" in wanted:
+            layerIds = self._bySource.get(self._sourceKey(wanted), ())
+        else:
+            layerIds = self._layers.keys()
+        for layerId in list(layerIds):
+            properties = self._properties[layerId]
+            if all(properties.get(key) == value for key, value in wanted.items()):
+                yield self._layers[layerId]
+
+    def layerSet(self, contourId):
+        """
+        The layers of a contour set as a dictionary keyed by mode
+        """
+        layerSet = {}
+        for layerId in self._byContourId.get(contourId, ()):
+            layerSet[self._properties[layerId]["Mode"]] = self._layers[layerId]
+        return layerSet
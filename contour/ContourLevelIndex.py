@@ -0,0 +1,179 @@
+import numpy as np
+
+from . import ContourUtils
+
+"""
+ContourLevelIndex calculates contour lines for large numbers of contour
+levels.  Each triangle (or grid cell, split into two triangles) is indexed
+by the range of contour levels that cross it, so that calculating the
+contour for a level only visits the triangles it crosses rather than every
+triangle.  The segments of each level are joined into lines by matching the
+triangle edges they cross.
+"""
+
+
+class ContourLevelIndex:
+    """
+    Index of the triangles of a triangulation by the contour levels that
+    cross them.
+
+    x, y, z are the coordinates and values at the nodes, triangles is an
+    (ntri,3) array of node indices, and levels is an increasing array of
+    contour levels.  mask is an optional boolean array of triangles to
+    ignore.  Triangles with any node value that is not finite are ignored.
+
+    A level crosses a triangle if min(z) < level <= max(z) over the
+    triangle's nodes.
+    """
+
+    def __init__(self, x, y, z, triangles, levels, mask=None):
+        self._x = np.asarray(x, dtype=np.float64)
+        self._y = np.asarray(y, dtype=np.float64)
+        self._z = np.asarray(z, dtype=np.float64)
+        self._levels = np.asarray(levels, dtype=np.float64)
+        triangles = np.asarray(triangles)
+        tz = self._z[triangles]
+        valid = np.all(np.isfinite(tz), axis=1)
+        if mask is not None:
+            valid &= ~np.asarray(mask, dtype=bool)
+        triangles = triangles[valid]
+        tz = tz[valid]
+        self._triangles = triangles
+
+        # Range of levels crossing each triangle is [lo, hi)
+        lo = np.searchsorted(self._levels, np.min(tz, axis=1), side="right")
+        hi = np.searchsorted(self._levels, np.max(tz, axis=1), side="right")
+        counts = hi - lo
+        ncross = int(np.sum(counts))
+
+        # Bucket the triangles by level (compressed sparse row form).  For
+        # each crossing the level id is lo plus the offset of the crossing
+        # within the triangle's range.
+        tri = np.repeat(np.arange(len(triangles)), counts)
+        starts = np.cumsum(counts) - counts
+        levelid = np.repeat(lo, counts) + (
+            np.arange(ncross) - np.repeat(starts, counts)
+        )
+        order = np.argsort(levelid, kind="stable")
+        self._bucketTriangles = tri[order]
+        nlevel = len(self._levels)
+        self._bucketStart = np.zeros(nlevel + 1, dtype=int)
+        self._bucketStart[1:] = np.cumsum(np.bincount(levelid, minlength=nlevel))
+
+    @staticmethod
+    def fromTriangulation(trig, z, levels):
+        """
+        Create an index from a matplotlib Triangulation
+        """
+        return ContourLevelIndex(trig.x, trig.y, z, trig.triangles, levels, trig.mask)
+
+    @staticmethod
+    def fromGrid(gx, gy, gz, levels):
+        """
+        Create an index for gridded data by splitting each grid cell into
+        two triangles.  gx and gy may be 1d arrays of column and row
+        coordinates or 2d arrays the same shape as gz.  Masked values of
+        gz are ignored.
+        """
+        gz = np.ma.filled(np.ma.asarray(gz, dtype=np.float64), np.nan)
+        nrow, ncol = gz.shape
+        if np.ndim(gx) == 1:
+            gx, gy = np.meshgrid(gx, gy)
+        node = np.arange(nrow * ncol).reshape(nrow, ncol)
+        n00 = node[:-1, :-1].ravel()
+        n01 = node[:-1, 1:].ravel()
+        n10 = node[1:, :-1].ravel()
+        n11 = node[1:, 1:].ravel()
+        triangles = np.vstack(
+            (
+                np.column_stack((n00, n01, n11)),
+                np.column_stack((n00, n11, n10)),
+            )
+        )
+        return ContourLevelIndex(gx.ravel(), gy.ravel(), gz.ravel(), triangles, levels)
+
+    def levels(self):
+        return self._levels
+
+    def crossingTriangles(self, i):
+        """
+        Indices of the triangles crossed by the i'th level
+        """
+        return self._bucketTriangles[self._bucketStart[i] : self._bucketStart[i + 1]]
+
+    def levelSegments(self, i):
+        """
+        Contour line segments for the i'th level as an (nseg,2,2) array
+        of segment end point coordinates.
+        """
+        return self._levelCrossings(i)[0]
+
+    def levelLines(self, i):
+        """
+        Contour lines for the i'th level as a list of (n,2) arrays.  The
+        segments are joined where they cross the same triangle edge, which
+        is exact rather than depending on the calculated coordinates.
+        """
+        segments, edges = self._levelCrossings(i)
+        if len(segments) == 0:
+            return []
+        # Each edge inside the triangulation is crossed by the segments of
+        # the two triangles sharing it
+        nnode = len(self._x)
+        keys = (np.min(edges, axis=2) * nnode + np.max(edges, axis=2)).ravel()
+        order = np.argsort(keys, kind="stable")
+        sortedKeys = keys[order]
+        same = np.zeros(len(keys) + 1, dtype=bool)
+        same[1:-1] = sortedKeys[1:] == sortedKeys[:-1]
+        pair = np.flatnonzero(same[1:-1] & ~same[:-2] & ~same[2:])
+        partner = np.full(len(keys), -1, dtype=np.int64)
+        partner[order[pair]] = order[pair + 1]
+        partner[order[pair + 1]] = order[pair]
+        return ContourUtils.chainLines(segments, partner)
+
+    def _levelCrossings(self, i):
+        # Segments of the i'th level and the pairs of nodes of the triangle
+        # edges crossed at each end, as an (nseg,2,2) array
+        level = self._levels[i]
+        tri = self._triangles[self.crossingTriangles(i)]
+        if len(tri) == 0:
+            return np.zeros((0, 2, 2)), np.zeros((0, 2, 2), dtype=np.int64)
+        x = self._x[tri]
+        y = self._y[tri]
+        z = self._z[tri]
+        above = z >= level
+        # Edges 0-1, 1-2, 2-0.  Exactly two edges of each crossed triangle
+        # have end nodes on different sides of the level.
+        ea = np.array([0, 1, 2])
+        eb = np.array([1, 2, 0])
+        crosses = above[:, ea] != above[:, eb]
+        za = z[:, ea]
+        zb = z[:, eb]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            t = np.where(crosses, (level - za) / (zb - za), 0.0)
+        px = x[:, ea] + t * (x[:, eb] - x[:, ea])
+        py = y[:, ea] + t * (y[:, eb] - y[:, ea])
+        # Select the two crossing edges of each triangle in edge order
+        edge = np.argsort(~crosses, axis=1, kind="stable")[:, :2]
+        rows = np.arange(len(tri))[:, np.newaxis]
+        segments = np.empty((len(tri), 2, 2))
+        segments[:, :, 0] = px[rows, edge]
+        segments[:, :, 1] = py[rows, edge]
+        edges = np.empty((len(tri), 2, 2), dtype=np.int64)
+        edges[:, :, 0] = tri[rows, ea[edge]]
+        edges[:, :, 1] = tri[rows, eb[edge]]
+        return segments, edges
+
+    def allSegments(self):
+        """
+        Generator returning (level, segments) for each level in turn
+        """
+        for i, level in enumerate(self._levels):
+            yield level, self.levelSegments(i)
+
+    def allLines(self):
+        """
+        Generator returning (level, lines) for each level in turn
+        """
+        for i, level in enumerate(self._levels):
+            yield level, self.levelLines(i)
@@ -0,0 +1,308 @@
+import multiprocessing
+import os
+import sys
+
+import numpy as np
+from multiprocessing import shared_memory
+
+from . import ContourUtils
+
+"""
+ContourParallel calculates contours on a pool of worker processes.  The
+triangulation (or grid) and data values are placed in shared memory once,
+and each worker contours a subset of the contour levels.  Results are
+returned in level order.
+
+Alternatively scattered points can be split into spatial blocks which are
+each triangulated and contoured by a worker, and the resulting contour
+lines clipped to the blocks and joined along the block boundaries.
+
+This module does not use QGIS so that the worker processes only need
+numpy and matplotlib.
+"""
+
+# Per-process state of worker processes, set by _initWorker
+
+_worker = {}
+
+
+def _pythonExecutable():
+    # Embedded python (eg QGIS) may have sys.executable set to the
+    # application rather than the python interpreter required to run
+    # worker processes
+    exe = sys.executable
+    if os.path.basename(exe).lower().startswith("python"):
+        return exe
+    for dir in (sys.exec_prefix, os.path.join(sys.exec_prefix, "bin")):
+        for name in ("python3.exe", "python.exe", "python3", "python"):
+            path = os.path.join(dir, name)
+            if os.path.isfile(path):
+                return path
+    return exe
+
+
+def _attachArray(spec):
+    name, shape, dtype = spec
+    shm = shared_memory.SharedMemory(name=name)
+    return shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+
+def _initWorker(specs):
+    import matplotlib
+
+    matplotlib.use("Agg")
+    from matplotlib import pyplot
+    from matplotlib.tri import Triangulation
+
+    arrays = {}
+    blocks = []
+    for key, spec in specs.items():
+        shm, array = _attachArray(spec)
+        blocks.append(shm)
+        arrays[key] = array
+    _worker.clear()
+    _worker["blocks"] = blocks
+    _worker["pyplot"] = pyplot
+    if "triangles" in arrays:
+        _worker["trig"] = Triangulation(
+            arrays["x"], arrays["y"], arrays["triangles"], arrays.get("mask")
+        )
+        _worker["z"] = arrays["z"]
+    elif arrays["z"].ndim == 1:
+        _worker["points"] = (arrays["x"], arrays["y"], arrays["z"])
+    else:
+        z = arrays["z"]
+        if "zmask" in arrays:
+            z = np.ma.masked_array(z, mask=arrays["zmask"])
+        _worker["grid"] = (arrays["x"], arrays["y"], z)
+
+
+def _contour(filled, levels, extend="neither"):
+    pyplot = _worker["pyplot"]
+    if "trig" in _worker:
+        trig = _worker["trig"]
+        z = _worker["z"]
+        if filled:
+            return pyplot.tricontourf(trig, z, levels, extend=extend)
+        return pyplot.tricontour(trig, z, levels)
+    gx, gy, gz = _worker["grid"]
+    if filled:
+        return pyplot.contourf(gx, gy, gz, levels, extend=extend)
+    return pyplot.contour(gx, gy, gz, levels)
+
+
+def _pathLists(cs):
+    try:
+        return [list(c.get_paths()) for c in cs.collections]
+    except AttributeError:
+        return [[p] for p in cs.get_paths()]
+
+
+def _partitionTask(levels, core, extent):
+    # Triangulate and contour the points within extent, and clip the
+    # contour lines to core
+    pyplot = _worker["pyplot"]
+    x, y, z = _worker["points"]
+    xmin, ymin, xmax, ymax = extent
+    index = np.flatnonzero((x >= xmin) & (x <= xmax) & (y >= ymin) & (y <= ymax))
+    result = [[] for level in levels]
+    if len(index) < 3:
+        return result
+    trig = ContourUtils.buildTriangulation(x[index], y[index])
+    cs = pyplot.tricontour(trig, z[index], levels)
+    for pieces, segs in zip(result, cs.allsegs):
+        for line in segs:
+            pieces.extend(ContourUtils.clipLine(line, core))
+    ContourUtils.releaseContourSet(cs)
+    return result
+
+
+def _contourTask(task):
+    kind, levels, option = task
+    if kind == "partition":
+        result = _partitionTask(levels, *option)
+    elif kind == "line":
+        cs = _contour(False, levels)
+        result = [(float(l), list(segs)) for l, segs in zip(cs.levels, cs.allsegs)]
+        ContourUtils.releaseContourSet(cs)
+    elif kind == "filled":
+        cs = _contour(True, levels, option)
+        result = _pathLists(cs)
+        ContourUtils.releaseContourSet(cs)
+    else:
+        result = []
+        for level in levels:
+            cs = _contour(True, [level, option], "neither")
+            pathlists = _pathLists(cs)
+            ContourUtils.releaseContourSet(cs)
+            result.append(pathlists[0] if len(pathlists) > 0 else None)
+    return result
+
+
+def partitionBlocks(x, y, nblocks, buffer):
+    """
+    Split the extent of points x, y into about nblocks blocks with similar
+    numbers of points.  Returns a list of (core, extent) tuples, where core
+    is the area (xmin, ymin, xmax, ymax) contoured from the block, which is
+    unbounded on the outside edges, and extent is the finite area of the
+    points triangulated for the block, the core expanded by buffer.
+    """
+    nblocks = max(1, int(nblocks))
+    width = np.ptp(x)
+    height = np.ptp(y)
+    ncol = nblocks
+    if height > 0:
+        ncol = int(round(np.sqrt(nblocks * width / height)))
+    ncol = max(1, min(ncol, nblocks))
+    nrow = max(1, int(round(nblocks / ncol)))
+    limits = (
+        np.min(x) - buffer,
+        np.min(y) - buffer,
+        np.max(x) + buffer,
+        np.max(y) + buffer,
+    )
+    xb = np.quantile(x, np.linspace(0.0, 1.0, ncol + 1))
+    xb[0] = -np.inf
+    xb[-1] = np.inf
+    blocks = []
+    for c in range(ncol):
+        incol = (x >= xb[c]) & (x <= xb[c + 1])
+        yb = np.quantile(y[incol], np.linspace(0.0, 1.0, nrow + 1))
+        yb[0] = -np.inf
+        yb[-1] = np.inf
+        for r in range(nrow):
+            core = (xb[c], yb[r], xb[c + 1], yb[r + 1])
+            extent = (
+                max(core[0] - buffer, limits[0]),
+                max(core[1] - buffer, limits[1]),
+                min(core[2] + buffer, limits[2]),
+                min(core[3] + buffer, limits[3]),
+            )
+            blocks.append((core, extent))
+    return blocks
+
+
+class ContourPool:
+    """
+    Pool of worker processes contouring data held in shared memory.
+
+    For triangulated data arrays should contain x, y, triangles, z, and
+    optionally mask (the triangulation mask).  For gridded data arrays
+    should contain x, y, and z as 2d arrays, and optionally zmask.  For
+    partitioned triangulation of scattered points arrays should contain
+    x, y, and z as 1d arrays.
+
+    The pool should be closed with close(), or used as a context manager.
+    """
+
+    ChunksPerWorker = 4
+
+    def __init__(self, nworkers, arrays):
+        self._nworkers = max(1, int(nworkers))
+        self._blocks = []
+        self._pool = None
+        specs = {}
+        try:
+            for key, array in arrays.items():
+                if array is None:
+                    continue
+                array = np.ascontiguousarray(array)
+                shm = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+                self._blocks.append(shm)
+                np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[...] = array
+                specs[key] = (shm.name, array.shape, array.dtype.str)
+            context = multiprocessing.get_context("spawn")
+            context.set_executable(_pythonExecutable())
+            self._pool = context.Pool(
+                self._nworkers, initializer=_initWorker, initargs=(specs,)
+            )
+        except Exception:
+            self.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+        for shm in self._blocks:
+            shm.close()
+            shm.unlink()
+        self._blocks = []
+
+    def _chunks(self, n):
+        # Split range(n) into contiguous (start, end) ranges
+        nchunk = max(1, min(n, self._nworkers * self.ChunksPerWorker))
+        bounds = np.linspace(0, n, nchunk + 1).round().astype(int)
+        return [(s, e) for s, e in zip(bounds[:-1], bounds[1:]) if e > s]
+
+    def _run(self, tasks):
+        # Results of each task in order, each a list of per level results
+        for result in self._pool.imap(_contourTask, tasks):
+            for item in result:
+                yield item
+
+    def lines(self, levels):
+        """
+        Contour lines for each level, returned in order as (level, lines)
+        where lines is a list of (n,2) coordinate arrays
+        """
+        levels = [float(l) for l in levels]
+        tasks = [("line", levels[s:e], None) for s, e in self._chunks(len(levels))]
+        return self._run(tasks)
+
+    def filled(self, levels, extend):
+        """
+        Filled contour paths for each band between levels, including the
+        bands below the first and above the last level if extend requires,
+        returned in order as lists of matplotlib paths.
+        """
+        levels = [float(l) for l in levels]
+        below = extend in ("both", "min")
+        above = extend in ("both", "max")
+        nband = len(levels) - 1
+        chunks = self._chunks(nband) if nband > 0 else [(0, 0)]
+        tasks = []
+        for ichunk, (s, e) in enumerate(chunks):
+            chunkBelow = below and ichunk == 0
+            chunkAbove = above and ichunk == len(chunks) - 1
+            option = (
+                "both"
+                if chunkBelow and chunkAbove
+                else "min" if chunkBelow else "max" if chunkAbove else "neither"
+            )
+            tasks.append(("filled", levels[s : e + 1], option))
+        return self._run(tasks)
+
+    def layers(self, levels, zmax):
+        """
+        Paths of the area above each level (up to zmax), returned in order
+        as lists of matplotlib paths, or None if there is no area.
+        """
+        levels = [float(l) for l in levels]
+        tasks = [
+            ("layer", levels[s:e], float(zmax)) for s, e in self._chunks(len(levels))
+        ]
+        return self._run(tasks)
+
+    def partitionedLines(self, levels, blocks):
+        """
+        Contour lines for each level calculated by triangulating each of the
+        blocks from partitionBlocks separately.  Returns a list of (level,
+        lines) where lines is a list of (n,2) coordinate arrays.  Lines cut
+        at block boundaries are returned as separate pieces, to be joined
+        with ContourUtils.mergeLines.
+        """
+        levels = [float(l) for l in levels]
+        pieces = [[] for level in levels]
+        tasks = [("partition", levels, block) for block in blocks]
+        for result in self._pool.imap_unordered(_contourTask, tasks):
+            for levelPieces, blockPieces in zip(pieces, result):
+                levelPieces.extend(line for line, start, end in blockPieces)
+        return list(zip(levels, pieces))
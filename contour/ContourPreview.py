@@ -0,0 +1,140 @@
+import time
+
+from PyQt5.QtCore import QObject, QTimer
+from PyQt5.QtGui import QColor
+from qgis.core import (
+    QgsCoordinateTransform,
+    QgsCsException,
+    QgsGeometry,
+    QgsPointXY,
+    QgsProject,
+    QgsWkbTypes,
+)
+from qgis.gui import QgsRubberBand
+
+from .ContourGenerator import ContourError
+from .ContourMethod import ContourMethodError
+
+"""
+ContourPreview draws approximate contour lines on the map canvas as a
+temporary overlay while the contouring parameters are being edited.
+"""
+
+
+class ContourPreview(QObject):
+    """
+    Manages a set of rubber bands on the map canvas showing a low resolution
+    preview of the contour lines of a ContourGenerator.
+
+    Updates are debounced - schedule() restarts a timer so that a burst of
+    changes results in a single update.  The number of points used for the
+    preview is adjusted after each update to keep the time taken within
+    LatencyBudget seconds.
+    """
+
+    Delay = 300
+    LatencyBudget = 0.5
+    MinPoints = 2000
+    MaxPoints = 100000
+
+    def __init__(self, canvas, generator):
+        QObject.__init__(self)
+        self._canvas = canvas
+        self._generator = generator
+        self._enabled = False
+        self._bands = []
+        self._maxPoints = 20000
+        self._colorFunc = None
+        self._suspended = False
+        self._pending = False
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.timeout.connect(self.update)
+
+    def setEnabled(self, enabled):
+        self._enabled = enabled
+        if enabled:
+            self.schedule()
+        else:
+            self._timer.stop()
+            self.clear()
+
+    def isEnabled(self):
+        return self._enabled
+
+    def setColorFunction(self, func):
+        """
+        Set a function func(i, nlevels) returning the QColor used to draw
+        the i'th preview level.
+        """
+        self._colorFunc = func
+
+    def schedule(self):
+        if self._enabled:
+            self._timer.start(self.Delay)
+
+    def suspend(self, suspended):
+        """
+        While suspended, for example while the generator is loading data,
+        updates are deferred until the preview is resumed.
+        """
+        self._suspended = suspended
+        if not suspended and self._pending:
+            self._pending = False
+            self.schedule()
+
+    def clear(self):
+        scene = self._canvas.scene()
+        for band in self._bands:
+            scene.removeItem(band)
+        self._bands = []
+
+    def _levelColor(self, i, nlevels):
+        if self._colorFunc is not None:
+            try:
+                color = self._colorFunc(i, nlevels)
+                if color is not None:
+                    return color
+            except Exception:
+                pass
+        return QColor(255, 0, 0)
+
+    def update(self):
+        if self._suspended:
+            self._pending = True
+            return
+        self.clear()
+        if not self._enabled:
+            return
+        start = time.time()
+        try:
+            levels = self._generator.previewLines(self._maxPoints)
+        except (ContourError, ContourMethodError):
+            return
+        transform = QgsCoordinateTransform(
+            self._generator.crs(),
+            self._canvas.mapSettings().destinationCrs(),
+            QgsProject.instance(),
+        )
+        nlevels = len(levels)
+        for i, level in enumerate(levels):
+            lines = [[QgsPointXY(x, y) for x, y in line] for line in level[1]]
+            if len(lines) == 0:
+                continue
+            geom = QgsGeometry.fromMultiPolylineXY(lines)
+            try:
+                geom.transform(transform)
+            except QgsCsException:
+                continue
+            band = QgsRubberBand(self._canvas, QgsWkbTypes.LineGeometry)
+            band.setColor(self._levelColor(i, nlevels))
+            band.setWidth(1)
+            band.setToGeometry(geom, None)
+            self._bands.append(band)
+        elapsed = time.time() - start
+        if elapsed > self.LatencyBudget:
+            self._maxPoints = max(
+                self.MinPoints, int(self._maxPoints * self.LatencyBudget / elapsed)
+            )
+        elif elapsed < self.LatencyBudget / 4:
+            self._maxPoints = min(self.MaxPoints, self._maxPoints * 2)
@@ -0,0 +1,197 @@
+import cProfile
+import json
+import os
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+"""
+ContourProfile records the time spent in each stage of contour generation,
+counters of the data processed by each stage, and the memory used by each
+stage.
+
+Environment variables enable additional profiling output:
+
+    CONTOUR_PROFILE_JSON   file to which the profile is written as JSON
+    CONTOUR_CPROFILE       file to which cProfile statistics are written
+    CONTOUR_TRACEMALLOC    if set then tracemalloc is used to measure the
+                           peak memory allocated in each stage
+"""
+
+ProfileJsonEnv = "CONTOUR_PROFILE_JSON"
+CProfileEnv = "CONTOUR_CPROFILE"
+TraceMallocEnv = "CONTOUR_TRACEMALLOC"
+
+
+class ContourProfile:
+
+    # Counters recorded during contour generation, with descriptions
+    # used for reporting
+
+    Counters = [
+        ("points_read", "Points read"),
+        ("points_discarded", "Points discarded"),
+        ("triangles", "Triangles"),
+        ("masked_triangles", "Masked triangles"),
+        ("vertices", "Vertices emitted"),
+        ("merged_parts", "Line parts removed by merging"),
+        ("merged_vertices", "Vertices removed by merging"),
+        ("invalid_geometries", "Invalid geometries repaired or discarded"),
+        ("features", "Contour features"),
+        ("features_written", "Features written"),
+    ]
+
+    def __init__(self, traceMemory=None):
+        if traceMemory is None:
+            traceMemory = bool(os.environ.get(TraceMallocEnv))
+        self._traceMemory = traceMemory
+        self._stack = []
+        self.reset()
+
+    def reset(self):
+        self._times = {}
+        self._counters = {}
+        self._memory = {}
+        self._peaks = {}
+
+    def setTraceMemory(self, traceMemory):
+        """
+        Enable or disable measuring the peak memory allocated in each stage
+        with tracemalloc.  This slows down the code being profiled.
+        """
+        self._traceMemory = traceMemory
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Context manager timing a stage.  Times for stages entered more
+        than once are accumulated.  Stages may be nested, in which case the
+        time recorded for the outer stage excludes the time spent in the
+        inner stages, so that the stage times add up to the total time.
+        If memory tracing is enabled then the peak memory allocated during
+        the stage (including any inner stages) is also recorded.
+        """
+        tracing = self._traceMemory
+        # Each frame of the stack holds the time spent in inner stages and
+        # the peak traced memory before the last inner stage reset it
+        frame = {"inner": 0.0, "peak": 0}
+        if tracing:
+            started = not tracemalloc.is_tracing()
+            if started:
+                tracemalloc.start()
+            current, peak = tracemalloc.get_traced_memory()
+            if self._stack:
+                parent = self._stack[-1]
+                parent["peak"] = max(parent["peak"], peak)
+            base = current
+            if hasattr(tracemalloc, "reset_peak"):
+                tracemalloc.reset_peak()
+        self._stack.append(frame)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self._stack.pop()
+            exclusive = max(0.0, elapsed - frame["inner"])
+            self._times[name] = self._times.get(name, 0.0) + exclusive
+            if self._stack:
+                self._stack[-1]["inner"] += elapsed
+            if tracing:
+                peak = max(frame["peak"], tracemalloc.get_traced_memory()[1])
+                self._peaks[name] = max(self._peaks.get(name, 0), peak - base)
+                if self._stack:
+                    parent = self._stack[-1]
+                    parent["peak"] = max(parent["peak"], peak)
+                if started:
+                    tracemalloc.stop()
+
+    def recordMemory(self, name, *arrays):
+        """
+        Record the memory used by numpy arrays held by a stage.  The
+        largest value recorded for the stage is kept.
+        """
+        nbytes = sum(a.nbytes for a in arrays if a is not None)
+        self._memory[name] = max(self._memory.get(name, 0), nbytes)
+        return nbytes
+
+    def count(self, name, n=1):
+        self._counters[name] = self._counters.get(name, 0) + int(n)
+
+    def times(self):
+        return dict(self._times)
+
+    def counter(self, name):
+        return self._counters.get(name, 0)
+
+    def counters(self):
+        return dict(self._counters)
+
+    def memory(self):
+        """
+        Memory in bytes held in arrays by each stage
+        """
+        return dict(self._memory)
+
+    def peakMemory(self):
+        """
+        Peak memory in bytes allocated by each stage as measured by
+        tracemalloc, if memory tracing is enabled
+        """
+        return dict(self._peaks)
+
+    def asDict(self):
+        return {
+            "times": self.times(),
+            "counters": self.counters(),
+            "memory": self.memory(),
+            "peak_memory": self.peakMemory(),
+        }
+
+    def report(self, feedback):
+        """
+        Report the stage times and counters using feedback.pushInfo
+        """
+        for name, elapsed in self._times.items():
+            feedback.pushInfo("{0}: {1:.3f} seconds".format(name, elapsed))
+        for name, description in self.Counters:
+            if name in self._counters:
+                feedback.pushInfo("{0}: {1}".format(description, self._counters[name]))
+        mb = 1024.0 * 1024.0
+        for name, nbytes in self._memory.items():
+            feedback.pushInfo("{0} arrays: {1:.1f} MB".format(name, nbytes / mb))
+        for name, nbytes in self._peaks.items():
+            feedback.pushInfo("{0} peak memory: {1:.1f} MB".format(name, nbytes / mb))
+
+    def writeJson(self, filename):
+        with open(filename, "w") as pf:
+            json.dump(self.asDict(), pf, indent=2)
+
+    def writeJsonFromEnvironment(self):
+        """
+        Write the profile to the file named by CONTOUR_PROFILE_JSON if it is
+        set.  Returns the file name or None.
+        """
+        filename = os.environ.get(ProfileJsonEnv)
+        if filename:
+            self.writeJson(filename)
+        return filename or None
+
+
+@contextmanager
+def cprofileFromEnvironment():
+    """
+    Context manager capturing a cProfile profile of the enclosed code if
+    CONTOUR_CPROFILE is set, writing the statistics to the file it names.
+    """
+    filename = os.environ.get(CProfileEnv)
+    if not filename:
+        yield None
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        profiler.dump_stats(filename)
@@ -0,0 +1,481 @@
+import gzip
+import json
+import math
+import os
+import sqlite3
+import struct
+
+import numpy as np
+
+from . import ContourUtils
+
+"""
+ContourTiles writes contour geometries as a pyramid of Mapbox vector tiles
+in an MBTiles file.  The contours are calculated once and added in web
+mercator (EPSG:3857) coordinates.  For each zoom level, from the most
+detailed down, the geometries are simplified with a tolerance matched to
+the tile resolution, clipped to the (buffered) tile bounds, and quantized
+to tile coordinates.
+
+The vector tile protocol buffer encoding is implemented here so that no
+additional python modules are required.  This module does not use QGIS.
+"""
+
+# Half the width of the web mercator world, and the earth radius used for
+# the projection
+
+WorldHalfWidth = 20037508.342789244
+EarthRadius = 6378137.0
+
+# Vector tile geometry types and commands
+
+GeomLine = 2
+GeomPolygon = 3
+
+_cmdMoveTo = 1
+_cmdLineTo = 2
+_cmdClosePath = 7
+
+
+def _varints(values):
+    # Protocol buffer varint encoding of an array of unsigned integers
+    values = np.asarray(values, dtype=np.uint64)
+    if len(values) == 0:
+        return b""
+    nbytes = np.ones(len(values), dtype=np.int64)
+    rest = values >> np.uint64(7)
+    while np.any(rest):
+        nbytes += rest > 0
+        rest = rest >> np.uint64(7)
+    offsets = np.cumsum(nbytes) - nbytes
+    encoded = np.empty(int(np.sum(nbytes)), dtype=np.uint8)
+    rest = values.copy()
+    for i in range(int(np.max(nbytes))):
+        active = nbytes > i
+        more = (nbytes[active] > i + 1).astype(np.uint8) << 7
+        low = (rest[active] & np.uint64(0x7F)).astype(np.uint8)
+        encoded[offsets[active] + i] = low | more
+        rest = rest >> np.uint64(7)
+    return encoded.tobytes()
+
+
+def _varint(value):
+    return _varints([value])
+
+
+def _zigzag(values):
+    values = np.asarray(values, dtype=np.int64)
+    return ((values << 1) ^ (values >> 63)).astype(np.uint64)
+
+
+def _key(field, wiretype):
+    return _varint((field << 3) | wiretype)
+
+
+def _bytesField(field, data):
+    return _key(field, 2) + _varint(len(data)) + data
+
+
+def _value(value):
+    # Encode a vector tile Value message
+    if isinstance(value, bool):
+        return _key(7, 0) + _varint(int(value))
+    if isinstance(value, (int, np.integer)):
+        return _key(6, 0) + _varints(_zigzag([value]))
+    if isinstance(value, (float, np.floating)):
+        return _key(3, 1) + struct.pack("<d", value)
+    return _bytesField(1, str(value).encode("utf8"))
+
+
+def mercatorToLonLat(x, y):
+    """
+    Convert web mercator coordinates to longitude and latitude in degrees
+    """
+    lon = np.degrees(np.asarray(x) / EarthRadius)
+    lat = np.degrees(2.0 * np.arctan(np.exp(np.asarray(y) / EarthRadius)) - np.pi / 2)
+    return lon, lat
+
+
+def encodeGeometry(parts, geomType):
+    """
+    Encode the geometry of a feature as vector tile commands.  parts is a
+    list of (n,2) integer arrays of tile coordinates.  For polygons the
+    parts are rings with the closing point omitted, exterior rings wound
+    with positive area followed by their interior rings.
+    """
+    commands = []
+    cursor = np.zeros(2, dtype=np.int64)
+    for part in parts:
+        deltas = np.diff(part, axis=0, prepend=cursor[np.newaxis, :])
+        cursor = part[-1]
+        params = _zigzag(deltas.ravel())
+        commands.append(np.array([_cmdMoveTo | (1 << 3)], dtype=np.uint64))
+        commands.append(params[:2])
+        lineTo = _cmdLineTo | ((len(part) - 1) << 3)
+        commands.append(np.array([lineTo], dtype=np.uint64))
+        commands.append(params[2:])
+        if geomType == GeomPolygon:
+            commands.append(np.array([_cmdClosePath | (1 << 3)], dtype=np.uint64))
+    if not commands:
+        return b""
+    return _varints(np.concatenate(commands))
+
+
+class _TileLayer:
+    # Accumulates the features of one layer of a tile
+
+    def __init__(self):
+        self._features = []
+        self._keys = {}
+        self._values = {}
+
+    def _index(self, table, item):
+        if item not in table:
+            table[item] = len(table)
+        return table[item]
+
+    def addFeature(self, geomType, parts, attributes):
+        tags = []
+        for name, value in attributes.items():
+            if value is None:
+                continue
+            tags.append(self._index(self._keys, name))
+            tags.append(self._index(self._values, (type(value).__name__, value)))
+        feature = (
+            _bytesField(2, _varints(tags))
+            + _key(3, 0)
+            + _varint(geomType)
+            + _bytesField(4, encodeGeometry(parts, geomType))
+        )
+        self._features.append(feature)
+
+    def encode(self, name, extent):
+        layer = [_key(15, 0) + _varint(2), _bytesField(1, name.encode("utf8"))]
+        for feature in self._features:
+            layer.append(_bytesField(2, feature))
+        for key in self._keys:
+            layer.append(_bytesField(3, key.encode("utf8")))
+        for typename, value in self._values:
+            layer.append(_bytesField(4, _value(value)))
+        layer.append(_key(5, 0) + _varint(extent))
+        return _bytesField(3, b"".join(layer))
+
+
+class ContourTileWriter:
+    """
+    Writes contour features as a vector tile pyramid to an MBTiles file.
+
+    Features are added with addLine or addPolygon, with coordinates in web
+    mercator (EPSG:3857) metres, and the tiles for zoom levels minZoom to
+    maxZoom are written by close().  Geometries are simplified at each zoom
+    so that no vertex moves more than tolerance tile units (of extent
+    units across the tile) and clipped to the tile expanded by buffer tile
+    units.  The simplification of each zoom starts from that of the next
+    more detailed zoom.
+
+    The writer should be closed with close(), or used as a context
+    manager.  The tiles are written to a temporary file which replaces the
+    MBTiles file once it is complete, so that a failed or discarded writer
+    leaves no partial file.
+    """
+
+    Extent = 4096
+    Buffer = 64
+    Tolerance = 8.0
+
+    def __init__(
+        self,
+        filename,
+        layerName,
+        minZoom=0,
+        maxZoom=14,
+        tolerance=None,
+        extent=None,
+        buffer=None,
+    ):
+        if not 0 <= minZoom <= maxZoom:
+            raise ValueError("Invalid zoom range {0} - {1}".format(minZoom, maxZoom))
+        self._filename = filename
+        self._layerName = layerName
+        self._minZoom = int(minZoom)
+        self._maxZoom = int(maxZoom)
+        self._tolerance = self.Tolerance if tolerance is None else tolerance
+        self._extent = int(extent or self.Extent)
+        self._buffer = self.Buffer if buffer is None else buffer
+        self._features = []
+        self._fieldTypes = {}
+        self._bounds = None
+        self._closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exctype, *exc):
+        if exctype is None:
+            self.close()
+        else:
+            self.discard()
+
+    def discard(self):
+        """
+        Discard the features without writing any tiles
+        """
+        self._closed = True
+        self._features = []
+
+    def _addFeature(self, geomType, parts, attributes):
+        for name, value in attributes.items():
+            if value is not None:
+                isNumber = isinstance(value, (int, float, np.number))
+                self._fieldTypes.setdefault(name, "Number" if isNumber else "String")
+        coords = [ring for part in parts for ring in part]
+        if len(coords) == 0:
+            return
+        allcoords = np.vstack(coords)
+        bounds = np.concatenate((np.min(allcoords, axis=0), np.max(allcoords, axis=0)))
+        if self._bounds is None:
+            self._bounds = bounds
+        else:
+            self._bounds[:2] = np.minimum(self._bounds[:2], bounds[:2])
+            self._bounds[2:] = np.maximum(self._bounds[2:], bounds[2:])
+        self._features.append((geomType, parts, dict(attributes)))
+
+    def addLine(self, lines, attributes):
+        """
+        Add a feature with a list of lines, each an (n,2) array of
+        coordinates, and a dictionary of attributes
+        """
+        parts = [
+            [np.asarray(line, dtype=np.float64)] for line in lines if len(line) > 1
+        ]
+        self._addFeature(GeomLine, parts, attributes)
+
+    def addPolygon(self, polygons, attributes):
+        """
+        Add a feature with a list of polygons, each a list of rings (the
+        exterior ring followed by any holes) as (n,2) arrays of
+        coordinates, and a dictionary of attributes
+        """
+        parts = [
+            [np.asarray(ring, dtype=np.float64) for ring in polygon]
+            for polygon in polygons
+            if len(polygon) > 0 and len(polygon[0]) > 3
+        ]
+        self._addFeature(GeomPolygon, parts, attributes)
+
+    def _tileSize(self, zoom):
+        return 2.0 * WorldHalfWidth / (1 << zoom)
+
+    def _simplify(self, geomType, part, tolerance):
+        if geomType == GeomLine:
+            return [ContourUtils.simplifyLine(part[0], tolerance)]
+        rings = [ContourUtils.simplifyLine(ring, tolerance) for ring in part]
+        if len(rings[0]) < 4:
+            return None
+        return [ring for ring in rings if len(ring) > 3]
+
+    def _clip(self, geomType, part, bounds):
+        # Clip a part (a line or polygon) to bounds, returning a list of parts
+        if geomType == GeomLine:
+            return [[piece] for piece, s, e in ContourUtils.clipLine(part[0], bounds)]
+        exterior = ContourUtils.clipRing(part[0], bounds)
+        if exterior is None:
+            return []
+        clipped = [exterior]
+        for ring in part[1:]:
+            ring = ContourUtils.clipRing(ring, bounds)
+            if ring is not None:
+                clipped.append(ring)
+        return [clipped]
+
+    def _tileRange(self, coords, zoom, margin):
+        # Range of tile columns and rows covered by coords expanded by margin
+        size = self._tileSize(zoom)
+        ntile = 1 << zoom
+        xmin, ymin = np.min(coords, axis=0) - margin
+        xmax, ymax = np.max(coords, axis=0) + margin
+        c0, c1 = (
+            int(np.clip(math.floor((v + WorldHalfWidth) / size), 0, ntile - 1))
+            for v in (xmin, xmax)
+        )
+        r0, r1 = (
+            int(np.clip(math.floor((WorldHalfWidth - v) / size), 0, ntile - 1))
+            for v in (ymax, ymin)
+        )
+        return c0, c1, r0, r1
+
+    def _tileParts(self, geomType, part, zoom):
+        # Generator returning ((column, row), part) for the pieces of a part
+        # in each tile.  Parts are clipped first to columns of tiles and
+        # then to rows within each column.
+        size = self._tileSize(zoom)
+        margin = size * self._buffer / self._extent
+        c0, c1, r0, r1 = self._tileRange(part[0], zoom, margin)
+        if c0 == c1 and r0 == r1:
+            yield (c0, r0), part
+            return
+        for c in range(c0, c1 + 1):
+            x0 = c * size - WorldHalfWidth
+            strip = (x0 - margin, -np.inf, x0 + size + margin, np.inf)
+            pieces = [part] if c0 == c1 else self._clip(geomType, part, strip)
+            for piece in pieces:
+                pc0, pc1, pr0, pr1 = self._tileRange(piece[0], zoom, margin)
+                for r in range(pr0, pr1 + 1):
+                    y1 = WorldHalfWidth - r * size
+                    if pr0 == pr1:
+                        yield (c, r), piece
+                        continue
+                    bounds = (
+                        x0 - margin,
+                        y1 - size - margin,
+                        x0 + size + margin,
+                        y1 + margin,
+                    )
+                    for tilePart in self._clip(geomType, piece, bounds):
+                        yield (c, r), tilePart
+
+    def _quantize(self, geomType, part, column, row, zoom):
+        # Convert a part to integer tile coordinates, removing repeated
+        # points.  Returns a list of coordinate arrays (rings without the
+        # closing point, correctly wound), or an empty list if the part
+        # vanishes at this resolution.
+        size = self._tileSize(zoom)
+        scale = self._extent / size
+        x0 = column * size - WorldHalfWidth
+        y1 = WorldHalfWidth - row * size
+        quantized = []
+        for i, coords in enumerate(part):
+            q = np.empty(coords.shape, dtype=np.int64)
+            q[:, 0] = np.round((coords[:, 0] - x0) * scale)
+            q[:, 1] = np.round((y1 - coords[:, 1]) * scale)
+            changed = np.ones(len(q), dtype=bool)
+            changed[1:] = np.any(q[1:] != q[:-1], axis=1)
+            q = q[changed]
+            if geomType == GeomLine:
+                if len(q) > 1:
+                    quantized.append(q)
+                continue
+            if len(q) > 1 and np.all(q[0] == q[-1]):
+                q = q[:-1]
+            area = 0.0
+            if len(q) > 2:
+                qf = q.astype(np.float64)
+                qn = np.roll(qf, -1, axis=0)
+                area = np.sum(qf[:, 0] * qn[:, 1] - qn[:, 0] * qf[:, 1])
+            if area == 0.0:
+                if i == 0:
+                    return []
+                continue
+            # Exterior rings have positive area in tile coordinates (y down)
+            if (area > 0) != (i == 0):
+                q = q[::-1]
+            quantized.append(q)
+        return quantized
+
+    def _writeZoom(self, db, zoom):
+        tolerance = self._tolerance * self._tileSize(zoom) / self._extent
+        tiles = {}
+        for ifeature, (geomType, parts, attributes) in enumerate(self._features):
+            simplified = []
+            for part in parts:
+                part = self._simplify(geomType, part, tolerance)
+                if part is None:
+                    continue
+                simplified.append(part)
+                for (column, row), tilePart in self._tileParts(geomType, part, zoom):
+                    quantized = self._quantize(geomType, tilePart, column, row, zoom)
+                    if quantized:
+                        tileFeatures = tiles.setdefault((column, row), {})
+                        tileFeatures.setdefault(ifeature, []).extend(quantized)
+            # Coarser zooms are simplified from this zoom's geometry
+            self._features[ifeature] = (geomType, simplified, attributes)
+
+        ntile = 1 << zoom
+        rows = []
+        for (column, row), tileFeatures in tiles.items():
+            layer = _TileLayer()
+            for ifeature, parts in sorted(tileFeatures.items()):
+                geomType, simplified, attributes = self._features[ifeature]
+                layer.addFeature(geomType, parts, attributes)
+            data = gzip.compress(layer.encode(self._layerName, self._extent))
+            # MBTiles rows are numbered from the bottom (TMS)
+            rows.append((zoom, column, ntile - 1 - row, sqlite3.Binary(data)))
+        db.executemany("INSERT INTO tiles VALUES (?, ?, ?, ?)", rows)
+        db.commit()
+        return len(rows)
+
+    def _metadata(self):
+        metadata = {
+            "name": self._layerName,
+            "format": "pbf",
+            "type": "overlay",
+            "version": "2",
+            "minzoom": str(self._minZoom),
+            "maxzoom": str(self._maxZoom),
+        }
+        if self._bounds is not None:
+            lon, lat = mercatorToLonLat(self._bounds[[0, 2]], self._bounds[[1, 3]])
+            metadata["bounds"] = "{0},{1},{2},{3}".format(
+                lon[0], lat[0], lon[1], lat[1]
+            )
+            metadata["center"] = "{0},{1},{2}".format(
+                (lon[0] + lon[1]) / 2.0, (lat[0] + lat[1]) / 2.0, self._minZoom
+            )
+        metadata["json"] = json.dumps(
+            {
+                "vector_layers": [
+                    {
+                        "id": self._layerName,
+                        "fields": self._fieldTypes,
+                        "minzoom": self._minZoom,
+                        "maxzoom": self._maxZoom,
+                    }
+                ]
+            }
+        )
+        return metadata
+
+    def close(self, progress=None):
+        """
+        Write the tiles of each zoom level to the MBTiles file, replacing
+        any existing file.  If progress is supplied it is called with the
+        percentage of zoom levels written.  Returns the number of tiles
+        written.
+        """
+        if self._closed:
+            return 0
+        self._closed = True
+        ntiles = 0
+        tempname = self._filename + ".tmp"
+        if os.path.exists(tempname):
+            os.remove(tempname)
+        db = sqlite3.connect(tempname)
+        completed = False
+        try:
+            db.execute("CREATE TABLE metadata (name TEXT, value TEXT)")
+            db.execute(
+                "CREATE TABLE tiles (zoom_level INTEGER, tile_column INTEGER, "
+                "tile_row INTEGER, tile_data BLOB)"
+            )
+            db.executemany(
+                "INSERT INTO metadata VALUES (?, ?)", self._metadata().items()
+            )
+            nzoom = self._maxZoom - self._minZoom + 1
+            for i, zoom in enumerate(range(self._maxZoom, self._minZoom - 1, -1)):
+                ntiles += self._writeZoom(db, zoom)
+                if progress is not None:
+                    progress(100.0 * (i + 1) / nzoom)
+            # The index is created once all the tiles are written
+            db.execute(
+                "CREATE UNIQUE INDEX tile_index ON tiles "
+                "(zoom_level, tile_column, tile_row)"
+            )
+            db.commit()
+            completed = True
+        finally:
+            db.close()
+            self._features = []
+            if not completed:
+                os.remove(tempname)
+        os.replace(tempname, self._filename)
+        return ntiles
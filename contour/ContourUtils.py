@@ -5,17 +5,18 @@ ContourUtils provide support functions for the contouring tool
 """
 
 
-def _discardIndex(x, y, x0, y0, resolution, index):
-    values, ix = np.unique(
-        ((x[index] - x0) / resolution).astype(int), return_inverse=True
-    )
-    values, iy = np.unique(
-        ((y[index] - y0) / resolution).astype(int), return_inverse=True
-    )
+def _discardIndex(x, y, x0, y0, xres, yres, index):
+    # index None means use all points, avoiding copying x and y
+    xi = x if index is None else x[index]
+    yi = y if index is None else y[index]
+    values, ix = np.unique(((xi - x0) / xres).astype(int), return_inverse=True)
+    values, iy = np.unique(((yi - y0) / yres).astype(int), return_inverse=True)
     mix = ix * values.shape[0] + iy
     values, indices = np.unique(mix, return_inverse=True)
+    if index is None:
+        index = np.arange(x.shape[0], dtype=int)
     thinned = np.zeros(values.shape, dtype=int)
-    thinned[indices] = index
+    thinned[indices.ravel()] = index
     return thinned
 
 
@@ -28,28 +29,481 @@ def discardDuplicatePoints(x, y, resolution, isLonLat=False):
     Resolution is the resolution within which points are merged
 
     If isLonLat is true then x,y are assumed to be longitude/latitudes
-    and are very approximately converted to metres for the test.
+    and the resolution is very approximately converted from metres to
+    degrees for the test.
     """
+    if resolution <= 0:
+        return np.arange(x.shape[0], dtype=int)
+    xres = resolution
+    yres = resolution
     if isLonLat:
-        meanlon = np.mean(x)
         meanlat = np.mean(y)
-        y = (y - meanlat) * 100000.0
-        x = (x - meanlon) * 100000.0 * np.cos(np.radians(meanlat))
+        yres = resolution / 100000.0
+        xres = yres / max(np.cos(np.radians(meanlat)), 1.0e-6)
 
     x0 = np.min(x)
     y0 = np.min(y)
-    index = np.arange(x.shape[0], dtype=int)
-    if resolution <= 0:
-        return index
-    index = _discardIndex(x, y, x0, y0, resolution, index)
-    index = _discardIndex(x, y, x0 + resolution / 2, y0, resolution, index)
-    index = _discardIndex(x, y, x0, y0 + resolution / 2, resolution, index)
-    index = _discardIndex(
-        x, y, x0 + resolution / 2, y0 + resolution / 2, resolution, index
-    )
+    index = _discardIndex(x, y, x0, y0, xres, yres, None)
+    index = _discardIndex(x, y, x0 + xres / 2, y0, xres, yres, index)
+    index = _discardIndex(x, y, x0, y0 + yres / 2, xres, yres, index)
+    index = _discardIndex(x, y, x0 + xres / 2, y0 + yres / 2, xres, yres, index)
     return index
 
 
+def _buildtrig_workaround(x, y):
+    """
+    Workaround implemented as qhull fails when called from
+    within QGIS python in ubuntu 17.10, QGIS 3.1 :-(
+    """
+    import os
+    import sys
+    import subprocess
+    import tempfile
+    from matplotlib.tri import Triangulation
+
+    tfh, tfname = tempfile.mkstemp(".npy", "tmp_contour_generator")
+    tfh2, tfname2 = tempfile.mkstemp(".npy", "tmp_contour_generator")
+    os.close(tfh)
+    os.close(tfh2)
+    trig = None
+    try:
+        np.save(tfname, np.vstack((x, y)))
+        pydir = os.path.dirname(os.path.abspath(os.path.realpath(__file__)))
+        pyscript = os.path.join(pydir, "buildtrig_qhull_workaround.py")
+        python = sys.executable
+        result = subprocess.call([python, pyscript, tfname, tfname2])
+        triangles = np.load(tfname2)
+        trig = Triangulation(x, y, triangles)
+    finally:
+        os.remove(tfname)
+        os.remove(tfname2)
+    return trig
+
+
+def buildTriangulation(x, y, workaround=False):
+    """
+    Build a Delauney triangulation of x, y with flat triangles on the
+    boundary masked.  If workaround is True the triangulation is calculated
+    in a separate python process (see _buildtrig_workaround).
+    """
+    from matplotlib.tri import Triangulation, TriAnalyzer
+
+    if workaround:
+        trig = _buildtrig_workaround(x, y)
+    else:
+        trig = Triangulation(x, y)
+    analyzer = TriAnalyzer(trig)
+    mask = analyzer.get_flat_tri_mask()
+    trig.set_mask(mask)
+    return trig
+
+
+def resampleToGrid(trig, z, cellsize, blocksize=1000000):
+    """
+    Linearly interpolate values z defined at the nodes of triangulation trig
+    onto a regular grid with spacing cellsize covering the extent of the
+    triangulation.  The interpolation is done in blocks of rows of about
+    blocksize grid nodes to limit the memory used.
+
+    Returns gx, gy, gz where gx and gy are 1d arrays of the grid column
+    and row coordinates, and gz is a 2d masked array of values with nodes
+    outside the triangulation masked.
+    """
+    from matplotlib.tri import LinearTriInterpolator
+
+    if cellsize <= 0:
+        raise ValueError("Resampling cell size must be greater than zero")
+    x = trig.x
+    y = trig.y
+    x0 = np.floor(np.min(x) / cellsize) * cellsize
+    y0 = np.floor(np.min(y) / cellsize) * cellsize
+    ncol = int(np.ceil((np.max(x) - x0) / cellsize)) + 1
+    nrow = int(np.ceil((np.max(y) - y0) / cellsize)) + 1
+    gx = x0 + np.arange(ncol) * cellsize
+    gy = y0 + np.arange(nrow) * cellsize
+    gz = np.ma.masked_all((nrow, ncol), dtype=np.float64)
+    interpolator = LinearTriInterpolator(trig, z)
+    nblock = max(1, blocksize // ncol)
+    for row0 in range(0, nrow, nblock):
+        row1 = min(nrow, row0 + nblock)
+        bx, by = np.meshgrid(gx, gy[row0:row1])
+        gz[row0:row1, :] = interpolator(bx, by)
+    return gx, gy, gz
+
+
+def releaseContourSet(cs):
+    """
+    Remove a contour set created by the pyplot contouring functions from the
+    current axes so that it can be garbage collected.  Errors from versions
+    of matplotlib which cannot remove the contour set are ignored.
+    """
+    try:
+        cs.remove()
+    except Exception:
+        pass
+
+
+def clipLine(line, bounds):
+    """
+    Clip a line, an (n,2) array of coordinates, to the rectangle bounds
+    (xmin, ymin, xmax, ymax) using the Liang-Barsky algorithm.  The bounds
+    may be infinite.
+
+    Returns a list of (piece, startClipped, endClipped) tuples for the
+    pieces of the line inside the rectangle, where startClipped and
+    endClipped are True if the end of the piece is on the rectangle
+    boundary where the line has been cut.
+    """
+    line = np.asarray(line, dtype=np.float64)
+    if len(line) < 2:
+        return []
+    xmin, ymin, xmax, ymax = bounds
+    p0 = line[:-1]
+    d = line[1:] - p0
+    t0 = np.zeros(len(d))
+    t1 = np.ones(len(d))
+    keep = np.ones(len(d), dtype=bool)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for p, q in (
+            (-d[:, 0], p0[:, 0] - xmin),
+            (d[:, 0], xmax - p0[:, 0]),
+            (-d[:, 1], p0[:, 1] - ymin),
+            (d[:, 1], ymax - p0[:, 1]),
+        ):
+            keep &= ~((p == 0) & (q < 0))
+            r = q / p
+            t0 = np.where(p < 0, np.maximum(t0, r), t0)
+            t1 = np.where(p > 0, np.minimum(t1, r), t1)
+    keep &= t0 < t1
+    if np.all(keep) and np.all(t0 == 0) and np.all(t1 == 1):
+        return [(line, False, False)]
+    start = p0 + t0[:, np.newaxis] * d
+    end = p0 + t1[:, np.newaxis] * d
+    # Consecutive kept segments form one piece if the first is not cut at
+    # its end and the second is not cut at its start
+    joined = keep[:-1] & keep[1:] & (t1[:-1] == 1) & (t0[1:] == 0)
+    pieces = []
+    piece = None
+    for i in np.flatnonzero(keep):
+        if piece is not None and joined[i - 1]:
+            piece.append(end[i])
+        else:
+            if piece is not None:
+                pieces.append((np.array(piece), startClipped, True))
+            piece = [start[i], end[i]]
+            startClipped = bool(t0[i] > 0)
+        if t1[i] < 1:
+            pieces.append((np.array(piece), startClipped, True))
+            piece = None
+    if piece is not None:
+        pieces.append((np.array(piece), startClipped, False))
+    return pieces
+
+
+def clipRing(ring, bounds):
+    """
+    Clip a polygon ring, an (n,2) array of coordinates, to the rectangle
+    bounds (xmin, ymin, xmax, ymax) using the Sutherland-Hodgman
+    algorithm.  Parts of the ring outside the rectangle are replaced by
+    lines along its boundary.  Returns the clipped ring, closed, or None
+    if nothing is left.
+    """
+    pts = np.asarray(ring, dtype=np.float64)
+    if len(pts) > 1 and np.all(pts[0] == pts[-1]):
+        pts = pts[:-1]
+    xmin, ymin, xmax, ymax = bounds
+    for axis, value, sign in ((0, xmin, 1), (0, xmax, -1), (1, ymin, 1), (1, ymax, -1)):
+        if len(pts) < 3:
+            return None
+        inside = sign * (pts[:, axis] - value) >= 0
+        if np.all(inside):
+            continue
+        following = np.roll(pts, -1, axis=0)
+        crossing = inside != np.roll(inside, -1)
+        # Each edge contributes its start point if inside and the
+        # intersection with the boundary if it crosses it
+        counts = inside.astype(int) + crossing.astype(int)
+        position = np.cumsum(counts) - counts
+        clipped = np.empty((int(np.sum(counts)), 2))
+        clipped[position[inside]] = pts[inside]
+        start = pts[crossing]
+        delta = following[crossing] - start
+        t = (value - start[:, axis]) / delta[:, axis]
+        cut = start + t[:, np.newaxis] * delta
+        cut[:, axis] = value
+        clipped[(position + inside)[crossing]] = cut
+        pts = clipped
+    if len(pts) < 3:
+        return None
+    return np.vstack((pts, pts[:1]))
+
+
+def simplifyLine(line, tolerance):
+    """
+    Simplify a line, an (n,2) array of coordinates, with the
+    Douglas-Peucker algorithm so that no point removed is further than
+    tolerance from the simplified line.  The end points are always kept,
+    so closed rings remain closed.
+    """
+    line = np.asarray(line, dtype=np.float64)
+    n = len(line)
+    if n < 3 or tolerance <= 0:
+        return line
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = True
+    keep[-1] = True
+    tol2 = tolerance * tolerance
+    ranges = [(0, n - 1)]
+    while ranges:
+        i0, i1 = ranges.pop()
+        if i1 - i0 < 2:
+            continue
+        d = line[i1] - line[i0]
+        offsets = line[i0 + 1 : i1] - line[i0]
+        len2 = d[0] * d[0] + d[1] * d[1]
+        if len2 > 0:
+            cross = offsets[:, 0] * d[1] - offsets[:, 1] * d[0]
+            dist2 = cross * cross / len2
+        else:
+            dist2 = np.sum(offsets * offsets, axis=1)
+        imax = int(np.argmax(dist2))
+        if dist2[imax] > tol2:
+            i = i0 + 1 + imax
+            keep[i] = True
+            ranges.append((i0, i))
+            ranges.append((i, i1))
+    return line[keep]
+
+
+def _pointerJump(succ, values, reduce):
+    # For each node of a graph in which each node has at most one successor
+    # (succ, -1 for none), reduce values over the nodes reached by
+    # following successors, including the node itself.  Returns the reduced
+    # values, the last node reached, and the number of steps taken, which
+    # for nodes on paths are the end of the path and the distance to it.
+    n = len(succ)
+    nodes = np.arange(n)
+    last = np.where(succ >= 0, succ, nodes)
+    steps = (succ >= 0).astype(np.int64)
+    values = values.copy()
+    span = 1
+    while span < n:
+        values = reduce(values, values[last])
+        steps = steps + steps[last]
+        last = last[last]
+        span *= 2
+    return values, last, steps
+
+
+def chainLines(lines, partner):
+    """
+    Join lines into maximal chains.  lines is a list of (n,2) arrays, or an
+    (nline,n,2) array of lines with the same number of points.  End points
+    2i and 2i+1 are the start and end of line i, and partner is an array of
+    the end point joined to each end point, or -1 if it is not joined.
+    Partners must be mutual.  Chains which return to their start are closed
+    as rings.  Returns a list of (n,2) arrays.
+
+    The chains are found with pointer jumping over the ends at which each
+    line is entered, so that the work is done by numpy rather than by
+    following each chain in python.
+    """
+    nline = len(lines)
+    if nline == 0:
+        return []
+    partner = np.asarray(partner, dtype=np.int64)
+    nend = 2 * nline
+    ends = np.arange(nend)
+
+    # Entering a line at end s leaves it at end s^1, and enters the next
+    # line at the partner of that end
+    succ = partner[ends ^ 1]
+
+    # Break each ring before the end of the ring with the lowest index
+    minEnd, last, steps = _pointerJump(succ, ends, np.minimum)
+    inRing = succ[last] >= 0
+    succ = np.where(inRing & (succ == minEnd), -1, succ)
+
+    # Follow predecessors to the first line entered in each chain
+    pred = np.full(nend, -1, dtype=np.int64)
+    linked = succ >= 0
+    pred[succ[linked]] = ends[linked]
+    unused, head, rank = _pointerJump(pred, ends, np.minimum)
+
+    # Each chain is found in both directions.  Use the direction starting
+    # from the lower numbered end.
+    forward = head[0::2] < head[1::2]
+    entry = np.where(forward, ends[0::2], ends[1::2])
+    order = np.lexsort((rank[entry], head[entry]))
+    entry = entry[order]
+    chainHead = head[entry]
+    lineIndex = entry // 2
+    reverse = (entry % 2) == 1
+
+    # Concatenate the lines of each chain, dropping the first point of each
+    # line after the first
+    if isinstance(lines, np.ndarray):
+        oriented = np.where(
+            reverse[:, np.newaxis, np.newaxis],
+            lines[lineIndex, ::-1],
+            lines[lineIndex],
+        )
+        npoint = np.full(nline, lines.shape[1], dtype=np.int64)
+        points = oriented.reshape(-1, 2)
+    else:
+        oriented = [
+            lines[i][::-1] if r else lines[i] for i, r in zip(lineIndex, reverse)
+        ]
+        npoint = np.fromiter((len(line) for line in oriented), dtype=np.int64)
+        points = np.concatenate(oriented).astype(np.float64, copy=False)
+    firstLine = np.ones(nline, dtype=bool)
+    firstLine[1:] = chainHead[1:] != chainHead[:-1]
+    lineStart = np.cumsum(npoint) - npoint
+    keep = np.ones(len(points), dtype=bool)
+    keep[lineStart[~firstLine]] = False
+    points = points[keep]
+    npoint = npoint - (~firstLine)
+
+    chainStart = np.flatnonzero(firstLine)
+    chainLength = np.add.reduceat(npoint, chainStart)
+    chainEnd = np.cumsum(chainLength)
+    # Close the rings exactly
+    ring = inRing[chainHead[chainStart]]
+    if np.any(ring):
+        points[chainEnd[ring] - 1] = points[chainEnd[ring] - chainLength[ring]]
+    return np.split(points, chainEnd[:-1])
+
+
+def _pairEnds(ends, tolerance):
+    # Partner of each end point, the only other end point within tolerance
+    # of it, or -1.  End points are hashed to cells much larger than the
+    # tolerance, and the ends near the edge of a cell are also matched with
+    # those in the neighbouring cells, so that ends either side of a cell
+    # boundary are matched.
+    nend = len(ends)
+    origin = np.min(ends, axis=0)
+    span = float(np.max(np.max(ends, axis=0) - origin))
+    # Limit the number of cells so that the cell keys fit in an int64
+    cellSize = max(16.0 * tolerance, span / 2**30, np.finfo(float).tiny)
+    position = (ends - origin) / cellSize
+    cells = np.floor(position).astype(np.int64)
+    nrow = int(np.max(cells[:, 1])) + 3
+    keys = (cells[:, 0] + 1) * nrow + cells[:, 1] + 1
+    order = np.argsort(keys, kind="stable")
+    sortedKeys = keys[order]
+
+    def candidates(index, start, count):
+        # Pairs of each end in index with the count ends in sorted order
+        # from start
+        a = np.repeat(index, count)
+        skip = np.repeat(np.cumsum(count) - count, count)
+        offset = np.arange(int(np.sum(count))) - skip
+        return a, order[np.repeat(start, count) + offset]
+
+    # Ends in the same cell
+    first = np.ones(nend, dtype=bool)
+    first[1:] = sortedKeys[1:] != sortedKeys[:-1]
+    groupStart = np.flatnonzero(first)
+    groupCount = np.diff(np.append(groupStart, nend))
+    group = np.cumsum(first) - 1
+    a, b = candidates(order, groupStart[group], groupCount[group])
+    pairs = [(a, b)]
+
+    # Ends near the edge of their cell with those in the neighbouring cells
+    # across that edge
+    margin = tolerance / cellSize
+    inCell = position - cells
+    near = {
+        -1: inCell < margin,
+        0: np.ones(inCell.shape, dtype=bool),
+        1: inCell > 1.0 - margin,
+    }
+    neighbours = [(dx, dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1) if dx or dy]
+    neighbourPairs = []
+    for dx, dy in neighbours:
+        edge = np.flatnonzero(near[dx][:, 0] & near[dy][:, 1])
+        neighbour = keys[edge] + dx * nrow + dy
+        lo = np.searchsorted(sortedKeys, neighbour, side="left")
+        hi = np.searchsorted(sortedKeys, neighbour, side="right")
+        a, b = candidates(edge, lo, hi - lo)
+        neighbourPairs.append(a * nend + b)
+        neighbourPairs.append(b * nend + a)
+    codes = np.unique(np.concatenate(neighbourPairs))
+    pairs.append((codes // nend, codes % nend))
+
+    a = np.concatenate([a for a, b in pairs])
+    b = np.concatenate([b for a, b in pairs])
+    d = ends[a] - ends[b]
+    close = (a != b) & (d[:, 0] * d[:, 0] + d[:, 1] * d[:, 1] <= tolerance**2)
+    a = a[close]
+    b = b[close]
+    degree = np.bincount(a, minlength=nend)
+    single = (degree[a] == 1) & (degree[b] == 1)
+    partner = np.full(nend, -1, dtype=np.int64)
+    partner[a[single]] = b[single]
+    return partner
+
+
+def mergeLines(lines, tolerance):
+    """
+    Merge lines that share end points into maximal lines.  lines is a
+    list of (n,2) arrays.  End points within tolerance of each other are
+    matched, and lines are only joined where exactly two line ends meet, so
+    lines meeting at saddle points are left unjoined.  Chains of lines which
+    return to their start are closed as rings.  Returns a list of (n,2)
+    arrays.
+    """
+    lines = [line for line in lines if len(line) > 1]
+    if len(lines) < 2:
+        return lines
+    npoint = np.fromiter((len(line) for line in lines), dtype=np.int64)
+    if np.all(npoint == npoint[0]):
+        # Lines of equal length, such as segments, are joined as one array
+        lines = np.array(lines, dtype=np.float64)
+        ends = lines[:, [0, -1]].reshape(-1, 2)
+    else:
+        ends = np.empty((2 * len(lines), 2))
+        ends[0::2] = [line[0] for line in lines]
+        ends[1::2] = [line[-1] for line in lines]
+    return chainLines(lines, _pairEnds(ends, max(tolerance, 0.0)))
+
+
+def parsePointWkb(data, count):
+    """
+    Parse count points from data, the concatenated WKB of point geometries
+    of a single type.  Returns arrays x, y, z, m, where z and m are None if
+    the points do not have z or m values.  Raises ValueError if the data
+    are not points of a single type.
+    """
+    if count == 0:
+        empty = np.zeros((0,))
+        return empty, empty, None, None
+    if len(data) % count != 0 or len(data) < 5:
+        raise ValueError("Geometries are not points of a single type")
+    endian = "<" if data[0] == 1 else ">"
+    wkbtype = int(np.frombuffer(data[1:5], dtype=endian + "u4")[0])
+    # ISO WKB adds 1000 for Z, 2000 for M, and 3000 for ZM, EWKB sets flags
+    dimension = (wkbtype & 0x0FFFFFFF) // 1000
+    hasZ = dimension in (1, 3) or bool(wkbtype & 0x80000000)
+    hasM = dimension in (2, 3) or bool(wkbtype & 0x40000000)
+    if (wkbtype & 0x0FFFFFFF) % 1000 != 1:
+        raise ValueError("Geometries are not points")
+    names = ["x", "y"] + (["z"] if hasZ else []) + (["m"] if hasM else [])
+    dtype = np.dtype(
+        [("order", "u1"), ("type", endian + "u4")]
+        + [(name, endian + "f8") for name in names]
+    )
+    if dtype.itemsize * count != len(data):
+        raise ValueError("Geometries are not points of a single type")
+    records = np.frombuffer(data, dtype=dtype, count=count)
+    if np.any(records["order"] != data[0]) or np.any(records["type"] != wkbtype):
+        raise ValueError("Geometries are not points of a single type")
+    return tuple(
+        records[name].astype(np.float64) if name in names else None
+        for name in ("x", "y", "z", "m")
+    )
+
+
 def calcDefaultNdp(levels):
     try:
         levels = np.array(levels)
@@ -13,11 +13,11 @@ class DataGridder:
 
     def setData(self, x, y):
         """
-        Set the x,y values to be tested
-
+        Set the x,y values to be tested.  The arrays are not copied if they
+        are already float64.
         """
-        self._x = None if x is None else x.astype(np.float64)
-        self._y = None if y is None else y.astype(np.float64)
+        self._x = None if x is None else np.asarray(x, dtype=np.float64)
+        self._y = None if y is None else np.asarray(y, dtype=np.float64)
         self._tested = False
         self._isValid = None
         self._gridOrder = None
@@ -159,8 +159,9 @@ class DataGridder:
     def _gridIsValid(self):
         if not self._gridShape:
             return False
-        u = self._x.copy() if self._gridOrder is None else self._x[self._gridOrder]
-        v = self._y.copy() if self._gridOrder is None else self._y[self._gridOrder]
+        # Views of the data if no reordering is required
+        u = self._x if self._gridOrder is None else self._x[self._gridOrder]
+        v = self._y if self._gridOrder is None else self._y[self._gridOrder]
         u = u.reshape(self._gridShape)
         v = v.reshape(self._gridShape)
         dudu = u[1:, :] - u[:-1, :]
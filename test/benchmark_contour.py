@@ -0,0 +1,464 @@
+#!/usr/bin/python3
+"""
+Benchmark the stages of the contouring pipeline on synthetic point sets.
+
+The numpy/matplotlib stages (duplicate point removal, grid detection,
+triangulation, contouring and polygon ring extraction) run without QGIS.
+If the qgis python module can be imported then the stages that require it
+(loading points from a layer, building multipolygon geometries, and writing
+features) are run with a standalone QgsApplication, otherwise they are
+reported as skipped.
+
+Each stage is timed separately and the results written as JSON.  Results
+can be compared with a stored baseline, in which case the script exits with
+status 1 if any stage is slower than the baseline by more than the
+regression threshold.
+
+Example:
+
+    python3 benchmark_contour.py --sizes 1000,100000 --output bench.json
+    python3 benchmark_contour.py --save-baseline baseline.json
+    python3 benchmark_contour.py --baseline baseline.json --threshold 0.25 \\
+        --stage-threshold triangulate=0.5
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+
+import numpy as np
+import matplotlib
+
+matplotlib.use("Agg")
+from matplotlib.pyplot import contour, contourf, tricontour, tricontourf
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from contour import ContourUtils
+from contour import ContourMethod
+from contour.DataGridder import DataGridder
+
+Cases = ["regular", "rotated", "holed", "scattered"]
+
+Stages = [
+    "load",
+    "discard_duplicates",
+    "grid",
+    "triangulate",
+    "contour_lines",
+    "contour_filled",
+    "polygon_rings",
+    "build_multipolygon",
+    "write_features",
+]
+
+
+# Synthetic data generators.  Each returns x, y, z arrays of approximately
+# npt points.
+
+
+def _surface(x, y):
+    # Smooth surface with a few hills and a trend
+    scale = max(np.ptp(x), np.ptp(y), 1.0)
+    u = (x - np.min(x)) / scale
+    v = (y - np.min(y)) / scale
+    return (
+        100.0 * np.sin(3.0 * u) * np.cos(2.0 * v)
+        + 50.0 * np.exp(-((u - 0.3) ** 2 + (v - 0.6) ** 2) * 20.0)
+        + 20.0 * u
+    )
+
+
+def _gridPoints(npt, spacing=10.0):
+    nrow = max(3, int(np.sqrt(npt)))
+    ncol = max(3, npt // nrow)
+    gx, gy = np.meshgrid(np.arange(ncol) * spacing, np.arange(nrow) * spacing)
+    return gx.ravel() + 1500000.0, gy.ravel() + 5000000.0
+
+
+def regularPoints(npt, rng):
+    x, y = _gridPoints(npt)
+    return x, y, _surface(x, y)
+
+
+def rotatedPoints(npt, rng):
+    # Grid rotated by 30 degrees, with the points in random order
+    x, y = _gridPoints(npt)
+    x0 = np.mean(x)
+    y0 = np.mean(y)
+    c = np.cos(np.radians(30.0))
+    s = np.sin(np.radians(30.0))
+    xr = x0 + (x - x0) * c - (y - y0) * s
+    yr = y0 + (x - x0) * s + (y - y0) * c
+    order = rng.permutation(len(x))
+    xr = xr[order]
+    yr = yr[order]
+    return xr, yr, _surface(xr, yr)
+
+
+def holedPoints(npt, rng):
+    # Regular grid with a circular hole, so not a complete grid
+    x, y = _gridPoints(int(npt * 1.1))
+    xm = np.mean(x)
+    ym = np.mean(y)
+    radius = 0.2 * np.ptp(x)
+    keep = (x - xm) ** 2 + (y - ym) ** 2 > radius**2
+    x = x[keep]
+    y = y[keep]
+    return x, y, _surface(x, y)
+
+
+def scatteredPoints(npt, rng):
+    width = 10.0 * np.sqrt(npt)
+    x = rng.uniform(0.0, width, npt) + 1500000.0
+    y = rng.uniform(0.0, width, npt) + 5000000.0
+    return x, y, _surface(x, y)
+
+
+Generators = {
+    "regular": regularPoints,
+    "rotated": rotatedPoints,
+    "holed": holedPoints,
+    "scattered": scatteredPoints,
+}
+
+
+def addDuplicates(x, y, z, rate, rng, jitter=0.001):
+    """
+    Add rate*len(x) near duplicate points, offset by up to jitter from a
+    randomly chosen existing point.
+    """
+    ndup = int(len(x) * rate)
+    if ndup <= 0:
+        return x, y, z
+    index = rng.randint(0, len(x), ndup)
+    x = np.concatenate((x, x[index] + rng.uniform(-jitter, jitter, ndup)))
+    y = np.concatenate((y, y[index] + rng.uniform(-jitter, jitter, ndup)))
+    z = np.concatenate((z, z[index]))
+    return x, y, z
+
+
+class StageTimer:
+    def __init__(self, repeat=1):
+        self.repeat = max(1, repeat)
+        self.results = {}
+
+    def time(self, stage, func, *args):
+        # Best of repeat runs.  Returns the result of the last run.
+        best = None
+        result = None
+        for i in range(self.repeat):
+            start = time.perf_counter()
+            result = func(*args)
+            elapsed = time.perf_counter() - start
+            if best is None or elapsed < best:
+                best = elapsed
+        self.results[stage] = best
+        return result
+
+    def skip(self, stage):
+        self.results[stage] = None
+
+
+def _contourPaths(cs):
+    try:
+        return [c.get_paths() for c in cs.collections]
+    except AttributeError:
+        return [[p] for p in cs.get_paths()]
+
+
+def _polygonRings(pathlists):
+    nring = 0
+    for pathlist in pathlists:
+        for path in pathlist:
+            path.should_simplify = False
+            nring += len(path.to_polygons())
+    return nring
+
+
+class QgisStages:
+    """
+    Stages requiring QGIS, run with a standalone QgsApplication
+    """
+
+    def __init__(self):
+        from qgis.core import QgsApplication
+
+        self._app = QgsApplication([], False)
+        self._app.initQgis()
+
+    def pointLayer(self, x, y, z):
+        from qgis.core import (
+            QgsFeature,
+            QgsField,
+            QgsGeometry,
+            QgsPointXY,
+            QgsVectorLayer,
+        )
+        from PyQt5.QtCore import QVariant
+
+        layer = QgsVectorLayer("Point?crs=EPSG:2193", "points", "memory")
+        pr = layer.dataProvider()
+        pr.addAttributes([QgsField("z", QVariant.Double)])
+        layer.updateFields()
+        features = []
+        for xp, yp, zp in zip(x, y, z):
+            feat = QgsFeature(layer.fields())
+            feat.setGeometry(QgsGeometry.fromPointXY(QgsPointXY(xp, yp)))
+            feat.setAttributes([float(zp)])
+            features.append(feat)
+        pr.addFeatures(features)
+        return layer
+
+    def generator(self, layer):
+        from contour.ContourGenerator import ContourGenerator
+
+        return ContourGenerator(layer, "z")
+
+    def load(self, generator):
+        generator.setReloadData()
+        return generator.data()
+
+    def buildMultipolygons(self, generator, pathlists):
+        return [generator.buildQgsMultipolygon(pathlist) for pathlist in pathlists]
+
+    def writeFeatures(self, generator, levels):
+        from qgis.core import QgsVectorLayer, QgsWkbTypes
+
+        generator.setContourLevels(levels)
+        generator.setContourType("filled")
+        url = QgsWkbTypes.displayString(generator.wkbtype()) + "?crs=EPSG:2193"
+        layer = QgsVectorLayer(url, "contours", "memory")
+        pr = layer.dataProvider()
+        pr.addAttributes(generator.fields())
+        layer.updateFields()
+        pr.addFeatures(list(generator.contourFeatures()))
+        return layer
+
+
+def runCase(case, npt, options, rng, qgisStages):
+    x, y, z = Generators[case](npt, rng)
+    x, y, z = addDuplicates(x, y, z, options.duplicate_rate, rng)
+    timer = StageTimer(options.repeat)
+    levels = ContourMethod.calculateLevels(z, "equal", ncontour=options.ncontour)
+
+    generator = None
+    if qgisStages is not None:
+        layer = qgisStages.pointLayer(x, y, z)
+        generator = qgisStages.generator(layer)
+        timer.time("load", qgisStages.load, generator)
+    else:
+        timer.skip("load")
+
+    if options.tolerance > 0:
+        index = timer.time(
+            "discard_duplicates",
+            ContourUtils.discardDuplicatePoints,
+            x,
+            y,
+            options.tolerance,
+        )
+        x = x[index]
+        y = y[index]
+        z = z[index]
+    else:
+        timer.skip("discard_duplicates")
+
+    shape, order = timer.time("grid", lambda: DataGridder(x, y).calcGrid())
+    gridded = shape is not None
+    if gridded:
+        if order is not None:
+            x = x[order]
+            y = y[order]
+            z = z[order]
+        gx = x.reshape(shape)
+        gy = y.reshape(shape)
+        gz = z.reshape(shape)
+        timer.skip("triangulate")
+        timer.time("contour_lines", contour, gx, gy, gz, levels)
+        cs = timer.time("contour_filled", contourf, gx, gy, gz, levels)
+    else:
+        trig = timer.time("triangulate", ContourUtils.buildTriangulation, x, y)
+        timer.time("contour_lines", tricontour, trig, z, levels)
+        cs = timer.time("contour_filled", tricontourf, trig, z, levels)
+    pathlists = _contourPaths(cs)
+    timer.time("polygon_rings", _polygonRings, pathlists)
+
+    if generator is not None:
+        timer.time(
+            "build_multipolygon", qgisStages.buildMultipolygons, generator, pathlists
+        )
+        timer.time("write_features", qgisStages.writeFeatures, generator, levels)
+    else:
+        timer.skip("build_multipolygon")
+        timer.skip("write_features")
+
+    matplotlib.pyplot.close("all")
+    return {
+        "case": case,
+        "requested_points": npt,
+        "points": int(len(x)),
+        "gridded": gridded,
+        "stages": timer.results,
+    }
+
+
+def resultKey(result):
+    return "{0}:{1}".format(result["case"], result["requested_points"])
+
+
+def compareBaseline(results, baseline, threshold, stageThresholds, minTime):
+    """
+    Compare results with baseline results.  Returns a list of regression
+    messages for stages slower than the baseline by more than the threshold
+    fraction.  Stages faster than minTime seconds in the baseline are ignored
+    as too noisy to compare.
+    """
+    regressions = []
+    base = {resultKey(r): r for r in baseline.get("results", [])}
+    for result in results:
+        key = resultKey(result)
+        if key not in base:
+            continue
+        bstages = base[key]["stages"]
+        for stage, seconds in result["stages"].items():
+            bseconds = bstages.get(stage)
+            if seconds is None or bseconds is None or bseconds < minTime:
+                continue
+            limit = stageThresholds.get(stage, threshold)
+            ratio = seconds / bseconds
+            if ratio > 1.0 + limit:
+                regressions.append(
+                    "{0} {1}: {2:.4f}s vs baseline {3:.4f}s (+{4:.0f}% > {5:.0f}%)".format(
+                        key,
+                        stage,
+                        seconds,
+                        bseconds,
+                        (ratio - 1.0) * 100,
+                        limit * 100,
+                    )
+                )
+    return regressions
+
+
+def parseStageThresholds(values):
+    thresholds = {}
+    for value in values or []:
+        stage, sep, limit = value.partition("=")
+        if not sep or stage not in Stages:
+            raise ValueError("Invalid stage threshold {0}".format(value))
+        thresholds[stage] = float(limit)
+    return thresholds
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark contouring stages")
+    parser.add_argument(
+        "--cases", default=",".join(Cases), help="Comma separated point set types"
+    )
+    parser.add_argument(
+        "--sizes",
+        default="1000,10000,100000",
+        help="Comma separated numbers of points, e.g. 1e3,1e5,1e7",
+    )
+    parser.add_argument(
+        "--duplicate-rate",
+        type=float,
+        default=0.0,
+        help="Fraction of near duplicate points added",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.01,
+        help="Duplicate point tolerance (0 to skip duplicate removal)",
+    )
+    parser.add_argument("--ncontour", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--no-qgis", action="store_true", help="Skip QGIS stages")
+    parser.add_argument("--output", help="File to write JSON results to")
+    parser.add_argument("--baseline", help="Baseline JSON results to compare with")
+    parser.add_argument("--save-baseline", help="Write results as a baseline file")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.2,
+        help="Allowed slowdown relative to baseline as a fraction",
+    )
+    parser.add_argument(
+        "--stage-threshold",
+        action="append",
+        help="Allowed slowdown for a specific stage, as stage=fraction",
+    )
+    parser.add_argument(
+        "--min-time",
+        type=float,
+        default=0.01,
+        help="Ignore stages faster than this (seconds) in the baseline",
+    )
+    options = parser.parse_args()
+
+    cases = options.cases.split(",")
+    for case in cases:
+        if case not in Generators:
+            parser.error("Invalid case {0}".format(case))
+    sizes = [int(float(s)) for s in options.sizes.split(",")]
+    stageThresholds = parseStageThresholds(options.stage_threshold)
+
+    qgisStages = None
+    if not options.no_qgis:
+        try:
+            qgisStages = QgisStages()
+        except ImportError:
+            print("qgis not available - skipping QGIS stages")
+
+    rng = np.random.RandomState(options.seed)
+    results = []
+    for case in cases:
+        for npt in sizes:
+            result = runCase(case, npt, options, rng, qgisStages)
+            results.append(result)
+            timings = ", ".join(
+                "{0} {1:.4f}".format(stage, seconds)
+                for stage, seconds in result["stages"].items()
+                if seconds is not None
+            )
+            print("{0} {1} points: {2}".format(case, result["points"], timings))
+
+    output = {
+        "meta": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "matplotlib": matplotlib.__version__,
+            "platform": platform.platform(),
+            "qgis": qgisStages is not None,
+            "duplicate_rate": options.duplicate_rate,
+            "tolerance": options.tolerance,
+            "ncontour": options.ncontour,
+            "repeat": options.repeat,
+        },
+        "results": results,
+    }
+    for filename in (options.output, options.save_baseline):
+        if filename:
+            with open(filename, "w") as jf:
+                json.dump(output, jf, indent=2)
+
+    if options.baseline:
+        with open(options.baseline) as jf:
+            baseline = json.load(jf)
+        regressions = compareBaseline(
+            results, baseline, options.threshold, stageThresholds, options.min_time
+        )
+        for message in regressions:
+            print("REGRESSION: " + message)
+        if regressions:
+            sys.exit(1)
+        print("No regressions against baseline {0}".format(options.baseline))
+
+
+if __name__ == "__main__":
+    main()
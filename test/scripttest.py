@@ -0,0 +1,48 @@
+"""
+Support for the script tests in this directory.  Importing this module
+makes the contour package importable.  Each test reports its results with
+check() and ends with finish(), which prints the number of failed checks
+and exits with status 1 if any failed.  Tests using the qgis python module
+can create a layer of points to contour with pointLayer().
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+_nfail = 0
+
+
+def check(name, ok, detail=""):
+    global _nfail
+    print("{0}: {1} {2}".format(name, "ok" if ok else "FAILED", detail))
+    if not ok:
+        _nfail += 1
+    return ok
+
+
+def finish():
+    print("{0} tests failed".format(_nfail))
+    sys.exit(1 if _nfail else 0)
+
+
+def pointLayer(x, y, z, crs=None):
+    """
+    Memory layer of points with a double field z.  Requires the qgis python
+    module, with the QgsApplication initialised.
+    """
+    from qgis.core import QgsFeature, QgsGeometry, QgsPointXY, QgsVectorLayer
+
+    url = "Point?field=z:double"
+    if crs is not None:
+        url += "&crs=" + crs
+    layer = QgsVectorLayer(url, "points", "memory")
+    features = []
+    for xi, yi, zi in zip(x, y, z):
+        feature = QgsFeature(layer.fields())
+        feature.setGeometry(QgsGeometry.fromPointXY(QgsPointXY(xi, yi)))
+        feature.setAttributes([float(zi)])
+        features.append(feature)
+    layer.dataProvider().addFeatures(features)
+    return layer
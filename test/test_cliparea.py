@@ -0,0 +1,100 @@
+#!/usr/bin/python3
+"""
+Test ContourGenerator.setClipArea.  Only the points within the bounding box
+of the clip area expanded by the buffer should be loaded, the line and
+filled contours should lie within the clip area, and the filled contours
+should cover it.  Requires the qgis python module.  Exits with status 1 if
+any test fails.
+"""
+
+import numpy as np
+
+from scripttest import check, finish
+
+from qgis.core import (
+    QgsApplication,
+    QgsFeature,
+    QgsGeometry,
+    QgsPointXY,
+    QgsRectangle,
+    QgsVectorLayer,
+)
+
+app = QgsApplication([], False)
+app.initQgis()
+
+from contour.ContourGenerator import ContourGenerator
+
+rng = np.random.default_rng(11)
+npt = 2000
+x = rng.uniform(0, 1000, npt)
+y = rng.uniform(0, 1000, npt)
+z = np.sin(x / 150.0) * np.cos(y / 200.0) * 50.0 + x * 0.01
+
+layer = QgsVectorLayer("Point?field=z:double", "points", "memory")
+features = []
+for xi, yi, zi in zip(x, y, z):
+    feature = QgsFeature(layer.fields())
+    feature.setGeometry(QgsGeometry.fromPointXY(QgsPointXY(xi, yi)))
+    feature.setAttributes([float(zi)])
+    features.append(feature)
+layer.dataProvider().addFeatures(features)
+
+extent = QgsRectangle(200.0, 150.0, 700.0, 800.0)
+mask = QgsGeometry.fromWkt("POLYGON((100 100,900 300,400 900,100 100))")
+clip = mask.intersection(QgsGeometry.fromRect(extent))
+buffer = 50.0
+tolerance = 1.0e-6
+
+generator = ContourGenerator(layer, '"z"')
+generator.setContourMethod("equal", {"ncontour": 8})
+generator.setClipArea(extent, mask, buffer)
+
+# Points loaded
+
+gx, gy, gz = generator.data()
+box = clip.boundingBox().buffered(buffer)
+inbox = (
+    (x >= box.xMinimum())
+    & (x <= box.xMaximum())
+    & (y >= box.yMinimum())
+    & (y <= box.yMaximum())
+)
+check(
+    "points loaded",
+    len(gz) == np.count_nonzero(inbox),
+    "{0} loaded {1} in area".format(len(gz), np.count_nonzero(inbox)),
+)
+check(
+    "points in buffered area",
+    np.all(gx >= box.xMinimum())
+    and np.all(gx <= box.xMaximum())
+    and np.all(gy >= box.yMinimum())
+    and np.all(gy <= box.yMaximum()),
+)
+
+# Contours clipped to the area
+
+within = clip.buffer(tolerance, 8)
+for contourType in ("line", "filled"):
+    generator.setContourType(contourType)
+    generator.setContourExtendOption("both")
+    geoms = [f.geometry() for f in generator.contourFeatures()]
+    check("{0} features".format(contourType), len(geoms) > 0, len(geoms))
+    outside = [g for g in geoms if g.isEmpty() or not within.contains(g)]
+    check("{0} within clip area".format(contourType), len(outside) == 0, len(outside))
+    if contourType == "filled":
+        area = sum(g.area() for g in geoms)
+        check(
+            "filled covers clip area",
+            np.isclose(area, clip.area(), rtol=1.0e-6),
+            "{0:.3f} filled {1:.3f} clip area".format(area, clip.area()),
+        )
+
+# Removing the clip area loads all the points
+
+generator.setClipArea()
+gx, gy, gz = generator.data()
+check("clip removed", len(gz) == npt, len(gz))
+
+finish()
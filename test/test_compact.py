@@ -0,0 +1,101 @@
+#!/usr/bin/python3
+"""
+Test ContourGenerator compact storage.  Coordinates should be stored as
+float32 offsets from an origin within CompactResolution of the original
+values, and z values as float32 where this does not lose significant
+precision.  Contours from compact storage should be in the original
+coordinates and match those from float64 data.  Data whose extent is too
+large keep their float64 coordinates.  Requires the qgis python module.
+Exits with status 1 if any test fails.
+"""
+
+import numpy as np
+
+from scripttest import check, finish, pointLayer
+
+from qgis.core import QgsApplication
+
+app = QgsApplication([], False)
+app.initQgis()
+
+from contour.ContourGenerator import ContourGenerator
+
+
+def generator(layer, compact):
+    result = ContourGenerator(layer, '"z"')
+    result.setContourMethod("equal", {"ncontour": 6})
+    result.setCompactStorage(compact)
+    return result
+
+
+def geometries(generator, contourType):
+    generator.setContourType(contourType)
+    return [f.geometry() for f in generator.contourFeatures()]
+
+
+rng = np.random.default_rng(29)
+npt = 3000
+x0 = 1750000.0
+y0 = 5900000.0
+x = x0 + rng.uniform(0, 10000.0, npt)
+y = y0 + rng.uniform(0, 8000.0, npt)
+z = 100.0 + np.sin((x - x0) / 1500.0) * np.cos((y - y0) / 2000.0) * 50.0
+layer = pointLayer(x, y, z, "EPSG:2193")
+
+full = generator(layer, False)
+compact = generator(layer, True)
+
+# Compact data
+
+cx, cy, cz = compact.data()
+origin = compact._origin
+resolution = ContourGenerator.CompactResolution
+check(
+    "float32",
+    cx.dtype == np.float32 and cy.dtype == np.float32 and cz.dtype == np.float32,
+)
+check("origin", origin != [0, 0], origin)
+check(
+    "coordinates",
+    np.max(np.abs(cx + origin[0] - x)) <= resolution
+    and np.max(np.abs(cy + origin[1] - y)) <= resolution,
+)
+check(
+    "z values",
+    np.max(np.abs(cz - z)) <= ContourGenerator.CompactZRelativeError * np.ptp(z),
+)
+
+# Contours in the original coordinates
+
+check("levels", np.allclose(full.levels(), compact.levels(), rtol=1.0e-6))
+for contourType in ("line", "filled"):
+    expected = geometries(full, contourType)
+    actual = geometries(compact, contourType)
+    same = len(expected) == len(actual)
+    for g0, g1 in zip(expected, actual):
+        b0 = g0.boundingBox()
+        b1 = g1.boundingBox()
+        same = (
+            same
+            and np.isclose(g0.length(), g1.length(), rtol=1.0e-5)
+            and np.isclose(g0.area(), g1.area(), rtol=1.0e-5)
+            and np.allclose(
+                [b0.xMinimum(), b0.yMinimum(), b0.xMaximum(), b0.yMaximum()],
+                [b1.xMinimum(), b1.yMinimum(), b1.xMaximum(), b1.yMaximum()],
+                rtol=0.0,
+                atol=0.01,
+            )
+        )
+    check("{0} contours".format(contourType), same, len(actual))
+
+# Extent too large for float32 coordinates, and z values needing float64
+
+large = pointLayer(x0 + (x - x0) * 100.0, y, 1.0e6 + z * 1.0e-3, "EPSG:2193")
+lx, ly, lz = generator(large, True).data()
+check(
+    "large extent",
+    lx.dtype == np.float64 and ly.dtype == np.float64 and lz.dtype == np.float64,
+)
+check("large extent values", np.array_equal(lx, x0 + (x - x0) * 100.0))
+
+finish()
@@ -0,0 +1,119 @@
+#!/usr/bin/python3
+"""
+Test the parts of ContourDialog used while loading data and writing
+contour layers.  The dialog feedback should process pending events during
+progress updates only while interruptible, so that a change of the data
+settings can cancel a reload, and a cancelled load should discard the
+partial data without reporting an error.  Contour features should be
+written directly to the layer provider, and a layer being replaced should
+be emptied keeping its id and properties.  Requires the qgis python module,
+and uses the Qt offscreen platform if no other is set.  Exits with status 1
+if any test fails.
+"""
+
+import os
+from types import SimpleNamespace
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+import numpy as np
+
+from scripttest import check, finish, pointLayer
+
+from PyQt5.QtCore import QTimer
+from PyQt5.QtWidgets import QProgressBar
+from qgis.core import QgsApplication, QgsVectorLayer
+from qgis.gui import QgsMessageBar
+
+app = QgsApplication([], True)
+app.initQgis()
+
+from contour.ContourDialog import ContourDialog
+from contour.ContourGenerator import ContourGenerator
+
+rng = np.random.default_rng(41)
+npt = 2000
+x = rng.uniform(0, 1000, npt)
+y = rng.uniform(0, 1000, npt)
+z = np.sin(x / 150.0) * np.cos(y / 200.0) * 50.0
+layer = pointLayer(x, y, z)
+
+# Cancelling and interruptible progress
+
+messageBar = QgsMessageBar()
+progress = QProgressBar()
+feedback = ContourDialog.Feedback(messageBar, progress)
+check("not cancelled", not feedback.isCanceled())
+feedback.cancel()
+check("cancelled", feedback.isCanceled())
+feedback.setInterruptible(True)
+check("cancel reset", not feedback.isCanceled())
+
+feedback.setInterruptible(False)
+QTimer.singleShot(0, feedback.cancel)
+feedback.setProgress(10)
+check("progress", progress.value() == 10, progress.value())
+check("events not processed", not feedback.isCanceled())
+feedback.setInterruptible(True)
+feedback.setProgress(20)
+check("events processed", feedback.isCanceled())
+
+# A load cancelled while interruptible
+
+generator = ContourGenerator(layer, '"z"', feedback)
+feedback.setInterruptible(True)
+QTimer.singleShot(0, feedback.cancel)
+gx, gy, gz = generator.data()
+check("load cancelled", feedback.isCanceled() and gz is None)
+check("cancel not reported", len(messageBar.items()) == 0)
+feedback.setInterruptible(False)
+generator.setReloadData()
+gx, gy, gz = generator.data()
+check("reloaded", gz is not None and np.array_equal(gz, z))
+
+# Writing contour features.  The layer methods only use the dialog's
+# generator, so are called with a stand in for the dialog.
+
+dialog = SimpleNamespace(_generator=generator)
+generator.setContourMethod("equal", {"ncontour": 8})
+features = list(generator.contourFeatures())
+contours = QgsVectorLayer("MultiLineString", "contours", "memory")
+contours.dataProvider().addAttributes(generator.fields())
+contours.updateFields()
+ContourDialog.writeFeatures(dialog, contours, features[:3])
+ContourDialog.writeFeatures(dialog, contours, [])
+ContourDialog.writeFeatures(dialog, contours, features[3:])
+check(
+    "features written",
+    contours.featureCount() == len(features) and not contours.isEditable(),
+    contours.featureCount(),
+)
+check(
+    "written features counted",
+    generator.profile().counter("features_written") == len(features),
+)
+levels = sorted(f["index"] for f in contours.getFeatures())
+check("written levels", levels == list(range(len(features))), levels)
+
+# Clearing a layer to be replaced
+
+contours.setCustomProperty("ContourPlugin.ContourId", "replaced")
+layerId = contours.id()
+ContourDialog.clearLayer(dialog, contours)
+check(
+    "layer cleared",
+    contours.featureCount() == 0
+    and len(contours.fields()) == 0
+    and contours.dataProvider().featureCount() == 0,
+)
+check(
+    "layer kept",
+    contours.id() == layerId
+    and contours.customProperty("ContourPlugin.ContourId") == "replaced",
+)
+contours.dataProvider().addAttributes(generator.fields())
+contours.updateFields()
+ContourDialog.writeFeatures(dialog, contours, features)
+check("layer reused", contours.featureCount() == len(features))
+
+finish()
@@ -0,0 +1,95 @@
+#!/usr/bin/python3
+"""
+Compare z values from expressions compiled by ContourExpression with those
+evaluated by QgsExpression, in particular for values on rounding
+boundaries.  Requires the qgis python module.  Exits with status 1 if any
+expression is not compiled or any value differs.
+"""
+
+import numpy as np
+
+from scripttest import check, finish
+
+from PyQt5.QtCore import QVariant
+from qgis.core import (
+    QgsApplication,
+    QgsExpression,
+    QgsExpressionContext,
+    QgsFeature,
+    QgsField,
+    QgsFields,
+)
+
+app = QgsApplication([], False)
+app.initQgis()
+
+from contour.ContourExpression import CompiledExpression
+
+expressions = [
+    "round(z)",
+    "round(z, 1)",
+    "round(z, 2)",
+    "round(z, -1)",
+    "round(z * 10) / 10",
+    "floor(z) + ceil(z)",
+    "abs(round(-z))",
+    "z / 0",
+    "z % 2",
+    "z // 2",
+    "sqrt(z)",
+    "coalesce(z, 0)",
+]
+
+values = [
+    0.5,
+    1.5,
+    2.5,
+    -0.5,
+    -1.5,
+    -2.5,
+    0.25,
+    0.35,
+    -0.25,
+    1.005,
+    2.675,
+    15.0,
+    25.0,
+    -35.0,
+    0.0,
+    None,
+]
+
+fields = QgsFields()
+fields.append(QgsField("z", QVariant.Double))
+column = np.array(
+    [CompiledExpression.attributeValue(value) for value in values], dtype=np.float64
+)
+
+for text in expressions:
+    compiled = CompiledExpression.compile(text, fields)
+    if not check(text + " compiled", compiled is not None):
+        continue
+    result = compiled.evaluate([column], len(values))
+    expression = QgsExpression(text)
+    context = QgsExpressionContext()
+    context.setFields(fields)
+    expression.prepare(context)
+    differences = []
+    for value, zcompiled in zip(values, result):
+        feature = QgsFeature(fields)
+        feature.setAttributes([value])
+        context.setFeature(feature)
+        zqgis = expression.evaluate(context)
+        if zqgis is None or (isinstance(zqgis, QVariant) and zqgis.isNull()):
+            zqgis = np.nan
+        zqgis = float(zqgis)
+        same = (np.isnan(zqgis) and np.isnan(zcompiled)) or np.isclose(
+            zqgis, zcompiled, rtol=1.0e-12, atol=0.0
+        )
+        if not same:
+            differences.append(
+                "z={0}: compiled {1} QGIS {2}".format(value, zcompiled, zqgis)
+            )
+    check(text, not differences, "; ".join(differences))
+
+finish()
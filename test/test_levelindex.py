@@ -0,0 +1,104 @@
+#!/usr/bin/python3
+"""
+Test ContourLevelIndex.  For each level the end points of the segments
+calculated by the index should be the vertices of the lines calculated by
+matplotlib tricontour for the same triangulation, each shared by two
+segments except at the ends of open lines, and the lines joined by the
+index should have the same numbers of parts and vertices.  Gridded data are
+compared with tricontour of the triangulation of the grid cells used by
+fromGrid.  Exits with status 1 if any test fails.
+"""
+
+from collections import Counter
+
+import numpy as np
+import matplotlib
+
+matplotlib.use("Agg")
+from matplotlib.pyplot import tricontour
+from matplotlib.tri import Triangulation
+
+from scripttest import check, finish
+from contour import ContourUtils
+from contour.ContourLevelIndex import ContourLevelIndex
+
+
+def pointCounts(points):
+    return Counter(tuple(p) for p in np.round(points, 6))
+
+
+def compare(name, index, trig, z, levels):
+    cs = tricontour(trig, z, levels)
+    check(name + " levels", np.array_equal(index.levels(), levels))
+    for i, (level, lines) in enumerate(zip(levels, cs.allsegs)):
+        segments = index.levelSegments(i)
+        lines = [l for l in lines if len(l) > 1]
+        # Each line vertex is the end of two segments, except at the ends
+        # of open lines.  Closed lines repeat their first vertex.
+        expected = Counter()
+        for line in lines:
+            closed = np.array_equal(line[0], line[-1])
+            points = line[:-1] if closed else line
+            counts = pointCounts(points)
+            for point in counts:
+                counts[point] *= 2
+            if not closed:
+                counts[tuple(np.round(line[0], 6))] -= 1
+                counts[tuple(np.round(line[-1], 6))] -= 1
+            expected.update(counts)
+        actual = pointCounts(segments.reshape(-1, 2))
+        nseg = sum(len(l) - 1 for l in lines)
+        check(
+            "{0} level {1:.1f} segments".format(name, level),
+            len(segments) == nseg,
+            "{0} index {1} tricontour".format(len(segments), nseg),
+        )
+        check("{0} level {1:.1f} points".format(name, level), actual == expected)
+        joined = index.levelLines(i)
+        nclosed = sum(np.array_equal(l[0], l[-1]) for l in joined)
+        check(
+            "{0} level {1:.1f} lines".format(name, level),
+            len(joined) == len(lines)
+            and sum(len(l) for l in joined) == sum(len(l) for l in lines)
+            and nclosed == sum(np.array_equal(l[0], l[-1]) for l in lines),
+            "{0} index {1} tricontour".format(len(joined), len(lines)),
+        )
+    ContourUtils.releaseContourSet(cs)
+
+
+# Scattered points
+
+rng = np.random.default_rng(7)
+npt = 3000
+x = rng.uniform(0, 1000, npt)
+y = rng.uniform(0, 1000, npt)
+z = np.sin(x / 150.0) * np.cos(y / 200.0) * 50.0 + x * 0.01
+trig = ContourUtils.buildTriangulation(x, y)
+levels = np.linspace(-40.0, 50.0, 7)
+index = ContourLevelIndex.fromTriangulation(trig, z, levels)
+compare("scattered", index, trig, z, levels)
+
+# Gridded data with masked values
+
+gx = np.linspace(0.0, 100.0, 41)
+gy = np.linspace(0.0, 50.0, 21)
+mx, my = np.meshgrid(gx, gy)
+gz = np.hypot(mx - 40.0, my - 20.0) + 0.001 * mx
+gz = np.ma.masked_array(gz, mask=(mx > 80.0) & (my > 30.0))
+levels = np.array([5.5, 10.5, 20.5, 30.5])
+index = ContourLevelIndex.fromGrid(gx, gy, gz, levels)
+nrow, ncol = gz.shape
+node = np.arange(nrow * ncol).reshape(nrow, ncol)
+n00 = node[:-1, :-1].ravel()
+n01 = node[:-1, 1:].ravel()
+n10 = node[1:, :-1].ravel()
+n11 = node[1:, 1:].ravel()
+triangles = np.vstack(
+    (np.column_stack((n00, n01, n11)), np.column_stack((n00, n11, n10)))
+)
+zflat = np.ma.filled(gz, np.nan).ravel()
+mask = np.any(np.isnan(zflat[triangles]), axis=1)
+gtrig = Triangulation(mx.ravel(), my.ravel(), triangles, mask)
+compare("grid", index, gtrig, np.nan_to_num(zflat), levels)
+
+finish()
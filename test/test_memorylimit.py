@@ -0,0 +1,95 @@
+#!/usr/bin/python3
+"""
+Test the ContourGenerator memory limit and release.  Scattered data which
+would need more than the memory limit to triangulate should be thinned,
+and gridded data decimated, to within the limit.  Releasing the generator
+should drop the loaded data, which are reloaded when next used.  Requires
+the qgis python module.  Exits with status 1 if any test fails.
+"""
+
+import numpy as np
+
+from scripttest import check, finish, pointLayer
+
+from qgis.core import QgsApplication
+
+app = QgsApplication([], False)
+app.initQgis()
+
+from contour.ContourGenerator import ContourGenerator
+
+
+class Feedback:
+    def __init__(self):
+        self.messages = []
+
+    def isCanceled(self):
+        return False
+
+    def setProgress(self, percent):
+        pass
+
+    def pushInfo(self, message):
+        self.messages.append(message)
+
+    def reportError(self, message, fatal=False):
+        self.messages.append(message)
+
+
+def thinned(feedback):
+    return any(m.startswith("Data thinned") for m in feedback.messages)
+
+
+rng = np.random.default_rng(17)
+npt = 5000
+x = rng.uniform(0, 1000, npt)
+y = rng.uniform(0, 1000, npt)
+z = np.sin(x / 150.0) * np.cos(y / 200.0) * 50.0
+layer = pointLayer(x, y, z)
+
+# Scattered data thinned to the number of points that can be triangulated
+
+feedback = Feedback()
+generator = ContourGenerator(layer, '"z"', feedback)
+generator.setContourMethod("equal", {"ncontour": 5})
+trig, tz = generator.trigContourData()
+check("no limit", len(trig.x) == npt and not thinned(feedback), len(trig.x))
+
+maxpt = 1000
+generator.setMemoryLimit(maxpt * ContourGenerator.TrigBytesPerPoint)
+trig, tz = generator.trigContourData()
+check(
+    "scattered thinned",
+    maxpt / 4 < len(trig.x) <= maxpt and len(tz) == len(trig.x),
+    len(trig.x),
+)
+check("thinned message", thinned(feedback))
+check("loaded data kept", len(generator.data()[2]) == npt)
+check("contours within limit", len(list(generator.contourFeatures())) > 0)
+
+# Gridded data decimated
+
+gx, gy = np.meshgrid(np.linspace(0.0, 1000.0, 101), np.linspace(0.0, 1000.0, 101))
+gz = np.hypot(gx - 400.0, gy - 600.0)
+feedback = Feedback()
+grid = ContourGenerator(pointLayer(gx.ravel(), gy.ravel(), gz.ravel()), '"z"', feedback)
+grid.setMemoryLimit(2000 * ContourGenerator.GridBytesPerPoint)
+cx, cy, cz = grid.gridContourData()
+check("grid decimated", cz.shape == (34, 34), cz.shape)
+check(
+    "grid decimated values",
+    np.array_equal(cz, gz[::3, ::3]) and np.array_equal(cx, gx[::3, ::3]),
+)
+check("grid thinned message", thinned(feedback))
+
+# Release
+
+generator.setMemoryLimit(None)
+with generator:
+    generator.data()
+    check("loaded", generator.dataLoaded())
+check("released", not generator.dataLoaded() and generator._z is None)
+x1, y1, z1 = generator.data()
+check("reloaded", z1 is not None and len(z1) == npt)
+
+finish()
@@ -0,0 +1,142 @@
+#!/usr/bin/python3
+"""
+Test ContourUtils.mergeLines.  The two point segments calculated by
+ContourLevelIndex for each level are merged, and the merged lines should
+have the same number of parts and vertices as the lines calculated by
+matplotlib tricontour from the same triangulation.  Also tests merging
+shuffled and reversed pieces of known lines, including pieces whose shared
+end points differ by less than the tolerance.
+"""
+
+import numpy as np
+import matplotlib
+
+matplotlib.use("Agg")
+from matplotlib.pyplot import tricontour
+
+from scripttest import check, finish
+from contour import ContourUtils
+from contour.ContourLevelIndex import ContourLevelIndex
+
+
+def lineKey(line):
+    # Lines compared independent of direction and, for rings, start point
+    line = np.round(np.asarray(line), 9)
+    closed = len(line) > 2 and np.array_equal(line[0], line[-1])
+    if closed:
+        points = [tuple(p) for p in line[:-1]]
+        start = points.index(min(points))
+        points = points[start:] + points[:start]
+        reverse = [points[0]] + points[1:][::-1]
+        return ("ring", tuple(min(points, reverse)))
+    points = [tuple(p) for p in line]
+    return ("line", tuple(min(points, points[::-1])))
+
+
+# Merge shuffled, reversed pieces of an open line, a ring, and an X shaped
+# junction where four lines meet
+
+t = np.linspace(0, 2 * np.pi, 101)
+ring = np.column_stack((np.cos(t), np.sin(t)))
+ring[-1] = ring[0]
+line = np.column_stack((np.linspace(5, 6, 21), np.zeros(21)))
+cross = [
+    np.array([[10.0, 0.0], [11.0, 1.0]]),
+    np.array([[11.0, 1.0], [12.0, 2.0]]),
+    np.array([[10.0, 2.0], [11.0, 1.0]]),
+    np.array([[11.0, 1.0], [12.0, 0.0]]),
+]
+closed = ring.copy() + 20.0
+pieces = [ring[i : i + 2] for i in range(100)]
+pieces += [line[i : i + 3] for i in range(0, 20, 2)]
+pieces += cross + [closed]
+rng = np.random.default_rng(1)
+order = rng.permutation(len(pieces))
+pieces = [pieces[i] if rng.random() < 0.5 else pieces[i][::-1] for i in order]
+merged = ContourUtils.mergeLines(pieces, 1.0e-9)
+expected = [ring, line, closed] + cross
+check("pieces parts", len(merged) == len(expected), len(merged))
+check(
+    "pieces lines",
+    sorted(lineKey(l) for l in merged) == sorted(lineKey(l) for l in expected),
+)
+check(
+    "rings closed",
+    all(np.array_equal(l[0], l[-1]) for l in merged if len(l) == 101),
+)
+check("empty", ContourUtils.mergeLines([], 1.0e-9) == [])
+check("single", len(ContourUtils.mergeLines([line], 1.0e-9)) == 1)
+
+# Shared end points perturbed by less than the tolerance, as where the same
+# crossing is calculated separately for two pieces, are joined whichever
+# side of a hash cell boundary they fall
+
+tolerance = 1.0e-6
+t = np.linspace(0.0, 1.0, 2001)
+line = np.column_stack((t, np.sin(5.0 * t)))
+ring = np.column_stack((np.cos(2.0 * np.pi * t), np.sin(2.0 * np.pi * t)))
+ring[-1] = ring[0]
+pieces = [line[i : i + 3] for i in range(0, 2000, 2)]
+pieces += [ring[i : i + 2] + 3.0 for i in range(2000)]
+perturbed = []
+for piece in pieces:
+    piece = piece.copy()
+    piece[[0, -1]] += rng.uniform(-0.3, 0.3, (2, 2)) * tolerance
+    perturbed.append(piece)
+merged = ContourUtils.mergeLines(perturbed, tolerance)
+check("perturbed parts", len(merged) == 2, len(merged))
+check(
+    "perturbed vertices",
+    sorted(len(l) for l in merged) == [2001, 2001],
+    sum(len(l) for l in merged),
+)
+check(
+    "perturbed ring closed",
+    sum(np.array_equal(l[0], l[-1]) for l in merged) == 1,
+)
+# Three ends within tolerance of each other are not joined
+junction = [
+    np.array([[0.0, 0.0], [1.0, 0.0]]),
+    np.array([[1.0 + 0.5 * tolerance, 0.0], [2.0, 0.0]]),
+    np.array([[1.0, 0.5 * tolerance], [1.0, 1.0]]),
+]
+check("three ends", len(ContourUtils.mergeLines(junction, tolerance)) == 3)
+check("separate ends", len(ContourUtils.mergeLines(junction[:2], 0.1 * tolerance)) == 2)
+check("equal ends", len(ContourUtils.mergeLines([line[:3], line[2:5]], 0.0)) == 1)
+
+# Compare merged level index segments with tricontour
+
+rng = np.random.default_rng(42)
+npt = 5000
+x = rng.uniform(0, 1000, npt)
+y = rng.uniform(0, 1000, npt)
+z = np.sin(x / 150.0) * np.cos(y / 200.0) * 50.0 + x * 0.01
+trig = ContourUtils.buildTriangulation(x, y)
+levels = np.linspace(-40.0, 50.0, 10)
+tolerance = 1.0e-9 * max(np.ptp(x), np.ptp(y))
+
+cs = tricontour(trig, z, levels)
+index = ContourLevelIndex.fromTriangulation(trig, z, levels)
+nsegments = 0
+nmerged = 0
+for (level, segments), mplLines in zip(index.allSegments(), cs.allsegs):
+    nsegments += len(segments)
+    merged = ContourUtils.mergeLines(list(segments), tolerance)
+    nmerged += len(merged)
+    mplLines = [l for l in mplLines if len(l) > 1]
+    check(
+        "level {0:.1f} parts".format(level),
+        len(merged) == len(mplLines),
+        "{0} merged {1} tricontour".format(len(merged), len(mplLines)),
+    )
+    nvmerged = sum(len(l) for l in merged)
+    nvmpl = sum(len(l) for l in mplLines)
+    check(
+        "level {0:.1f} vertices".format(level),
+        nvmerged == nvmpl,
+        "{0} merged {1} tricontour".format(nvmerged, nvmpl),
+    )
+ContourUtils.releaseContourSet(cs)
+print("{0} segments merged into {1} lines".format(nsegments, nmerged))
+
+finish()
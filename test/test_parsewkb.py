@@ -0,0 +1,79 @@
+#!/usr/bin/python3
+"""
+Test ContourUtils.parsePointWkb with points with and without z and m
+values, using ISO and extended WKB type codes in both byte orders, and
+check that data which are not points of a single type are rejected.  Exits
+with status 1 if any test fails.
+"""
+
+import struct
+
+import numpy as np
+
+from scripttest import check, finish
+from contour import ContourUtils
+
+def pointWkb(wkbtype, coords, bigEndian=False):
+    endian = ">" if bigEndian else "<"
+    return struct.pack(
+        endian + "BI" + "d" * len(coords), 0 if bigEndian else 1, wkbtype, *coords
+    )
+
+
+def rejected(data, count):
+    try:
+        ContourUtils.parsePointWkb(data, count)
+    except ValueError:
+        return True
+    return False
+
+
+rng = np.random.default_rng(5)
+npt = 20
+values = {name: rng.uniform(-1000.0, 1000.0, npt) for name in "xyzm"}
+
+# (name, wkb type, names of coordinates)
+types = [
+    ("2d", 1, "xy"),
+    ("iso z", 1001, "xyz"),
+    ("iso m", 2001, "xym"),
+    ("iso zm", 3001, "xyzm"),
+    ("ewkb z", 0x80000001, "xyz"),
+    ("ewkb m", 0x40000001, "xym"),
+    ("ewkb zm", 0xC0000001, "xyzm"),
+]
+
+for name, wkbtype, names in types:
+    for bigEndian in (False, True):
+        label = "{0} {1}".format(name, "big endian" if bigEndian else "little endian")
+        data = b"".join(
+            pointWkb(wkbtype, [values[n][i] for n in names], bigEndian)
+            for i in range(npt)
+        )
+        try:
+            result = ContourUtils.parsePointWkb(data, npt)
+        except ValueError as ex:
+            check(label, False, str(ex))
+            continue
+        ok = True
+        for n, array in zip("xyzm", result):
+            if n in names:
+                ok = ok and array is not None and np.array_equal(array, values[n])
+            else:
+                ok = ok and array is None
+        check(label, ok)
+
+x, y, z, m = ContourUtils.parsePointWkb(b"", 0)
+check("no points", len(x) == 0 and len(y) == 0 and z is None and m is None)
+
+point = pointWkb(1, [1.0, 2.0])
+pointz = pointWkb(1001, [1.0, 2.0, 3.0])
+check("mixed types", rejected(point + point + pointz, 3))
+check("mixed types same size", rejected(pointz + pointWkb(2001, [1.0, 2.0, 3.0]), 2))
+check("mixed byte order", rejected(point + pointWkb(1, [1.0, 2.0], True), 2))
+linestring = struct.pack("<BIIdddd", 1, 2, 2, 0.0, 0.0, 1.0, 1.0)
+check("linestring", rejected(linestring, 1))
+check("wrong count", rejected(point + point, 3))
+check("truncated", rejected(point[:-1], 1))
+
+finish()
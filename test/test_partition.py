@@ -0,0 +1,133 @@
+#!/usr/bin/python3
+"""
+Test the partitioned triangulation of scattered points.  Tests edge cases
+of ContourUtils.clipLine, that the blocks from partitionBlocks cover the
+points, and that the lines from ContourPool.partitionedLines, once merged,
+are the same as those from a single triangulation of all the points.  Flat
+triangles on the edge of the data may be masked differently in each block,
+so line lengths are compared away from the edge.  Exits with status 1 if
+any test fails.
+"""
+
+import numpy as np
+import matplotlib
+
+matplotlib.use("Agg")
+from matplotlib.pyplot import tricontour
+
+from scripttest import check, finish
+from contour import ContourUtils
+from contour.ContourParallel import ContourPool, partitionBlocks
+
+def clipped(line, bounds):
+    return [
+        (piece.tolist(), start, end)
+        for piece, start, end in ContourUtils.clipLine(np.array(line, float), bounds)
+    ]
+
+
+def testClipLine():
+    bounds = (0.0, 0.0, 10.0, 10.0)
+    inside = [[1.0, 1.0], [5.0, 5.0], [9.0, 2.0]]
+    check("inside", clipped(inside, bounds) == [(inside, False, False)])
+    check("outside", clipped([[11.0, 1.0], [15.0, 5.0]], bounds) == [])
+    check("single point", clipped([[1.0, 1.0]], bounds) == [])
+    check(
+        "crossing",
+        clipped([[-5.0, 5.0], [5.0, 5.0], [15.0, 5.0]], bounds)
+        == [([[0.0, 5.0], [5.0, 5.0], [10.0, 5.0]], True, True)],
+    )
+    check(
+        "leaving and re-entering",
+        clipped([[5.0, 5.0], [5.0, 15.0], [8.0, 15.0], [8.0, 5.0]], bounds)
+        == [
+            ([[5.0, 5.0], [5.0, 10.0]], False, True),
+            ([[8.0, 10.0], [8.0, 5.0]], True, False),
+        ],
+    )
+    check(
+        "along boundary",
+        clipped([[0.0, 2.0], [0.0, 8.0]], bounds)
+        == [([[0.0, 2.0], [0.0, 8.0]], False, False)],
+    )
+    check("parallel outside", clipped([[-1.0, 2.0], [-1.0, 8.0]], bounds) == [])
+    check(
+        "ending on boundary",
+        clipped([[5.0, 5.0], [10.0, 5.0]], bounds)
+        == [([[5.0, 5.0], [10.0, 5.0]], False, False)],
+    )
+    # Touching the rectangle at a single point leaves nothing
+    check("corner", clipped([[-5.0, 5.0], [5.0, -5.0]], bounds) == [])
+    check(
+        "infinite bounds",
+        clipped([[-5.0, 5.0], [5.0, 5.0]], (0.0, -np.inf, np.inf, np.inf))
+        == [([[0.0, 5.0], [5.0, 5.0]], True, False)],
+    )
+
+
+def testBlocks(x, y):
+    blocks = partitionBlocks(x, y, 6, 20.0)
+    check("block count", len(blocks) == 6, len(blocks))
+    covered = np.zeros(len(x), dtype=int)
+    for core, extent in blocks:
+        xmin, ymin, xmax, ymax = core
+        covered += (x >= xmin) & (x <= xmax) & (y >= ymin) & (y <= ymax)
+        check(
+            "extent contains core",
+            extent[0] <= max(xmin, x.min())
+            and extent[1] <= max(ymin, y.min())
+            and extent[2] >= min(xmax, x.max())
+            and extent[3] >= min(ymax, y.max()),
+        )
+    check("points covered", np.all(covered >= 1))
+    return blocks
+
+
+def lineLength(lines, bounds):
+    pieces = [p for l in lines for p, s, e in ContourUtils.clipLine(l, bounds)]
+    return sum(np.sum(np.hypot(*np.diff(p, axis=0).T)) for p in pieces)
+
+
+def testPartitionedLines(x, y, z, blocks, inset):
+    levels = np.linspace(-40.0, 50.0, 7)
+    tolerance = 1.0e-9 * max(np.ptp(x), np.ptp(y))
+    interior = (x.min() + inset, y.min() + inset, x.max() - inset, y.max() - inset)
+    trig = ContourUtils.buildTriangulation(x, y)
+    cs = tricontour(trig, z, levels)
+    single = [[l for l in lines if len(l) > 1] for lines in cs.allsegs]
+    ContourUtils.releaseContourSet(cs)
+    with ContourPool(2, {"x": x, "y": y, "z": z}) as pool:
+        partitioned = pool.partitionedLines(levels, blocks)
+    for (level, pieces), lines in zip(partitioned, single):
+        merged = ContourUtils.mergeLines(pieces, tolerance)
+        check(
+            "level {0:.1f} parts".format(level),
+            len(merged) == len(lines),
+            "{0} partitioned {1} single".format(len(merged), len(lines)),
+        )
+        lmerged = lineLength(merged, interior)
+        lsingle = lineLength(lines, interior)
+        check(
+            "level {0:.1f} length".format(level),
+            np.isclose(lmerged, lsingle, rtol=1.0e-9),
+            "{0:.6f} partitioned {1:.6f} single".format(lmerged, lsingle),
+        )
+
+
+def main():
+    testClipLine()
+    rng = np.random.default_rng(3)
+    npt = 4000
+    x = rng.uniform(0, 1000, npt)
+    y = rng.uniform(0, 1000, npt)
+    z = np.sin(x / 150.0) * np.cos(y / 200.0) * 50.0 + x * 0.01
+    blocks = testBlocks(x, y)
+    # Buffer of several point spacings, as used by the contour generator
+    buffer = 10.0 * np.sqrt(1.0e6 / npt)
+    blocks = partitionBlocks(x, y, 6, buffer)
+    testPartitionedLines(x, y, z, blocks, buffer)
+    finish()
+
+
+if __name__ == "__main__":
+    main()
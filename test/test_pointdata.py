@@ -0,0 +1,87 @@
+#!/usr/bin/python3
+"""
+Test the handling of point data by ContourUtils.discardDuplicatePoints and
+DataGridder.  Near duplicate points should be discarded within the
+tolerance, converted from metres to degrees for longitude/latitude data,
+and DataGridder should use float64 data without copying or modifying it.
+Exits with status 1 if any test fails.
+"""
+
+import numpy as np
+
+from scripttest import check, finish
+from contour import ContourUtils
+from contour.DataGridder import DataGridder
+
+# Lattice of points with near duplicates
+
+spacing = 100.0
+lx, ly = np.meshgrid(np.arange(20) * spacing + 5.0, np.arange(10) * spacing + 5.0)
+lx = lx.ravel()
+ly = ly.ravel()
+nlattice = len(lx)
+rng = np.random.default_rng(23)
+offset = rng.uniform(-1.0, 1.0, (2, nlattice))
+x = np.concatenate((lx, lx + offset[0]))
+y = np.concatenate((ly, ly + offset[1]))
+
+index = ContourUtils.discardDuplicatePoints(x, y, 10.0)
+check("duplicates discarded", len(index) == nlattice, len(index))
+kept = np.round(np.column_stack((x[index], y[index])) / spacing)
+check("one point each", len(np.unique(kept, axis=0)) == nlattice)
+check(
+    "distinct points kept",
+    len(ContourUtils.discardDuplicatePoints(lx, ly, 10.0)) == nlattice,
+)
+check(
+    "zero tolerance",
+    np.array_equal(ContourUtils.discardDuplicatePoints(x, y, 0.0), np.arange(len(x))),
+)
+
+# Longitude/latitude tolerance in metres, about 0.5 metres offset in
+# longitude and 1 metre in latitude at latitude 60 degrees
+
+lon = 170.0 + lx / 10000.0
+lat = 60.0 + ly / 10000.0
+near = (np.concatenate((lon, lon + 1.0e-5)), np.concatenate((lat, lat + 1.0e-5)))
+index = ContourUtils.discardDuplicatePoints(near[0], near[1], 10.0, True)
+check("lonlat duplicates discarded", len(index) == nlattice, len(index))
+apart = (np.concatenate((lon, lon)), np.concatenate((lat, lat + 3.0e-4)))
+index = ContourUtils.discardDuplicatePoints(apart[0], apart[1], 10.0, True)
+check("lonlat points apart kept", len(index) == 2 * nlattice, len(index))
+
+# DataGridder works on the data without copying it
+
+gx, gy = np.meshgrid(np.linspace(0.0, 100.0, 11), np.linspace(0.0, 50.0, 6))
+gx = gx.ravel()
+gy = gy.ravel()
+original = gx.copy(), gy.copy()
+gridder = DataGridder(gx, gy)
+shape, order = gridder.calcGrid()
+check("grid", tuple(shape) == (6, 11) and order is None, shape)
+check("data not copied", np.shares_memory(gridder._x, gx))
+check(
+    "data not modified",
+    np.array_equal(gx, original[0]) and np.array_equal(gy, original[1]),
+)
+
+# Shuffled grid points are reordered into rows and columns, in either
+# orientation
+
+order = rng.permutation(len(gx))
+shape, gridOrder = DataGridder(gx[order], gy[order]).calcGrid()
+u = gx[order][gridOrder].reshape(shape)
+v = gy[order][gridOrder].reshape(shape)
+rows = np.all(np.ptp(u, axis=0) == 0) and np.all(np.ptp(v, axis=1) == 0)
+columns = np.all(np.ptp(u, axis=1) == 0) and np.all(np.ptp(v, axis=0) == 0)
+check(
+    "shuffled grid",
+    sorted(shape) == [6, 11]
+    and np.array_equal(np.sort(gridOrder), np.arange(len(gx)))
+    and (rows or columns),
+    shape,
+)
+x32 = DataGridder(gx.astype(np.float32), gy)._x
+check("float32 converted", x32.dtype == np.float64)
+
+finish()
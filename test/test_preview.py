@@ -0,0 +1,91 @@
+#!/usr/bin/python3
+"""
+Test ContourGenerator.previewLines.  The preview should be calculated from
+at most maxPoints features without loading the points, from the selected
+features if there is a selection, and from the loaded points once they are
+loaded.  The data are a plane so that the preview lines are exact whatever
+subset of the points is used.  Requires the qgis python module.  Exits with
+status 1 if any test fails.
+"""
+
+import numpy as np
+
+from scripttest import check, finish, pointLayer
+
+from qgis.core import QgsApplication
+
+app = QgsApplication([], False)
+app.initQgis()
+
+from contour.ContourGenerator import ContourGenerator
+
+
+def plane(x, y):
+    return x * 0.1 + y * 0.05
+
+
+def checkPreview(name, generator, levels, npoints):
+    preview = generator.previewLines(npoints)
+    check(
+        name + " levels",
+        [level for level, lines in preview] == levels,
+        [level for level, lines in preview],
+    )
+    for level, lines in preview:
+        points = np.vstack(lines) if lines else np.zeros((0, 2))
+        error = np.abs(plane(points[:, 0], points[:, 1]) - level)
+        check(
+            "{0} level {1}".format(name, level),
+            len(points) > 0 and np.max(error) < 1.0e-6,
+            "{0} points".format(len(points)),
+        )
+
+
+rng = np.random.default_rng(13)
+npt = 5000
+x = rng.uniform(0, 1000, npt)
+y = rng.uniform(0, 1000, npt)
+layer = pointLayer(x, y, plane(x, y))
+levels = [20.0, 50.0, 80.0]
+
+# Preview without loading the points
+
+generator = ContourGenerator(layer, '"z"')
+generator.setContourMethod("manual", {"levels": levels})
+checkPreview("unloaded", generator, levels, 1000)
+check("points not loaded", not generator.dataLoaded())
+trig = generator._previewTrig[1]
+check("preview points", len(trig.x) == 1000, len(trig.x))
+
+# Preview of the selected features
+
+selected = set(range(1, npt + 1, 2))
+generator.setDataSource(layer, '"z"', sourceFids=selected)
+checkPreview("selected", generator, levels, 500)
+check("selected not loaded", not generator.dataLoaded())
+trig = generator._previewTrig[1]
+selectedPoints = set(zip(x[0::2], y[0::2]))
+check(
+    "selected points",
+    len(trig.x) == 500 and all(p in selectedPoints for p in zip(trig.x, trig.y)),
+    len(trig.x),
+)
+
+# Preview from the loaded points
+
+generator.setDataSource(layer, '"z"')
+generator.data()
+checkPreview("loaded", generator, levels, 1000)
+check("preview of loaded points", len(generator._previewTrig[1].x) == 1000)
+
+# Preview of gridded data uses a decimated grid
+
+gx, gy = np.meshgrid(np.linspace(0.0, 1000.0, 101), np.linspace(0.0, 500.0, 51))
+gridLayer = pointLayer(gx.ravel(), gy.ravel(), plane(gx, gy).ravel())
+grid = ContourGenerator(gridLayer, '"z"')
+grid.setContourMethod("manual", {"levels": levels})
+grid.data()
+check("gridded", grid.isGridded())
+checkPreview("grid", grid, levels, 1000)
+
+finish()
@@ -0,0 +1,148 @@
+#!/usr/bin/python3
+"""
+Test ContourProfile.  Nested stages should record exclusive times which
+add up to the total time, repeated stages should accumulate, the memory
+held and allocated by stages should be recorded, and the profile should
+be reported and written as JSON, including to the files named by the
+profiling environment variables.  Exits with status 1 if any test fails.
+"""
+
+import json
+import os
+import pstats
+import tempfile
+import time
+
+import numpy as np
+
+from scripttest import check, finish
+from contour import ContourProfile as cp
+
+
+class Messages:
+    def __init__(self):
+        self.messages = []
+
+    def pushInfo(self, message):
+        self.messages.append(message)
+
+
+def close(value, expected, tolerance=0.03):
+    return abs(value - expected) <= tolerance
+
+
+# Stage times
+
+profile = cp.ContourProfile(traceMemory=False)
+start = time.perf_counter()
+with profile.stage("outer"):
+    time.sleep(0.05)
+    with profile.stage("inner"):
+        time.sleep(0.1)
+    with profile.stage("inner"):
+        time.sleep(0.05)
+total = time.perf_counter() - start
+times = profile.times()
+check("stage names", sorted(times) == ["inner", "outer"], times)
+check("inner accumulated", close(times["inner"], 0.15), times["inner"])
+check("outer exclusive", close(times["outer"], 0.05), times["outer"])
+check("times add up", close(sum(times.values()), total, 1.0e-3), total)
+
+try:
+    with profile.stage("failed"):
+        time.sleep(0.02)
+        raise ValueError("Failed")
+except ValueError:
+    pass
+check("stage with exception", close(profile.times().get("failed", 0.0), 0.02))
+
+# Counters
+
+profile.count("triangles", 10)
+profile.count("triangles", 5)
+profile.count("features")
+check("counter", profile.counter("triangles") == 15)
+check("unset counter", profile.counter("vertices") == 0)
+check("counters", profile.counters() == {"triangles": 15, "features": 1})
+
+# Memory
+
+mb = 1024 * 1024
+a = np.zeros(mb // 8)
+b = np.zeros(mb // 4)
+check("record memory", profile.recordMemory("load", a, None, b) == 3 * mb)
+profile.recordMemory("load", a)
+check("largest memory kept", profile.memory() == {"load": 3 * mb}, profile.memory())
+check("memory not traced", profile.peakMemory() == {})
+
+traced = cp.ContourProfile(traceMemory=True)
+with traced.stage("outer"):
+    with traced.stage("inner"):
+        array = np.ones(4 * mb // 8)
+        del array
+    array = np.ones(mb // 8)
+    del array
+peaks = traced.peakMemory()
+check(
+    "peak memory",
+    peaks.get("inner", 0) >= 4 * mb and peaks.get("outer", 0) >= peaks["inner"],
+    peaks,
+)
+
+# Reporting
+
+messages = Messages()
+profile.report(messages)
+check(
+    "report",
+    "Triangles: 15" in messages.messages
+    and "Contour features: 1" in messages.messages
+    and "load arrays: 3.0 MB" in messages.messages
+    and any(m.startswith("inner: ") for m in messages.messages),
+    messages.messages,
+)
+
+with tempfile.TemporaryDirectory() as tempdir:
+    filename = os.path.join(tempdir, "profile.json")
+    profile.writeJson(filename)
+    with open(filename) as pf:
+        written = json.load(pf)
+    check(
+        "json",
+        written["times"] == profile.times()
+        and written["counters"] == profile.counters()
+        and written["memory"] == profile.memory(),
+    )
+
+    os.environ.pop(cp.ProfileJsonEnv, None)
+    check("json not requested", profile.writeJsonFromEnvironment() is None)
+    envfile = os.path.join(tempdir, "env.json")
+    os.environ[cp.ProfileJsonEnv] = envfile
+    check(
+        "json from environment",
+        profile.writeJsonFromEnvironment() == envfile and os.path.exists(envfile),
+    )
+    del os.environ[cp.ProfileJsonEnv]
+
+    statsfile = os.path.join(tempdir, "contour.prof")
+    os.environ[cp.CProfileEnv] = statsfile
+    with cp.cprofileFromEnvironment() as profiler:
+        sum(range(1000))
+    del os.environ[cp.CProfileEnv]
+    check(
+        "cprofile",
+        profiler is not None and pstats.Stats(statsfile).total_calls > 0,
+    )
+    with cp.cprofileFromEnvironment() as profiler:
+        pass
+    check("cprofile not requested", profiler is None)
+
+# Reset
+
+profile.reset()
+check(
+    "reset",
+    profile.times() == {} and profile.counters() == {} and profile.memory() == {},
+)
+
+finish()
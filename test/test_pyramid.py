@@ -0,0 +1,89 @@
+#!/usr/bin/python3
+"""
+Test the generalisation of contours for a multi-resolution pyramid by
+ContourGeneratorAlgorithm.  Scale lists should be parsed in either plain or
+1:n form and sorted, invalid scales rejected, and each generalised version
+of a contour should add the scale attribute, have no more vertices than the
+version for the previous scale, and stay within the accumulated tolerance
+of the original line.  Requires the qgis python module.  Exits with status
+1 if any test fails.
+"""
+
+import numpy as np
+
+from scripttest import check, finish, pointLayer
+
+from PyQt5.QtCore import QVariant
+from qgis.core import QgsApplication, QgsField
+
+app = QgsApplication([], False)
+app.initQgis()
+
+from contour.ContourGenerator import ContourGenerator
+from contour.ContourGeneratorAlgorithm import (
+    ContourGeneratorAlgorithm,
+    ContourGeneratorAlgorithmError,
+)
+
+algorithm = ContourGeneratorAlgorithm()
+
+# Scales
+
+check(
+    "scales",
+    algorithm._parseScales(" 25000, 1:5000;10000 1:25000 ") == [5000, 10000, 25000],
+)
+check("no scales", algorithm._parseScales("") == [])
+for text in ("0", "-5000", "1:", "large"):
+    try:
+        algorithm._parseScales(text)
+        check("invalid scale '{0}'".format(text), False)
+    except ContourGeneratorAlgorithmError:
+        check("invalid scale '{0}'".format(text), True)
+
+# Generalised features
+
+rng = np.random.default_rng(43)
+npt = 3000
+x = rng.uniform(0, 1000, npt)
+y = rng.uniform(0, 1000, npt)
+z = np.sin(x / 150.0) * np.cos(y / 200.0) * 50.0
+generator = ContourGenerator(pointLayer(x, y, z), '"z"')
+generator.setContourMethod("equal", {"ncontour": 6})
+fields = generator.fields()
+fields.append(QgsField("scale", QVariant.Int, "Int"))
+tolerances = [(5000.0, 2.0), (25000.0, 10.0)]
+
+features = list(generator.contourFeatures())
+check("contours", len(features) > 0, len(features))
+totals = np.zeros(len(tolerances) + 1, dtype=int)
+for feature in features:
+    name = "level {0}".format(feature["label"])
+    scaled = list(algorithm._scaleFeatures(feature, fields, tolerances))
+    check(name + " versions", len(scaled) == len(tolerances), len(scaled))
+    check(
+        name + " attributes",
+        [f.attributes() for f in scaled]
+        == [feature.attributes() + [5000], feature.attributes() + [25000]],
+    )
+    counts = [feature.geometry().constGet().nCoordinates()]
+    counts.extend(f.geometry().constGet().nCoordinates() for f in scaled)
+    check(
+        name + " vertices",
+        all(n1 <= n0 for n0, n1 in zip(counts, counts[1:])),
+        counts,
+    )
+    if len(counts) == len(totals):
+        totals += counts
+    distance = [feature.geometry().hausdorffDistance(f.geometry()) for f in scaled]
+    check(
+        name + " distance",
+        len(distance) == len(tolerances)
+        and all(f.geometry().isMultipart() for f in scaled)
+        and distance[0] <= 2.0 + 1.0e-6
+        and distance[1] <= 12.0 + 1.0e-6,
+        distance,
+    )
+check("generalised", totals[2] < totals[1] < totals[0], totals)
+
+finish()
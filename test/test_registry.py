@@ -0,0 +1,112 @@
+#!/usr/bin/python3
+"""
+Test ContourLayerRegistry.  Contour layers in the project should be indexed
+by contour id and by source layer and attribute, whether they are in the
+project when the registry is created or added later, and removed from the
+index when they are removed from the project.  Layers without contour
+properties should be ignored.  Requires the qgis python module.  Exits with
+status 1 if any test fails.
+"""
+
+from scripttest import check, finish
+
+from qgis.core import QgsApplication, QgsProject, QgsVectorLayer
+
+app = QgsApplication([], False)
+app.initQgis()
+
+from contour.ContourLayerRegistry import ContourLayerRegistry
+
+
+def contourLayer(contourId, mode, source="points", attr="z"):
+    layer = QgsVectorLayer("LineString?field=index:integer", mode, "memory")
+    setProperties(
+        layer,
+        ContourId=contourId,
+        Mode=mode,
+        SourceLayerId=source,
+        SourceLayerAttr=attr,
+    )
+    return layer
+
+
+def setProperties(layer, **properties):
+    for key, value in properties.items():
+        layer.setCustomProperty(ContourLayerRegistry.PropertyPrefix + key, value)
+
+
+def names(layers):
+    return sorted(layer.name() for layer in layers)
+
+
+project = QgsProject()
+existing = contourLayer("a", "lines")
+plain = QgsVectorLayer("Point?field=z:double", "plain", "memory")
+project.addMapLayers([existing, plain])
+
+registry = ContourLayerRegistry(project)
+check("existing layer", names(registry.layers()) == ["lines"])
+check("plain layer", registry.properties(plain) is None)
+
+filled = contourLayer("a", "filled")
+other = contourLayer("b", "layer", attr="depth")
+project.addMapLayers([filled, other])
+check(
+    "added layers",
+    names(registry.layers()) == ["filled", "layer", "lines"],
+    names(registry.layers()),
+)
+check(
+    "by contour id",
+    names(registry.layers({"ContourId": "a"})) == ["filled", "lines"],
+)
+check(
+    "layer set",
+    registry.layerSet("a") == {"lines": existing, "filled": filled},
+)
+check(
+    "by source",
+    names(registry.layers({"SourceLayerId": "points", "SourceLayerAttr": "z"}))
+    == ["filled", "lines"],
+)
+check(
+    "by source and mode",
+    names(
+        registry.layers(
+            {"SourceLayerId": "points", "SourceLayerAttr": "z", "Mode": "filled"}
+        )
+    )
+    == ["filled"],
+)
+check("by other property", names(registry.layers({"Mode": "layer"})) == ["layer"])
+check("properties", registry.properties(other)["SourceLayerAttr"] == "depth")
+
+# Removing a layer
+
+project.removeMapLayer(filled.id())
+check("removed", registry.layerSet("a") == {"lines": existing})
+
+# Properties changed after the layer is added
+
+setProperties(other, ContourId="c")
+check("not updated", names(registry.layers({"ContourId": "b"})) == ["layer"])
+registry.updateLayer(other)
+check(
+    "updated",
+    registry.layerSet("b") == {} and registry.layerSet("c") == {"layer": other},
+)
+
+# Layers which are not in the project
+
+outside = contourLayer("d", "lines")
+check("outside project", registry.properties(outside)["ContourId"] == "d")
+registry.updateLayer(outside)
+check("outside not indexed", registry.layerSet("d") == {})
+
+# Released registry no longer follows the project
+
+registry.release()
+project.addMapLayer(contourLayer("e", "lines"))
+check("released", list(registry.layers()) == [])
+
+finish()
@@ -0,0 +1,82 @@
+#!/usr/bin/python3
+"""
+Test ContourUtils.resampleToGrid.  The grid should cover the extent of the
+triangulation with nodes at multiples of the cell size, values should be
+linearly interpolated (so exact for a plane), nodes outside the
+triangulation should be masked, and the result should not depend on the
+block size.  Exits with status 1 if any test fails.
+"""
+
+import numpy as np
+from matplotlib.path import Path
+
+from scripttest import check, finish
+from contour import ContourUtils
+
+
+def plane(x, y):
+    return 3.0 + 0.2 * x - 0.05 * y
+
+
+rng = np.random.default_rng(37)
+npt = 2000
+x = rng.uniform(2.5, 997.5, npt)
+y = rng.uniform(10.0, 510.0, npt)
+trig = ContourUtils.buildTriangulation(x, y)
+z = plane(x, y)
+cellsize = 25.0
+
+gx, gy, gz = ContourUtils.resampleToGrid(trig, z, cellsize)
+check("shape", gz.shape == (len(gy), len(gx)), gz.shape)
+check(
+    "grid nodes",
+    np.allclose(np.diff(gx), cellsize)
+    and np.allclose(np.diff(gy), cellsize)
+    and np.allclose(np.remainder(gx[0], cellsize), 0.0)
+    and np.allclose(np.remainder(gy[0], cellsize), 0.0),
+    (gx[0], gy[0]),
+)
+check(
+    "grid extent",
+    gx[0] <= np.min(x)
+    and gx[-1] >= np.max(x)
+    and gy[0] <= np.min(y)
+    and gy[-1] >= np.max(y)
+    and gx[-1] - cellsize < np.max(x)
+    and gy[-1] - cellsize < np.max(y),
+)
+
+mx, my = np.meshgrid(gx, gy)
+valid = ~np.ma.getmaskarray(gz)
+error = np.abs(gz[valid] - plane(mx[valid], my[valid]))
+check("interpolated", np.count_nonzero(valid) > 0 and np.max(error) < 1.0e-9)
+
+# Nodes inside an unmasked triangle are valid, and nodes outside the
+# bounding box of the points are masked
+
+triangles = trig.get_masked_triangles()
+inside = np.zeros(mx.shape, dtype=bool)
+nodes = np.column_stack((mx.ravel(), my.ravel()))
+for tri in triangles[::50]:
+    path = Path(np.column_stack((x[tri], y[tri])))
+    inside |= path.contains_points(nodes, radius=-1.0e-6).reshape(mx.shape)
+check("inside valid", np.count_nonzero(inside) > 0 and np.all(valid[inside]))
+outside = (mx < np.min(x)) | (mx > np.max(x)) | (my < np.min(y)) | (my > np.max(y))
+check("outside masked", np.count_nonzero(outside) > 0 and not np.any(valid[outside]))
+
+bx, by, bz = ContourUtils.resampleToGrid(trig, z, cellsize, blocksize=100)
+check(
+    "block size",
+    np.array_equal(bx, gx)
+    and np.array_equal(by, gy)
+    and np.array_equal(np.ma.getmaskarray(bz), np.ma.getmaskarray(gz))
+    and np.allclose(bz[valid], gz[valid], rtol=0.0, atol=1.0e-12),
+)
+
+try:
+    ContourUtils.resampleToGrid(trig, z, 0.0)
+    check("invalid cell size", False)
+except ValueError:
+    check("invalid cell size", True)
+
+finish()
@@ -0,0 +1,95 @@
+#!/usr/bin/python3
+"""
+Test the ContourGenerator scratch directory.  With a scratch directory the
+point arrays should be memory mapped files in a temporary directory within
+it, which is removed by release(), and the contours should be the same as
+from arrays in memory.  Also tests the array helpers _allocate, _take, and
+_resize with and without a scratch directory.  Requires the qgis python
+module.  Exits with status 1 if any test fails.
+"""
+
+import os
+import tempfile
+
+import numpy as np
+
+from scripttest import check, finish, pointLayer
+
+from qgis.core import QgsApplication
+
+app = QgsApplication([], False)
+app.initQgis()
+
+from contour.ContourGenerator import ContourGenerator
+
+
+def lengths(generator):
+    return [f.geometry().length() for f in generator.contourFeatures()]
+
+
+rng = np.random.default_rng(31)
+npt = 2000
+x = rng.uniform(0, 1000, npt)
+y = rng.uniform(0, 1000, npt)
+z = np.sin(x / 150.0) * np.cos(y / 200.0) * 50.0
+layer = pointLayer(x, y, z)
+
+with tempfile.TemporaryDirectory() as scratch:
+
+    # Array helpers
+
+    for directory in (None, scratch):
+        name = "memory mapped" if directory else "in memory"
+        generator = ContourGenerator()
+        generator.setScratchDirectory(directory)
+        values = np.arange(10.0)
+        allocated = generator._allocate(5, np.int64)
+        taken = generator._take(values, np.array([7, 2, 2]))
+        grown = generator._resize(values, 15)
+        shrunk = generator._resize(values, 4)
+        arrays = (allocated, taken, grown, shrunk)
+        check(
+            name + " allocate",
+            allocated.shape == (5,) and allocated.dtype == np.int64,
+        )
+        check(name + " allocate empty", generator._allocate(0).shape == (0,))
+        check(name + " take", np.array_equal(taken, [7.0, 2.0, 2.0]))
+        check(
+            name + " resize",
+            np.array_equal(grown[:10], values)
+            and len(grown) == 15
+            and np.array_equal(shrunk, values[:4]),
+        )
+        check(
+            name + " array type",
+            all(isinstance(a, np.memmap) == bool(directory) for a in arrays),
+        )
+        generator.release()
+
+    check("helpers scratch removed", os.listdir(scratch) == [], os.listdir(scratch))
+
+    # Memory mapped point data
+
+    generator = ContourGenerator(layer, '"z"')
+    generator.setContourMethod("equal", {"ncontour": 6})
+    expected = lengths(generator)
+
+    generator.setScratchDirectory(scratch)
+    check("scratch reloads", not generator.dataLoaded())
+    gx, gy, gz = generator.data()
+    check(
+        "memory mapped data",
+        all(isinstance(a, np.memmap) for a in (gx, gy, gz)),
+    )
+    check(
+        "data values",
+        np.array_equal(gx, x) and np.array_equal(gy, y) and np.array_equal(gz, z),
+    )
+    check("scratch directory", len(os.listdir(scratch)) == 1, os.listdir(scratch))
+    actual = lengths(generator)
+    check("contours", np.allclose(actual, expected, rtol=1.0e-12), len(actual))
+    del gx, gy, gz
+    generator.release()
+    check("scratch removed", os.listdir(scratch) == [], os.listdir(scratch))
+
+finish()
@@ -0,0 +1,280 @@
+#!/usr/bin/python3
+"""
+Test ContourTiles.  Checks the protocol buffer varint and zigzag encoding
+and the vector tile geometry commands, the ContourUtils clipRing and
+simplifyLine functions used to build the tiles, and writes an MBTiles file
+which is read back and decoded.  Exits with status 1 if any test fails.
+"""
+
+import gzip
+import os
+import sqlite3
+import tempfile
+
+import numpy as np
+
+from scripttest import check, finish
+from contour import ContourTiles, ContourUtils
+
+def readVarint(data, i):
+    value = shift = 0
+    while True:
+        byte = data[i]
+        i += 1
+        value |= (byte & 0x7F) << shift
+        shift += 7
+        if byte < 128:
+            return value, i
+
+
+def readMessage(data):
+    # Decode a protocol buffer message as a list of (field, value)
+    i = 0
+    fields = []
+    while i < len(data):
+        key, i = readVarint(data, i)
+        field, wiretype = key >> 3, key & 7
+        if wiretype == 0:
+            value, i = readVarint(data, i)
+        elif wiretype == 1:
+            value = data[i : i + 8]
+            i += 8
+        else:
+            n, i = readVarint(data, i)
+            value = data[i : i + n]
+            i += n
+        fields.append((field, value))
+    return fields
+
+
+def readVarints(data):
+    i = 0
+    values = []
+    while i < len(data):
+        value, i = readVarint(data, i)
+        values.append(value)
+    return values
+
+
+def unzigzag(n):
+    return (n >> 1) ^ -(n & 1)
+
+
+def decodeGeometry(commands):
+    # Returns the parts of a geometry as lists of (x, y) tile coordinates
+    i = 0
+    x = y = 0
+    parts = []
+    while i < len(commands):
+        command = commands[i] & 7
+        count = commands[i] >> 3
+        i += 1
+        if command == 7:
+            continue
+        for k in range(count):
+            x += unzigzag(commands[i])
+            y += unzigzag(commands[i + 1])
+            i += 2
+            if command == 1:
+                parts.append([(x, y)])
+            else:
+                parts[-1].append((x, y))
+    return parts
+
+
+def ringArea(ring):
+    ring = np.asarray(ring, dtype=np.float64)
+    following = np.roll(ring, -1, axis=0)
+    return np.sum(ring[:, 0] * following[:, 1] - following[:, 0] * ring[:, 1]) / 2.0
+
+
+def segmentDistance(points, line):
+    # Distance of each point from the nearest segment of line
+    a = line[:-1]
+    d = line[1:] - a
+    len2 = np.maximum(np.sum(d * d, axis=1), np.finfo(float).tiny)
+    distance = np.full(len(points), np.inf)
+    for i, p in enumerate(points):
+        t = np.clip(np.sum((p - a) * d, axis=1) / len2, 0.0, 1.0)
+        nearest = a + t[:, np.newaxis] * d
+        distance[i] = np.min(np.hypot(*(p - nearest).T))
+    return distance
+
+
+# Protocol buffer encoding
+
+values = [0, 1, 127, 128, 300, 16383, 16384, 2**40]
+encoded = ContourTiles._varints(values)
+check("varint bytes", encoded[:5] == bytes([0, 1, 127, 0x80, 0x01]))
+check("varint 300", ContourTiles._varint(300) == bytes([0xAC, 0x02]))
+check("varint round trip", readVarints(encoded) == values)
+check("varint empty", ContourTiles._varints([]) == b"")
+check(
+    "zigzag",
+    ContourTiles._zigzag([0, -1, 1, -2, 2, -(2**40)]).tolist()
+    == [0, 1, 2, 3, 4, 2**41 - 1],
+)
+
+# Geometry commands
+
+square = np.array([[0, 0], [10, 0], [10, 10], [0, 10]], dtype=np.int64)
+commands = readVarints(ContourTiles.encodeGeometry([square], ContourTiles.GeomPolygon))
+check("polygon commands", commands == [9, 0, 0, 26, 20, 0, 0, 20, 19, 0, 15])
+lines = [square[:2], square[2:] + 5]
+commands = readVarints(ContourTiles.encodeGeometry(lines, ContourTiles.GeomLine))
+check("line commands", commands == [9, 0, 0, 10, 20, 0, 9, 10, 30, 10, 19, 0])
+check(
+    "line decoded",
+    decodeGeometry(commands) == [[(0, 0), (10, 0)], [(15, 15), (5, 15)]],
+)
+check("no parts", ContourTiles.encodeGeometry([], ContourTiles.GeomLine) == b"")
+
+# Ring clipping
+
+bounds = (0.0, 0.0, 10.0, 10.0)
+ring = np.array([[-2.0, -2.0], [12.0, -2.0], [12.0, 12.0], [-2.0, 12.0], [-2.0, -2.0]])
+clipped = ContourUtils.clipRing(ring, bounds)
+check(
+    "ring clipped",
+    clipped is not None
+    and np.isclose(abs(ringArea(clipped[:-1])), 100.0)
+    and np.array_equal(clipped[0], clipped[-1]),
+)
+inside = ring * 0.25 + 5.0
+clipped = ContourUtils.clipRing(inside, bounds)
+check(
+    "ring inside",
+    clipped is not None and np.isclose(ringArea(clipped[:-1]), ringArea(inside[:-1])),
+)
+check("ring outside", ContourUtils.clipRing(ring + 100.0, bounds) is None)
+triangle = np.array([[5.0, 5.0], [15.0, 5.0], [5.0, 15.0], [5.0, 5.0]])
+clipped = ContourUtils.clipRing(triangle, bounds)
+check(
+    "ring corner",
+    clipped is not None and np.isclose(abs(ringArea(clipped[:-1])), 25.0),
+    ringArea(clipped[:-1]) if clipped is not None else None,
+)
+
+# Line simplification
+
+rng = np.random.default_rng(9)
+t = np.linspace(0.0, 10.0, 500)
+line = np.column_stack((t, np.sin(t) + rng.normal(0.0, 0.01, len(t))))
+for tolerance in (0.001, 0.05, 0.5):
+    simple = ContourUtils.simplifyLine(line, tolerance)
+    distance = segmentDistance(line, simple)
+    check(
+        "simplify {0}".format(tolerance),
+        np.array_equal(simple[0], line[0])
+        and np.array_equal(simple[-1], line[-1])
+        and np.max(distance) <= tolerance * (1.0 + 1.0e-9)
+        and len(simple) < len(line),
+        "{0} of {1} points".format(len(simple), len(line)),
+    )
+check("simplify zero", np.array_equal(ContourUtils.simplifyLine(line, 0.0), line))
+simple = ContourUtils.simplifyLine(ring, 1.0)
+check("simplify ring", np.array_equal(simple[0], simple[-1]) and len(simple) == 5)
+
+# MBTiles file
+
+t = np.linspace(0.0, 2.0 * np.pi, 2001)
+radius = 3.0e6
+circle = np.column_stack((radius * np.cos(t), radius * np.sin(t)))
+hole = circle[::-1] / 3.0
+northeast = np.array([[1.0e6, 1.0e6], [2.0e6, 1.5e6], [3.0e6, 1.0e6]])
+
+with tempfile.TemporaryDirectory() as tempdir:
+    filename = os.path.join(tempdir, "contours.mbtiles")
+    writer = ContourTiles.ContourTileWriter(filename, "contours", 0, 4)
+    writer.addLine([northeast], {"index": 1, "elev": 10.5, "label": "10.5"})
+    writer.addPolygon([[circle, hole]], {"index": 2, "label": "band"})
+    ntiles = writer.close()
+    check("tiles written", ntiles > 0, ntiles)
+    check("no temporary file", not os.path.exists(filename + ".tmp"))
+    check("close again", writer.close() == 0)
+
+    db = sqlite3.connect(filename)
+    metadata = dict(db.execute("SELECT name, value FROM metadata").fetchall())
+    bounds = [float(v) for v in metadata["bounds"].split(",")]
+    lon, lat = ContourTiles.mercatorToLonLat([-radius, radius], [-radius, radius])
+    check(
+        "metadata bounds",
+        np.allclose(bounds, [lon[0], lat[0], lon[1], lat[1]], atol=1.0e-3),
+        metadata["bounds"],
+    )
+    check(
+        "metadata zooms", metadata["minzoom"] == "0" and metadata["maxzoom"] == "4"
+    )
+    rows = db.execute("SELECT zoom_level, tile_column, tile_row FROM tiles").fetchall()
+    check("tile count", len(rows) == ntiles)
+    check(
+        "tiles in range",
+        all(0 <= c < (1 << z) and 0 <= r < (1 << z) for z, c, r in rows),
+    )
+    check(
+        "zoom 1 tiles",
+        sorted((c, r) for z, c, r in rows if z == 1)
+        == [(0, 0), (0, 1), (1, 0), (1, 1)],
+    )
+
+    # Decode the single tile at zoom 0
+    (data,) = db.execute("SELECT tile_data FROM tiles WHERE zoom_level=0").fetchone()
+    tile = readMessage(gzip.decompress(data))
+    layer = readMessage(tile[0][1])
+    names = [v.decode() for f, v in layer if f == 1]
+    keys = [v.decode() for f, v in layer if f == 3]
+    features = [dict(readMessage(v)) for f, v in layer if f == 2]
+    check("layer name", names == ["contours"])
+    check("layer keys", keys == ["index", "elev", "label"], keys)
+    check("feature count", len(features) == 2)
+    polygon = [f for f in features if f[3] == ContourTiles.GeomPolygon]
+    check("polygon feature", len(polygon) == 1)
+    if polygon:
+        rings = decodeGeometry(readVarints(polygon[0][4]))
+        areas = [ringArea(r) for r in rings]
+        check(
+            "polygon winding",
+            len(areas) == 2 and areas[0] > 0 and areas[1] < 0,
+            areas,
+        )
+    line = [f for f in features if f[3] == ContourTiles.GeomLine]
+    if line:
+        parts = decodeGeometry(readVarints(line[0][4]))
+        # North east of the origin is in the top right of the tile (y down)
+        check(
+            "line position",
+            len(parts) == 1 and all(x > 2048 and y < 2048 for x, y in parts[0]),
+            parts,
+        )
+    db.close()
+
+    # The line is only in the north east tile at zoom 1, which is in the
+    # top row of tiles, row 1 in MBTiles (TMS) numbering
+    linefile = os.path.join(tempdir, "line.mbtiles")
+    with ContourTiles.ContourTileWriter(linefile, "contours", 1, 1) as writer:
+        writer.addLine([northeast], {"index": 1})
+    db = sqlite3.connect(linefile)
+    rows = db.execute("SELECT tile_column, tile_row FROM tiles").fetchall()
+    db.close()
+    check("TMS row", rows == [(1, 1)], rows)
+
+    # A writer leaving its context on an exception writes nothing
+    discarded = os.path.join(tempdir, "discarded.mbtiles")
+    try:
+        with ContourTiles.ContourTileWriter(discarded, "contours", 0, 2) as writer:
+            writer.addLine([northeast], {"index": 1})
+            raise RuntimeError("Cancelled")
+    except RuntimeError:
+        pass
+    check(
+        "discarded",
+        not os.path.exists(discarded) and not os.path.exists(discarded + ".tmp"),
+    )
+
+    try:
+        ContourTiles.ContourTileWriter(filename, "contours", 5, 2)
+        check("invalid zoom range", False)
+    except ValueError:
+        check("invalid zoom range", True)
+
+finish()